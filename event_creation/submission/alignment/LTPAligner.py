@@ -1,5 +1,6 @@
 import os
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
 from ..log import logger
 import pandas as pd
 
@@ -77,7 +78,7 @@ class LTPAligner:
 
         :return: The updated events structure, now filled with eegfile and eegoffset information.
         """
-        if self.events.shape == () or self.sample_rate is None:
+        if self.events.shape == () or len(self.events) == 0 or self.sample_rate is None:
             logger.warn('Skipping alignment due to there being no events or no EEG parameter info.')
             return self.events
 
@@ -218,31 +219,24 @@ def times_to_offsets(behav_ms, ephys_ms, ev_ms, samplerate, window=100, thresh_m
     :return s_ind: The index of the EEG sample that matches the beginning of the behavioral pulse syncs.
     :return e_ind: The index of the EEG sample that matches the end of the behavioral pulse syncs.
     """
-    s_ind = None
-    e_ind = None
-
     # Determine which range of samples in the ephys computer's pulse log matches the behavioral computer's sync pulse timings
     # Determine which ephys sync pulses correspond to the beginning behavioral sync pulses
-    for i in xrange(len(ephys_ms) - window):
-        s_ind = match_sequence(np.diff(ephys_ms[i:i + window]), np.diff(behav_ms), thresh_ms)
-        if s_ind is not None:
-            start_ephys_vals = ephys_ms[i:i + window]
-            start_behav_vals = behav_ms[s_ind:s_ind + window]
-            break
+    ephys_windows = sliding_windows(np.diff(ephys_ms), window - 1)[:len(ephys_ms) - window]
+    i, s_ind = find_first_match(ephys_windows, np.diff(behav_ms), thresh_ms)
     if s_ind is None:
         raise ValueError("Unable to find a start window.")
+    start_ephys_vals = ephys_ms[i:i + window]
+    start_behav_vals = behav_ms[s_ind:s_ind + window]
 
     # Determine which ephys sync pulses correspond with the ending behavioral sync pulses
-    for i in xrange(len(ephys_ms) - window):
-        e_ind = match_sequence(np.diff(ephys_ms[::-1][i:i + window]), np.diff(behav_ms[::-1]), thresh_ms)
-        if e_ind is not None:
-            e_ind = len(behav_ms) - e_ind - window
-            i = len(ephys_ms) - i - window
-            end_ephys_vals = ephys_ms[i:i + window]
-            end_behav_vals = behav_ms[e_ind:e_ind + window]
-            break
+    ephys_windows = sliding_windows(np.diff(ephys_ms[::-1]), window - 1)[:len(ephys_ms) - window]
+    i, e_ind = find_first_match(ephys_windows, np.diff(behav_ms[::-1]), thresh_ms)
     if e_ind is None:
         raise ValueError("Unable to find an end window.")
+    e_ind = len(behav_ms) - e_ind - window
+    i = len(ephys_ms) - i - window
+    end_ephys_vals = ephys_ms[i:i + window]
+    end_behav_vals = behav_ms[e_ind:e_ind + window]
 
     # Perform a regression on the corresponding behavioral and ephys sync pulse times to enable a conversion between
     # event mstimes and EEG offsets.
@@ -264,12 +258,59 @@ def match_sequence(needle, haystack, maxdiff):
     """
     Look for a matching subsequence in a long sequence.
     """
-    nlen = len(needle)
-    found = False
-    for i in range(len(haystack)-nlen):
-        if np.abs(haystack[i:i+nlen] - needle).max() < maxdiff:
-            found = True
-            break
-    if not found:
-        i = None
-    return i
+    return find_first_match(np.asarray(needle)[None, :], haystack, maxdiff)[1]
+
+
+def find_first_match(needles, haystack, maxdiff):
+    """
+    Finds the first of several needles that matches a subsequence of a long sequence. A needle matches the subsequence
+    starting at index j of the haystack if every element differs from haystack[j:j + len(needle)] by less than maxdiff.
+    Only subsequences starting before len(haystack) - len(needle) are considered.
+
+    Rather than comparing each needle against every subsequence, the subsequences are indexed by their first element.
+    For each needle, only the subsequences whose first element is within maxdiff of the needle's are candidates, and
+    the candidates are narrowed down one element at a time.
+
+    :param needles: A 2D array with one needle per row
+    :param haystack: The sequence to search
+    :param maxdiff: The exclusive bound on the difference between matching elements
+    :return: The index of the first matching needle and the index of the first subsequence it matches, or
+    (None, None) if no needle matches
+    """
+    haystack = np.asarray(haystack)
+    nlen = needles.shape[1]
+    num_starts = len(haystack) - nlen
+    if num_starts <= 0 or nlen == 0:
+        return None, None
+
+    # Candidate starts sorted by their first element. The search bounds are inclusive, so that the exact comparison is
+    # left to the filtering below.
+    order = np.argsort(haystack[:num_starts], kind='mergesort')
+    firsts = haystack[order]
+
+    for i, needle in enumerate(needles):
+        lo = np.searchsorted(firsts, needle[0] - maxdiff, side='left')
+        hi = np.searchsorted(firsts, needle[0] + maxdiff, side='right')
+        starts = np.sort(order[lo:hi])
+        for k in range(nlen):
+            if starts.size == 0:
+                break
+            starts = starts[np.abs(haystack[starts + k] - needle[k]) < maxdiff]
+        if starts.size > 0:
+            return i, starts[0]
+    return None, None
+
+
+def sliding_windows(a, width):
+    """
+    Returns a read-only view of an array in which row i is a[i:i + width].
+
+    :param a: A 1D array
+    :param width: The length of each window
+    :return: A 2D array with len(a) - width + 1 rows
+    """
+    a = np.ascontiguousarray(a)
+    num_windows = max(len(a) - width + 1, 0)
+    windows = as_strided(a, shape=(num_windows, width), strides=(a.strides[0], a.strides[0]))
+    windows.flags.writeable = False
+    return windows
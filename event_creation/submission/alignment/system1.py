@@ -126,11 +126,12 @@ class System1Aligner:
         eeg_diff = np.diff(eeg_pulse_ms)
 
         # We match the beginning and the end separately, then draw a line between them
+        task_index = PulseIntervalIndex(task_diff, cls.ALIGNMENT_THRESHOLD)
         logger.debug('Scanning for start window')
-        task_start_range, eeg_start_range = cls.find_matching_window(eeg_diff, task_diff, True)
+        task_start_range, eeg_start_range = cls.find_matching_window(eeg_diff, task_diff, True, task_index=task_index)
 
         logger.debug('Scanning for end window')
-        task_end_range, eeg_end_range = cls.find_matching_window(eeg_diff, task_diff, False)
+        task_end_range, eeg_end_range = cls.find_matching_window(eeg_diff, task_diff, False, task_index=task_index)
 
         # This whole next part was just for confirming that the fit is good,
         # However, it was never really implemented...
@@ -174,7 +175,7 @@ class System1Aligner:
         return scipy.stats.linregress(x, y)
 
     @classmethod
-    def find_matching_window(cls, eeg_diff, task_diff, from_front=True, alignment_window=None):
+    def find_matching_window(cls, eeg_diff, task_diff, from_front=True, alignment_window=None, task_index=None):
         """
         Finds the window in which the differences between the eeg pulses and the differences between the task pulses
         are the same as one another.
@@ -182,10 +183,13 @@ class System1Aligner:
         :param task_diff: Differences in times between task pulses
         :param from_front: Whether to try to match from the front or the back
         :param alignment_window: How much of a window to attempt to align
+        :param task_index: A PulseIntervalIndex of task_diff, reused across window sizes
         :return: (task start index, task end index), (eeg start index, eeg end index)
         """
         if alignment_window is None:
             alignment_window = cls.STARTING_ALIGNMENT_WINDOW
+        if task_index is None:
+            task_index = PulseIntervalIndex(task_diff, cls.ALIGNMENT_THRESHOLD)
 
         task_start_ind = None
         eeg_start_ind = None
@@ -199,7 +203,8 @@ class System1Aligner:
         for i in range(start_i, end_i, step_i):
             task_start_ind = cls.get_best_offset(eeg_diff[i:i + alignment_window],
                                             task_diff,
-                                            cls.ALIGNMENT_THRESHOLD)
+                                            cls.ALIGNMENT_THRESHOLD,
+                                            task_index)
             # If it finds an offset, we can stop looking
             if task_start_ind:
                 eeg_start_ind = i
@@ -213,27 +218,31 @@ class System1Aligner:
             else:
                 logger.warn('Reducing align window to {}'.format(alignment_window - cls.ALIGNMENT_WINDOW_STEP))
                 return cls.find_matching_window(eeg_diff, task_diff, from_front,
-                                                alignment_window - cls.ALIGNMENT_WINDOW_STEP)
+                                                alignment_window - cls.ALIGNMENT_WINDOW_STEP, task_index)
 
         return (task_start_ind, task_start_ind + alignment_window), \
                (eeg_start_ind, eeg_start_ind + alignment_window)
 
     @staticmethod
-    def get_best_offset(eeg_diff, task_diff, delta):
+    def get_best_offset(eeg_diff, task_diff, delta, task_index=None):
         """
         Finds the index of eeg_diff at which the pattern of differences in task_diff occurs
         :param eeg_diff: differences between samples of received sync pulses
         :param task_diff: differences between ms of sent sync pulses
         :param delta: threshold under which is considered a match for differences in times
+        :param task_index: A PulseIntervalIndex of task_diff with threshold delta. Built if not provided.
         :return:  the offset of eeg_diff at which it begins matching with task_diff
         """
+        if task_index is None:
+            task_index = PulseIntervalIndex(task_diff, delta)
 
-        # Find any differences that match
-        ind = np.where(abs(task_diff - eeg_diff[0]) < delta)
+        # Find any differences that match, leaving room for the rest of the window
+        ind = task_index.positions(eeg_diff[0])
+        ind = ind[ind <= len(task_diff) - len(eeg_diff)]
 
         # For each difference, find the indices that still match
         for i, this_eeg_diff in enumerate(eeg_diff):
-            ind = np.intersect1d(ind, np.where(abs(task_diff-this_eeg_diff) < delta)[0] - i)
+            ind = ind[abs(task_diff[ind + i] - this_eeg_diff) < delta]
             # If there are no indices left, return None
             if len(ind) == 0:
                 return None
@@ -242,3 +251,48 @@ class System1Aligner:
         if len(ind) > 1:
             raise AlignmentError("Multiple matching windows. Lower threshold or increase window.")
         return ind[0]
+
+
+class PulseIntervalIndex(object):
+    """
+    Maps the intervals between task pulses, quantized into bins the width of the matching threshold, to the positions
+    at which they occur. The positions of the intervals matching a given interval are then found by looking up only the
+    neighboring bins, rather than by comparing against every task interval.
+    """
+
+    def __init__(self, task_diff, delta):
+        """
+        :param task_diff: Differences in times between task pulses
+        :param delta: threshold under which is considered a match for differences in times
+        """
+        self.task_diff = np.asarray(task_diff)
+        self.delta = delta
+        bins = self.bin(self.task_diff)
+        order = np.argsort(bins, kind='mergesort')
+        unique_bins, starts = np.unique(bins[order], return_index=True)
+        self.positions_by_bin = dict(zip(unique_bins, np.split(order, starts[1:])))
+        self.matches = {}
+
+    def bin(self, interval):
+        return np.floor(np.asarray(interval) / float(self.delta)).astype(int)
+
+    def positions(self, interval):
+        """
+        :param interval: A difference between pulse times
+        :return: The sorted positions of the task intervals that differ from interval by less than delta
+        """
+        if interval in self.matches:
+            return self.matches[interval]
+        # Matching intervals fall in the neighboring bins. One more bin on each side guards against rounding at the
+        # bin edges.
+        interval_bin = self.bin(interval)
+        candidates = [self.positions_by_bin[b] for b in range(interval_bin - 2, interval_bin + 3)
+                      if b in self.positions_by_bin]
+        if not candidates:
+            matches = np.array([], dtype=int)
+        else:
+            candidates = np.sort(np.concatenate(candidates))
+            matches = candidates[abs(self.task_diff[candidates] - interval) < self.delta]
+        # The same eeg intervals are looked up again for each window size and scan direction
+        self.matches[interval] = matches
+        return matches
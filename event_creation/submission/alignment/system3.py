@@ -8,6 +8,7 @@ import scipy.stats
 
 from ..log import logger
 from ..parsers.system3_log_parser import System3LogParser
+from ..readers.event_log import load_event_log
 from ..exc import AlignmentError
 import itertools
 
@@ -111,7 +112,7 @@ class System3Aligner(object):
 
         for i, event_log in enumerate(self.events_logs):
 
-            event_dict = json.load(open(event_log))['events']
+            event_dict = load_event_log(event_log)['events']
 
             froms = [float(event[from_label]) * 1000. / rate for event in event_dict \
                     if from_label in event and to_label in event and event['event_label'] not in exclude]
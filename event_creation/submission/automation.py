@@ -1,7 +1,8 @@
 import json
 import os
 import copy
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from multiprocessing import Pool
 import traceback
 
 from ptsa.data.readers import JsonIndexReader
@@ -11,7 +12,67 @@ from .pipelines import build_events_pipeline, build_split_pipeline, build_conver
                        build_convert_eeg_pipeline, build_import_montage_pipeline, build_import_localization_pipeline,\
                        build_create_montage_pipeline
 from .log import logger
-from .configuration import paths
+from .configuration import paths, config
+
+
+# The items run by the worker processes of run_by_subject
+_worker_items = None
+
+
+def _init_worker(items):
+    global _worker_items
+    _worker_items = items
+
+
+def _run_worker(args):
+    func, indices = args
+    return indices, [func(_worker_items[i]) for i in indices]
+
+
+def run_by_subject(func, items, subjects, n_workers=None):
+    """
+    Calls func on each of items. Items of the same subject are run one after another, in order, as they share the
+    subject's directories and logs; items of different subjects share nothing but the protocol index (which is only
+    aggregated once all items have been run), so with n_workers > 1 subjects are distributed across a pool of
+    processes.
+
+    Results are yielded as soon as they are available, so that those already yielded are kept if a later item is
+    interrupted. func should catch its own errors: an exception raised by func ends the run of all items.
+
+    :param func: A module-level function, whose return value must be picklable
+    :param items: The items to be run
+    :param subjects: The subject of each item
+    :param n_workers: The number of processes across which subjects are distributed. Defaults to the import_workers
+    config option. With 0 or 1 all items are run in the current process, in order.
+    :return: Generator of (index of item, value returned by func)
+    """
+    n_workers = int(config.import_workers) if n_workers is None else n_workers
+    groups = OrderedDict()
+    for i, subject in enumerate(subjects):
+        groups.setdefault(subject, []).append(i)
+    if n_workers <= 1 or len(groups) <= 1:
+        for i, item in enumerate(items):
+            yield i, func(item)
+        return
+
+    logger.debug('Running imports for {} subjects in {} processes'.format(len(groups), n_workers))
+    pool = Pool(min(n_workers, len(groups)), initializer=_init_worker, initargs=(items,))
+    try:
+        for indices, values in pool.imap_unordered(_run_worker, [(func, indices) for indices in groups.values()]):
+            for i, value in zip(indices, values):
+                yield i, value
+    except:
+        # Including the generator being closed before all items have run
+        pool.terminate()
+        raise
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _run_importer(importer):
+    importer.run()
+    return importer.status()
 
 
 class ImporterCollection(object):
@@ -86,73 +147,26 @@ class ImporterCollection(object):
         return initialization_statuses
 
 
-class Importer(object):
+class ImporterStatus(object):
+    """
+    The initialization, transfer and processing status of an importer, as described in import logs
+    """
 
-
-    CREATE_MONTAGE =  0
-    CONVERT_MONTAGE = 1
-    BUILD_EVENTS = 2
-    BUILD_EPHYS = 3
-    CONVERT_EVENTS = 4
-    CONVERT_EPHYS = 5
-    LOCALIZATION = 6
-    MOVE_WAV = 7
-
-    PIPELINE_BUILDERS = {
-        CREATE_MONTAGE: build_create_montage_pipeline,
-        CONVERT_MONTAGE: build_import_montage_pipeline,
-        LOCALIZATION: build_import_localization_pipeline,
-        BUILD_EVENTS: build_events_pipeline,
-        BUILD_EPHYS: build_split_pipeline,
-        CONVERT_EVENTS: build_convert_events_pipeline,
-        CONVERT_EPHYS: build_convert_eeg_pipeline,
-    }
-    LABELS = {
-        CREATE_MONTAGE: 'Montage Importer',
-        CONVERT_MONTAGE: 'Montage Importer',
-        LOCALIZATION: 'Localization importer',
-        BUILD_EVENTS: 'Events Builder',
-        BUILD_EPHYS: 'Ephys Builder',
-        CONVERT_EVENTS: 'Events Converter',
-        CONVERT_EPHYS: 'Ephys Converter',
-        MOVE_WAV: '.wav Importer'
-    }
-
-    def __init__(self, type, *args, **kwargs):
-        if type not in self.PIPELINE_BUILDERS:
-            raise TransferError("Cannot build importer for type {}".format(type))
-        self.label = self.LABELS[type]
-        self.args = args
+    def __init__(self, label, kwargs):
+        self.label = label
         self.kwargs = kwargs
         self.subject = kwargs['subject']
         self.errors = {'init': None, 'check': None, 'transfer': None, 'processing': None}
         self.tests = []
         self._should_transfer = None
+        self.initialized = False
         self.errored = False
         self.processed = False
         self.transferred = False
         self.traceback = None
-        try:
-            self.pipeline = self.PIPELINE_BUILDERS[type](*args, **kwargs)
-            self.pipeline.importer  = self
-            self.transferer = self.pipeline.transferer
-            self.initialized = True
-        except Exception as e:
-            logger.warn("Encountered exception \"{}\" while initializing: {}".format(e, traceback.format_exc()))
-            self.set_error('init', e)
-            self.pipeline = None
-            self.transferer = None
-            self.initialized = False
-
-    def remove(self):
-        if self.initialized:
-            self.pipeline.on_failure()
 
-    def previous_transfer_type(self):
-        if self.pipeline:
-            return self.pipeline.previous_transfer_type()
-        else:
-            return None
+    def should_transfer(self):
+        return self._should_transfer
 
     def describe_initialization(self):
         if self.initialized:
@@ -237,6 +251,78 @@ class Importer(object):
         self.errored = True
         self.traceback = traceback.format_exc()
 
+
+class Importer(ImporterStatus):
+
+
+    CREATE_MONTAGE =  0
+    CONVERT_MONTAGE = 1
+    BUILD_EVENTS = 2
+    BUILD_EPHYS = 3
+    CONVERT_EVENTS = 4
+    CONVERT_EPHYS = 5
+    LOCALIZATION = 6
+    MOVE_WAV = 7
+
+    PIPELINE_BUILDERS = {
+        CREATE_MONTAGE: build_create_montage_pipeline,
+        CONVERT_MONTAGE: build_import_montage_pipeline,
+        LOCALIZATION: build_import_localization_pipeline,
+        BUILD_EVENTS: build_events_pipeline,
+        BUILD_EPHYS: build_split_pipeline,
+        CONVERT_EVENTS: build_convert_events_pipeline,
+        CONVERT_EPHYS: build_convert_eeg_pipeline,
+    }
+    LABELS = {
+        CREATE_MONTAGE: 'Montage Importer',
+        CONVERT_MONTAGE: 'Montage Importer',
+        LOCALIZATION: 'Localization importer',
+        BUILD_EVENTS: 'Events Builder',
+        BUILD_EPHYS: 'Ephys Builder',
+        CONVERT_EVENTS: 'Events Converter',
+        CONVERT_EPHYS: 'Ephys Converter',
+        MOVE_WAV: '.wav Importer'
+    }
+
+    def __init__(self, type, *args, **kwargs):
+        if type not in self.PIPELINE_BUILDERS:
+            raise TransferError("Cannot build importer for type {}".format(type))
+        super(Importer, self).__init__(self.LABELS[type], kwargs)
+        self.args = args
+        try:
+            self.pipeline = self.PIPELINE_BUILDERS[type](*args, **kwargs)
+            self.pipeline.importer  = self
+            self.transferer = self.pipeline.transferer
+            self.initialized = True
+        except Exception as e:
+            logger.warn("Encountered exception \"{}\" while initializing: {}".format(e, traceback.format_exc()))
+            self.set_error('init', e)
+            self.pipeline = None
+            self.transferer = None
+            self.initialized = False
+
+    def status(self):
+        """
+        :return: A copy of the importer's status without its pipeline, which can be returned from a worker process.
+        Errors are kept as their messages
+        """
+        status = ImporterStatus(self.label, self.kwargs)
+        for name in vars(status):
+            setattr(status, name, copy.copy(getattr(self, name)))
+        status.errors = dict((error_type, error if error is None else str(error))
+                             for error_type, error in self.errors.items())
+        return status
+
+    def remove(self):
+        if self.initialized:
+            self.pipeline.on_failure()
+
+    def previous_transfer_type(self):
+        if self.pipeline:
+            return self.pipeline.previous_transfer_type()
+        else:
+            return None
+
     def should_transfer(self):
         if self.initialized and self._should_transfer is None:
             self.check()
@@ -389,8 +475,10 @@ class Automator(object):
                     self.importers.append(importer)
 
     def run_all_imports(self):
-        for importer in self.importers:
-            importer.run()
+        """ Runs the importers, replacing each with its status once it has run """
+        for i, status in run_by_subject(_run_importer, self.importers,
+                                        [importer.subject for importer in self.importers]):
+            self.importers[i] = status
 
     def sorted_importers(self):
         order = 'initialized', 'errored', '_should_transfer', 'transferred', 'processed', 'subject'
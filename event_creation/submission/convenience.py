@@ -29,7 +29,7 @@ from .exc import MontageError
 from .tasks import CleanDbTask, IndexAggregatorTask
 from .events_tasks import ReportLaunchTask
 from .log import logger
-from .automation import Importer, ImporterCollection
+from .automation import Importer, ImporterCollection, ImporterStatus, run_by_subject
 
 from ptsa.data.readers import JsonIndexReader
 
@@ -470,14 +470,34 @@ def importer_sort_key(importer):
             importer.label)
 
 
+def _run_json_session_import(args):
+    """
+    Runs the import of a single session from a JSON file
+    :return: (success, ImporterCollection of the statuses of the attempted importers)
+    """
+    inputs, do_import, do_convert, force_events, force_eeg = args
+    try:
+        logger.set_subject(inputs['subject'],inputs['protocol'])
+        success, importers = run_session_import(inputs, do_import, do_convert, force_events, force_eeg)
+        return success, ImporterCollection([importer.status() for importer in importers.importers])
+    except Exception as e:
+        logger.error("Failure importing session: message {}".format(e))
+        traceback.print_exc()
+        status = ImporterStatus('Session Importer', inputs)
+        status.set_error('processing', str(e))
+        return False, ImporterCollection([status])
+
+
 def import_sessions_from_json(filename, do_import, do_convert, force_events=False, force_eeg=False):
     successes = []
     failures = []
     interrupted = False
     try:
-        for inputs in session_inputs_from_json(filename):
-            logger.set_subject(inputs['subject'],inputs['protocol'])
-            success, importers = run_session_import(inputs, do_import, do_convert, force_events, force_eeg)
+        all_inputs = list(session_inputs_from_json(filename))
+        results = run_by_subject(_run_json_session_import,
+                                 [(inputs, do_import, do_convert, force_events, force_eeg) for inputs in all_inputs],
+                                 [inputs['subject'] for inputs in all_inputs])
+        for _, (success, importers) in results:
             if success:
                 successes.append(importers)
             else:
@@ -535,7 +555,20 @@ def run_json_import(filename, do_import, do_convert, force_events=False, force_e
         for success in sorted_successes:
             output.write('{}\n\n'.format(success.describe()))
 
-    return sorted_failures
+    return sorted_successes, sorted_failures
+
+
+def aggregate_imported_indexes(importers):
+    """
+    Updates the aggregated index of each protocol with the indexes of the subjects of the given importers
+    :param importers: ImporterCollections of the attempted imports
+    """
+    protocol_subjects = defaultdict(set)
+    for importer in importers:
+        for protocol in importer.kwargs['protocol']:
+            protocol_subjects[protocol].update(importer.kwargs['subject'])
+    for protocol, subjects in protocol_subjects.items():
+        IndexAggregatorTask().run_subjects(subjects, protocol)
 
 
 def get_code_montage(code, protocol='r1'):
@@ -858,15 +891,15 @@ def main():
             import_log = 'json_import' + str(i)
             i += 1
         import_log = import_log + '.log'
-        failures = run_json_import(config.json_file, attempt_import, attempt_convert,
-                                   config.force_events, config.force_eeg, config.force_montage, import_log)
+        successes, failures = run_json_import(config.json_file, attempt_import, attempt_convert,
+                                              config.force_events, config.force_eeg, config.force_montage, import_log)
         if failures:
             print('\n******************\nSummary of failures\n******************\n')
             print('\n\n'.join([failure.describe() for failure in failures]))
         else:
             print('No failures.')
         print("Aggregating indexes. This may take a moment...")
-        IndexAggregatorTask().run()
+        aggregate_imported_indexes(successes + failures)
         print('Log created: {}. Exiting'.format(import_log))
         exit(0)
 
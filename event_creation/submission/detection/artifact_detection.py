@@ -1,23 +1,41 @@
 import os
 import glob
 import numpy as np
+from multiprocessing import Pool, current_process
+from ..configuration import config
 from ..log import logger
 from ..helpers import butter_filt
 
 
+# The detector whose methods are run by the worker processes of ArtifactDetector.map_channels
+_worker_detector = None
+
+
+def _init_worker(detector):
+    global _worker_detector
+    _worker_detector = detector
+
+
+def _run_worker(args):
+    method, method_args = args
+    return getattr(_worker_detector, method)(*method_args)
+
+
 class ArtifactDetector:
     """
     Runs scripts for blink and artifact detection. Parameters differ depending on whether the session was conducted
     using EGI or Biosemi. After detection processes are run, the events structure is filled with artifact data.
     """
 
-    def __init__(self, events, root_names, noreref_dir, reref_dir):
+    def __init__(self, events, root_names, noreref_dir, reref_dir, n_workers=None):
         """
         :param events: The events structure (a recarray) for the session
         :param root_names: A list of the string basenames of the EEG channel files (useful in the event that there were
         multiple recordings made during a single session)
         :param reref_dir: The path to the directory containing rereferenced EEG data for the session
         :param sample_rate: The integer sample rate of the recording (EGI = 500, BioSemi varies)
+        :param n_workers: The number of processes across which channels are distributed. Defaults to the
+        artifact_workers config option. With 0 or 1 all channels are processed in the current process.
         """
         self.events = events
         self.root_names = root_names
@@ -25,6 +43,8 @@ class ArtifactDetector:
         self.reref_dir = reref_dir
         self.basename = root_names[0]  # Used for tracking the basename of the recording currently being processed
         self.known_sys = True
+        self.n_workers = int(config.artifact_workers) if n_workers is None else n_workers
+        self._pool = None
         # These are extensions that should not be interpreted as channel files
         self.non_chans = ['sync', 'DIN1', 'DI15', 'D255', 'Status', 'epoc', 'txt', 'cal*', 'cal+', 'STI 014']
 
@@ -40,9 +60,10 @@ class ArtifactDetector:
             logger.warn('Unable to read EEG parameters file at path ' + eeg_params)
 
         self.ref_chans = {}
-        # Load the common average reference channel for each recording
+        # Map the common average reference channel for each recording. Samples are only read and converted to float
+        # when they are used.
         for name in root_names:
-            self.ref_chans[name] = np.fromfile(os.path.join(self.reref_dir, name + '.ref'), self.data_fmt).astype('float')
+            self.ref_chans[name] = self.open_eeg_file(os.path.join(self.reref_dir, name + '.ref'))
 
         if system == 'EGI':
             self.num_chans = 129
@@ -66,16 +87,50 @@ class ArtifactDetector:
 
         :return: The events structure updated with artifact and blink info.
         """
-        if self.events.shape == () or self.sample_rate is None or not self.known_sys:
+        if self.events.shape == () or len(self.events) == 0 or self.sample_rate is None or not self.known_sys:
             logger.warn('Skipping artifact detection due to there being no events or invalid EEG parameter info.')
         else:
-            for basename in self.root_names:
-                self.basename = basename
-                self.process_eog()
-            if self.basename != '':
-                self.find_bad_events(duration=3200, offset=-200, buff=1000, filtfreq=[[58, 62]])
+            # Daemonic processes (such as the workers of automation.run_by_subject) cannot start pools of their own
+            if self.n_workers > 1 and not current_process().daemon:
+                logger.debug('Running artifact detection in %d processes' % self.n_workers)
+                self._pool = Pool(self.n_workers, initializer=_init_worker, initargs=(self,))
+            try:
+                for basename in self.root_names:
+                    self.basename = basename
+                    self.process_eog()
+                if self.basename != '':
+                    self.find_bad_events(duration=3200, offset=-200, buff=1000, filtfreq=[[58, 62]])
+            except:
+                if self._pool is not None:
+                    self._pool.terminate()
+                raise
+            finally:
+                if self._pool is not None:
+                    self._pool.close()
+                    self._pool.join()
+                    self._pool = None
         return self.events
 
+    def __getstate__(self):
+        # The pool is not sent to the worker processes along with the detector
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        return state
+
+    def map_channels(self, method, args_list):
+        """
+        Calls one of the detector's methods once for each set of arguments. If the detector is running with multiple
+        worker processes, the calls are distributed across them. The methods are run on the workers' copy of the
+        detector, so they must not rely on state that changes after the workers are started.
+
+        :param method: The name of the method to call
+        :param args_list: A list of argument tuples, one per call
+        :return: A list of the values returned by each call, in the order of args_list
+        """
+        if self._pool is None:
+            return [getattr(self, method)(*args) for args in args_list]
+        return self._pool.map(_run_worker, [(method, args) for args in args_list], chunksize=1)
+
     def process_eog(self):
         """
         Locates blinks/artifacts in the EOG channels using find_blinks(), then identifies which artifacts occurred
@@ -85,32 +140,10 @@ class ArtifactDetector:
         event, any blinks occurring up to 3 seconds after the event onset are attached to the event.
         """
         logger.debug('Identifying blinks in the EOG channels...')
-        eeg_path = os.path.join(self.noreref_dir, self.basename)
-
-        # Load and scan the rereferenced eeg data from each EOG channel. If the channel is a binary channel
-        # (represented as a tuple), load both sub-channels and subtract one from the other before searching for blinks.
-        artifact_mask = None
-        for i in range(len(self.eog_chans)):
-            ch = self.eog_chans[i]
-            if isinstance(ch, tuple):
-                logger.debug('Identifying blinks in binary channel ' + str(ch) + '...')
-                eeg1 = np.fromfile(eeg_path + '.' + ch[0], self.data_fmt).astype('float') - self.ref_chans[self.basename]
-                eeg2 = np.fromfile(eeg_path + '.' + ch[1], self.data_fmt).astype('float') - self.ref_chans[self.basename]
-                eeg = eeg1 - eeg2
-            else:
-                logger.debug('Identifying blinks in channel ' + str(ch) + '...')
-                eeg = np.fromfile(eeg_path + '.' + ch, self.data_fmt).astype('float') - self.ref_chans[self.basename]
-
-            # Instantiate artifact_mask once we know how many EEG samples there are. Note that this assumes all channels
-            # have the same number of samples. The artifact_mask will be used to track which events have a blink on each
-            # of the EOG channels. It has one row for each EOG channel and one column for each EEG sample.
-            if artifact_mask is None:
-                artifact_mask = np.empty((len(self.eog_chans), len(eeg)))
-
-            # Find the blinks recorded by each EOG channel and log them in artifact_mask
-            artifact_mask[i] = self.find_blinks(eeg, self.blink_thresh)
-
-            logger.debug('Done.')
+        # The artifact_mask will be used to track which events have a blink on each of the EOG channels. It has one row
+        # for each EOG channel and one column for each EEG sample. Note that this assumes all channels have the same
+        # number of samples.
+        artifact_mask = np.array(self.map_channels('eog_blinks', [(self.basename, ch) for ch in self.eog_chans]))
         logger.debug('Blink identification complete.')
 
         # Get a list of the indices for all samples that contain a blink on any EOG channel
@@ -150,6 +183,42 @@ class ArtifactDetector:
                 continue
         logger.debug('Events successfully updated with artifact information.')
 
+    def open_eeg_file(self, path):
+        """
+        Opens a split EEG channel file as a read-only memory map with the data format of the recording.
+
+        :param path: The path to the channel file
+        :return: A numpy memmap of the file's samples, or an empty array if the file is empty
+        """
+        if os.path.getsize(path) == 0:
+            return np.empty(0, dtype=self.data_fmt)
+        return np.memmap(path, dtype=self.data_fmt, mode='r')
+
+    def eog_blinks(self, basename, ch):
+        """
+        Loads the rereferenced eeg data from an EOG channel and finds the blinks in it. If the channel is a binary
+        channel (represented as a tuple), loads both sub-channels and subtracts one from the other before searching for
+        blinks.
+
+        :param basename: The basename of the recording
+        :param ch: The EOG channel label, or a tuple of two channel labels
+        :return: A numpy array containing one boolean per EEG sample, indicating whether that sample contains a blink.
+        """
+        eeg_path = os.path.join(self.noreref_dir, basename)
+        ref = self.ref_chans[basename].astype('float')
+        if isinstance(ch, tuple):
+            logger.debug('Identifying blinks in binary channel ' + str(ch) + '...')
+            eeg1 = self.open_eeg_file(eeg_path + '.' + ch[0]).astype('float') - ref
+            eeg2 = self.open_eeg_file(eeg_path + '.' + ch[1]).astype('float') - ref
+            eeg = eeg1 - eeg2
+        else:
+            logger.debug('Identifying blinks in channel ' + str(ch) + '...')
+            eeg = self.open_eeg_file(eeg_path + '.' + ch).astype('float') - ref
+
+        blinks = self.find_blinks(eeg, self.blink_thresh)
+        logger.debug('Done.')
+        return blinks
+
     @staticmethod
     def find_blinks(data, thresh):
         """
@@ -203,7 +272,6 @@ class ArtifactDetector:
         :param buff: The number of milliseconds to include as buffers during filtering.
         :param filtfreq: The frequencies on which to filter when lodaing EEG data.
 
-        data: A channels x events x samples matrix of EEG data.
         bad_evchans: A channels x events matrix denoting which channels are bad on each event
         bad_events: An array denoting whether each event has at least one bad channel (1 == bad, 0 == good)
         """
@@ -216,13 +284,14 @@ class ArtifactDetector:
         offset = int(offset * self.sample_rate / 1000)
         buff = int(buff * self.sample_rate / 1000)
 
-        # Create a channels x events_with_eeg x samples matrix containing the samps from each channel during each event
-        logger.debug('Loading reref data for word presentation events...')
-        data = np.zeros((len(all_chans), len(self.events), ev_length), dtype=np.float)
-        data.fill(np.nan)
-        for i in range(len(all_chans)):
-            data[i] = self.get_event_eeg(all_chans[i], self.events, ev_length, offset, buff, filtfreq)
-        logger.debug('Done.')
+        # Get the indices of all word presentation events with eeg data and the channels used for the voltage threshold
+        pres_ev_ind = np.where(np.logical_and(self.events.type == 'WORD', self.events.eegfile != ''))[0]
+        weak = np.array([(chan in self.weak_chans) for chan in all_chans], dtype=bool)
+
+        # Channel data are loaded and filtered once, one channel at a time, so that the full channels x events x samples
+        # matrix is never held in memory. Along with the moments of its samples, each channel keeps only the largest and
+        # smallest sample of each event, which is all that is needed to compare the event against the thresholds.
+        load_args = (ev_length, offset, buff, filtfreq)
 
         try:
             # Load the mean and std deviation if they have already been calculated. This way math events generation can
@@ -234,16 +303,26 @@ class ArtifactDetector:
             assert not np.isnan(avg)
             assert not np.isnan(stddev)
             logger.debug('Loaded average voltage from file.')
+            # The thresholds are known, so the moments of the channels are not needed
+            moment_inds = [[]] * len(all_chans)
         except (IOError, AssertionError):
-            logger.debug('Calculating average voltage...')
-            # Get the indices of all word presentation events with eeg data
-            pres_ev_ind = np.where(np.logical_and(self.events.type == 'WORD', self.events.eegfile != ''))[0]
-            chans_to_use = np.where(np.array([(chan not in self.weak_chans) for chan in all_chans]))[0]
+            # The moments are taken over the samples of non-weak channels during presentation events
+            avg = stddev = None
+            moment_inds = [[] if is_weak else pres_ev_ind for is_weak in weak]
 
+        logger.debug('Loading reref data for all events...')
+        chan_summaries = self.map_channels('channel_summary',
+                                           [(chan, ev_inds) + load_args for chan, ev_inds in zip(all_chans, moment_inds)])
+
+        if avg is None:
+            logger.debug('Calculating average voltage...')
             # Calculate mean and standard deviation across all samples in non-weak channels from all presentation events
-            data_to_use = data[np.ix_(chans_to_use, pres_ev_ind, )]
-            avg = data_to_use.mean()
-            stddev = data_to_use.std()
+            # by merging the running count, mean and sum of squared deviations of each channel
+            count, avg, sq_dev = 0, 0., 0.
+            for moments, _, _ in chan_summaries:
+                count, avg, sq_dev = self.merge_moments((count, avg, sq_dev), moments)
+            stddev = np.sqrt(sq_dev / count) if count > 0 else np.nan
+            avg = avg if count > 0 else np.nan
 
             logger.debug('Saving average voltage...')
             with open(os.path.join(self.reref_dir, 'mean_stddev.txt'), 'w') as f:
@@ -254,13 +333,15 @@ class ArtifactDetector:
         pos_thresh = avg + 4 * stddev
         neg_thresh = avg - 4 * stddev
 
-        # Find artifacts by looking for samples that are greater than 4 standard deviations above or below the mean
+        # Find artifacts by looking for samples that are greater than 4 standard deviations above or below the mean.
+        # Build a matrix of channels x events where entries are True if one or more bad samples occur on a channel
+        # during an event
         logger.debug('Finding artifacts during all events...')
-        data = np.logical_or(data > pos_thresh, data < neg_thresh)
+        bad_evchans = np.zeros((len(all_chans), len(self.events)), dtype=bool)
+        for i, (_, ev_max, ev_min) in enumerate(chan_summaries):
+            bad_evchans[i] = np.logical_or(ev_max > pos_thresh, ev_min < neg_thresh)
+        logger.debug('Done.')
 
-        # Get matrix of channels x events where entries are True if one or more bad samples occur on a channel during
-        # an event
-        bad_evchans = data.any(2)
         # Get an array of booleans denoting whether each event is bad
         bad_events = bad_evchans.any(0)
         # Mark each bad event with a list of the channels containing bad samples during the event
@@ -270,12 +351,57 @@ class ArtifactDetector:
             badEventChannel = all_chans[np.where(bad_evchans[:, i])[0]]
             self.events[i].badEventChannel = np.append(badEventChannel, np.array(['' for x in range(len(self.events[i].badEventChannel) - len(badEventChannel))]))
 
+    def channel_summary(self, chan, ev_inds, ev_length, offset, buff, filtfreq):
+        """
+        Loads the eeg data from a single channel for all events, and summarizes it by the moments of the samples from
+        the given events and the extreme samples of every event. See get_event_eeg for the loading parameters.
+
+        :param chan: The string label of the channel from which data will be loaded.
+        :param ev_inds: The indices of the events whose samples are included in the moments.
+        :return: The (count, mean, sum of squared deviations) of the samples, and arrays of the largest and smallest
+        sample of each event
+        """
+        data = self.get_event_eeg(chan, self.events, ev_length, offset, buff, filtfreq)
+        return self.moments(data[ev_inds]), data.max(1), data.min(1)
+
+    @staticmethod
+    def moments(data):
+        """
+        :param data: An array of samples
+        :return: The (count, mean, sum of squared deviations from the mean) of the samples
+        """
+        if data.size == 0:
+            return 0, 0., 0.
+        mean = data.mean()
+        return data.size, mean, ((data - mean) ** 2).sum()
+
+    @staticmethod
+    def merge_moments(moments1, moments2):
+        """
+        Merges the moments of two sets of samples, as returned by moments(), using the pairwise form of Welford's
+        algorithm. The population standard deviation of the merged samples is sqrt(sum of squared deviations / count).
+
+        :param moments1: The (count, mean, sum of squared deviations) of the first set of samples
+        :param moments2: The (count, mean, sum of squared deviations) of the second set of samples
+        :return: The (count, mean, sum of squared deviations) of both sets together
+        """
+        count1, mean1, sq_dev1 = moments1
+        count2, mean2, sq_dev2 = moments2
+        if count2 == 0:
+            return moments1
+        total = count1 + count2
+        delta = mean2 - mean1
+        mean = mean1 + delta * count2 / total
+        sq_dev = sq_dev1 + sq_dev2 + delta ** 2 * count1 * count2 / total
+        return total, mean, sq_dev
+
     def get_event_eeg(self, chan, events, ev_length, offset, buff, filtfreq):
         """
         Loads the eeg data from a single channel for all events. For each event in the events structure, gets
         {ev_length} samples from channel {chan}, beginning with the sample defined by the event's eegoffset field. Runs
         a first-order bandstop Butterworth filter on the data from each event upon loading to reduce
-        background noise.
+        background noise. The windows of all events are gathered into one events x samples matrix and filtered in a
+        single call along the sample axis, which matches filtering each event separately to floating point precision.
 
         :param chan: The string label of the channel from which data will be loaded.
         :param events: The list of events whose data will be loaded.
@@ -298,15 +424,21 @@ class ArtifactDetector:
         offsets[np.where(offsets < 0)[0]] = 0
         # Create an events x samples matrix to hold the data from all events
         data = np.zeros((len(events), len_with_buffer))
-        # Load each event's data from its reref file, while filtering the data from each event
-        chan_data = None
-        for i in range(len(events)):
-            if events[i].eegfile == '':
+        # Gather the windows of all events recorded in the same file with a single fancy index, then filter them
+        # together. Only the samples inside the windows are read from the channel and reference files. Events without
+        # an eegfile are left as zeros.
+        window = np.arange(len_with_buffer)
+        for eegfile in np.unique(events.eegfile):
+            if eegfile == '':
                 continue
-            if chan_data is None:
-                chan_data = np.fromfile(os.path.join(self.noreref_dir, events[i].eegfile) + '.' + str(chan), self.data_fmt).astype('float') - self.ref_chans[events[i].eegfile]
-            data[i] = chan_data[offsets[i]:offsets[i]+len_with_buffer]
-            # Run a first-order bandstop filter on the data from each event. Typically will be run with a range of 58-62
-            data[i] = butter_filt(data[i], filtfreq, self.sample_rate, filt_type='bandstop', order=1)
+            ev_inds = np.where(events.eegfile == eegfile)[0]
+            samples = offsets[ev_inds, None] + window
+            chan_data = self.open_eeg_file(os.path.join(self.noreref_dir, eegfile) + '.' + str(chan))
+            ref = self.ref_chans[eegfile]
+            data[ev_inds] = np.asarray(chan_data[samples], dtype='float') - np.asarray(ref[samples], dtype='float')
+        # Run a first-order bandstop filter along the samples of every event. Typically will be run with a range of 58-62
+        has_eeg = np.where(events.eegfile != '')[0]
+        if has_eeg.size > 0:
+            data[has_eeg] = butter_filt(data[has_eeg], filtfreq, self.sample_rate, filt_type='bandstop', order=1)
         # Return only the data from the event itself. The buffers are dropped from the beginning and end.
         return data[:, buff:buff + ev_length]
@@ -37,10 +37,11 @@ from .parsers.math_parser import MathSessionLogParser
 from .parsers.hostpc_parsers import FRHostPCLogParser, catFRHostPCLogParser,\
         TiclFRParser
 from .readers.eeg_reader import get_eeg_reader
+from .readers.event_log import load_versions
 from .tasks import PipelineTask
 from .quality.util import get_time_field
 
-from .viewers.recarray import to_json, from_json
+from .viewers.recarray import from_json
 from .log import logger
 from .exc import NoEventsError, ProcessingError,WebAPIError
 import json
@@ -253,8 +254,7 @@ class EventCreationTask(PipelineTask):
         logger.set_label(self.name)
         logger.debug('self._parser_type is %s'%(None if not self._parser_type else str(self._parser_type)))
         if self.r1_sys_num>=3:
-            with open(files['event_log'][0]) as event_log:
-                self._r1_sys_num = json.load(event_log)['versions']['Ramulator'].rpartition('.')[0].replace('.','_')
+            self._r1_sys_num = load_versions(files['event_log'][0])['Ramulator'].rpartition('.')[0].replace('.','_')
 
         parser = self.parser_type(self.protocol, self.subject, self.montage, self.experiment, self.session, files)
         logger.debug('Using %s'%str(self.parser_type))
@@ -300,10 +300,9 @@ class EventCreationTask(PipelineTask):
                     if issubclass(type(aligner), System3Aligner):
                         aligner.apply_eeg_file(events)
 
-        events = parser.clean_events(events) if events.shape != () else events
+        events = parser.clean_events(events) if events.shape != () and len(events) > 0 else events
         self.pipeline.importer.tests.extend(parser.check_event_quality(events,files))
-        self.create_file(self.filename, to_json(events),
-                         '{}_events'.format(self.event_label))
+        self.create_event_files(self.filename, events, '{}_events'.format(self.event_label))
 
 
 class PruneEventsTask(PipelineTask):
@@ -319,8 +318,7 @@ class PruneEventsTask(PipelineTask):
             if len(filtered_events) == 0 or events is None:
                 logger.info('No events for this experiment. If there are subsequent PS4 sessions, do not panic.')
                 raise NoEventsError()
-            filtered_events = to_json(filtered_events)
-            self.create_file(fid, filtered_events, os.path.splitext(os.path.basename(fid))[0])
+            self.create_event_files(fid, filtered_events, os.path.splitext(os.path.basename(fid))[0])
 
 
 class RecognitionFlagTask(PipelineTask):
@@ -392,8 +390,8 @@ class EventCombinationTask(PipelineTask):
         combiner = EventCombiner(events,sort_field=sort_field)
         combined_events = combiner.combine()
 
-        self.create_file('{}_events.json'.format(self.COMBINED_LABEL),
-                         to_json(combined_events), '{}_events'.format(self.COMBINED_LABEL))
+        self.create_event_files('{}_events.json'.format(self.COMBINED_LABEL),
+                                combined_events, '{}_events'.format(self.COMBINED_LABEL))
 
 class MontageLinkerTask(PipelineTask):
     """
@@ -466,8 +464,7 @@ class MatlabEventConversionTask(PipelineTask):
                                         self.original_session, files)
         events = converter.convert()
 
-        self.create_file( self.filename, to_json(events),
-                         '{}_events'.format(self.event_label))
+        self.create_event_files(self.filename, events, '{}_events'.format(self.event_label))
 
 
 class ImportEventsTask(PipelineTask):
@@ -1,6 +1,16 @@
+import errno
 import os
+import tempfile
 from contextlib import contextmanager
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl request that clones a file (FICLONE in linux/fs.h)
+FICLONE = 0x40049409
+
 
 def mkdir(path):
     """Make a new directory with the correct permissions."""
@@ -14,7 +24,8 @@ def makedirs(path, **kwargs):
 
 @contextmanager
 def open_with_perms(filename, mode='r', *args, **kwargs):
-    """Opens a file and sets permissions to ``0o644`` when in write mode.
+    """Opens a file and sets permissions to ``0o644`` when in write mode (text or
+    binary).
 
     Parameters
     ----------
@@ -29,5 +40,57 @@ def open_with_perms(filename, mode='r', *args, **kwargs):
     with open(filename, mode, *args, **kwargs) as f:
         yield f
 
-    if mode == 'w':
+    if mode in ('w', 'wb'):
         os.chmod(filename, 0o644)
+
+
+@contextmanager
+def atomic_open_with_perms(filename, mode='w'):
+    """Opens a temporary file alongside ``filename`` for writing, which
+    replaces ``filename`` (with permissions ``0o644``) only once it has been
+    written without error, so that readers never see a partially written file.
+
+    Parameters
+    ----------
+    filename : str
+    mode : str
+        ``'w'`` or ``'wb'``.
+
+    """
+    directory, basename = os.path.split(os.path.abspath(filename))
+    handle, temp_filename = tempfile.mkstemp(dir=directory, prefix='.{}.'.format(basename))
+    try:
+        with os.fdopen(handle, mode) as f:
+            yield f
+        os.chmod(temp_filename, 0o644)
+        os.rename(temp_filename, filename)
+    except:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
+
+
+def reflink(source, destination):
+    """Creates ``destination`` as a copy-on-write clone of ``source``, sharing its
+    data blocks until either file is modified.
+
+    Raises :class:`IOError` or :class:`OSError` (and leaves no ``destination``)
+    if the filesystem does not support cloning or the files are on different
+    filesystems.
+
+    Parameters
+    ----------
+    source : str
+    destination : str
+
+    """
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "Cloning not supported on this platform", source)
+    with open(source, 'rb') as source_file:
+        try:
+            with open(destination, 'wb') as destination_file:
+                fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+        except (IOError, OSError):
+            if os.path.exists(destination):
+                os.remove(destination)
+            raise
@@ -10,10 +10,87 @@ import pandas as pd
 from ..log import logger
 from ..exc import LogParseError, UnknownExperimentError, EventFieldError
 from ..readers.eeg_reader import read_jacksheet
-from ..viewers.recarray import pformat_rec, to_dict, from_dict
+from ..readers.event_log import iter_events, load_versions
+from ..viewers.recarray import pformat_rec
 from ..exc import NoAnnotationError
 from . import dtypes
 
+
+class EventAccumulator(object):
+    """
+    Growable buffer of events used while parsing a log.
+
+    Events are written into a preallocated recarray whose capacity doubles when it fills, so that adding an event is
+    amortized constant time rather than a copy of every event seen so far (as with repeated calls to np.append).
+    """
+
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self, first_event, capacity=INITIAL_CAPACITY):
+        """
+        constructor
+        :param first_event: The event that seeds the buffer. Its dtype is used for all subsequent events
+        :param capacity: The number of events for which space is initially allocated
+        """
+        self._buffer = np.zeros(max(capacity, 1), dtype=first_event.dtype).view(np.recarray)
+        self._n_events = 0
+        self.extend(first_event)
+
+    def __len__(self):
+        return self._n_events
+
+    def _reserve(self, n_events):
+        """
+        Makes sure that the buffer can hold at least n_events, doubling its capacity as needed
+        :param n_events: The required number of events
+        """
+        capacity = len(self._buffer)
+        if n_events <= capacity:
+            return
+        while capacity < n_events:
+            capacity *= 2
+        new_buffer = np.zeros(capacity, dtype=self._buffer.dtype).view(np.recarray)
+        new_buffer[:self._n_events] = self._buffer[:self._n_events]
+        self._buffer = new_buffer
+
+    def extend(self, new_events):
+        """
+        Adds one or more events to the end of the buffer
+        :param new_events: A single event (0-d recarray) or a recarray of events
+        """
+        new_events = np.atleast_1d(new_events).ravel()
+        n_new = len(new_events)
+        self._reserve(self._n_events + n_new)
+        self._buffer[self._n_events:self._n_events + n_new] = new_events
+        self._n_events += n_new
+
+    @property
+    def events(self):
+        """
+        A view of the events accumulated so far. Modifications to the view modify the accumulated events.
+        """
+        return self._buffer[:self._n_events]
+
+    def replace(self, events):
+        """
+        Replaces the contents of the buffer with the provided events.
+        If events is the view returned from self.events (i.e. it was modified in place), nothing is copied.
+        :param events: The events that should be held by the buffer
+        """
+        current = self.events
+        if (events.shape == current.shape and events.dtype == current.dtype and
+                events.__array_interface__['data'][0] == current.__array_interface__['data'][0] and
+                events.strides == current.strides):
+            return
+        events = np.atleast_1d(events).ravel()
+        if np.may_share_memory(events, self._buffer):
+            events = events.copy()
+        if events.dtype != self._buffer.dtype:
+            self._buffer = np.zeros(len(self._buffer), dtype=events.dtype).view(np.recarray)
+        self._n_events = 0
+        self.extend(events)
+
+
 class BaseLogParser(object):
 
     # Maximum length of stim params
@@ -82,6 +159,7 @@ class BaseLogParser(object):
             self._jacksheet = read_jacksheet(files['jacksheet'])
         else:
             self._jacksheet = None
+        self._reverse_jacksheet = self.reverse_jacksheet(self._jacksheet)
 
         # Try to read annotation files if they are present
         try:
@@ -174,6 +252,20 @@ class BaseLogParser(object):
         dtypes = cls.dtype_from_template(template)
         return np.rec.array(defaults, dtype=dtypes)
 
+    @classmethod
+    def events_from_template(cls, template, n_events):
+        """
+        Creates an array of events out of template of type ( (name1, default1, dtype1), (name2, ...), ...) in a single
+        allocation. Individual events can be filled in place through their 0-d views, events[i, ...]
+        :param template:
+        :param n_events: The number of events to create
+        :return: recarray of n_events events, each set to the defaults of the template
+        """
+        empty_event = cls.event_from_template(template)
+        events = np.empty(n_events, dtype=empty_event.dtype).view(np.recarray)
+        events[:] = empty_event
+        return events
+
     @classmethod
     def dtype_from_template(cls, template):
         """
@@ -201,12 +293,24 @@ class BaseLogParser(object):
         return event
 
     @staticmethod
-    def set_event_stim_params(event, jacksheet, index=0, **params):
+    def reverse_jacksheet(jacksheet):
+        """
+        Returns the mapping of channel name -> channel # for a jacksheet, or None if there is no jacksheet
+        :param jacksheet: Mapping of channel # -> channel name
+        """
+        if jacksheet is None:
+            return None
+        return {v: k for k, v in jacksheet.items()}
+
+    @staticmethod
+    def set_event_stim_params(event, jacksheet, index=0, reverse_jacksheet=None, **params):
         """
         Sets stimulation parameters for a given event, also applying label or number for stimulated contact
         :param event: The event to be modified
         :param jacksheet: Mapping of channel # -> channel name
         :param index: The index of the stimulation parameter (if 2 stims were applied, call once with 0 and once with 1)
+        :param reverse_jacksheet: Mapping of channel name -> channel # for the jacksheet. Built from the jacksheet if
+        not provided.
         :param params: Keyword/value pairs setting individual parameters
         """
 
@@ -218,14 +322,15 @@ class BaseLogParser(object):
             if param in event.stim_params.dtype.names:
                 event.stim_params[index][param] = value
 
+        if reverse_jacksheet is None and ('anode_label' in params or 'cathode_label' in params):
+            reverse_jacksheet = BaseLogParser.reverse_jacksheet(jacksheet)
+
         if 'anode_label' in params and 'anode_number' not in params:
-            reverse_jacksheet = {v: k for k, v in jacksheet.items()}
             event.stim_params[index]['anode_number'] = reverse_jacksheet.get(params['anode_label'].upper(),
                                                                              reverse_jacksheet[params['anode_label']]
                                                                              )
 
         if 'cathode_label' in params and 'cathode_number' not in params:
-            reverse_jacksheet = {v: k for k, v in jacksheet.items()}
             event.stim_params[index]['cathode_number'] = reverse_jacksheet.get(params['cathode_label'].upper(),
                                                                                reverse_jacksheet[params['cathode_label']])
 
@@ -310,7 +415,7 @@ class BaseLogParser(object):
         :return: all events
         """
         # Start with a single empty event
-        events = self._empty_event
+        events = EventAccumulator(self._empty_event)
         # Loop over the contents of the log file
         for raw_event in self._contents:
             this_type = self._get_raw_event_type(raw_event)
@@ -328,17 +433,14 @@ class BaseLogParser(object):
             if not isinstance(new_event, np.recarray) and not (new_event is False):
                 raise Exception('Event not properly provided from log parser for raw event {}'.format(raw_event))
             elif isinstance(new_event, np.recarray):
-                events = np.append(events, new_event)
+                events.extend(new_event)
 
             # Modify existing events if necessary
             if this_type in self._type_to_modify_events:
-                events = self._type_to_modify_events[this_type](events.view(np.recarray))
+                events.replace(self._type_to_modify_events[this_type](events.events))
 
         # Remove first (empty) event
-        if events.ndim > 0:
-            return events[1:]
-        else:
-            return events
+        return events.events[1:].copy()
 
 
 class BaseSessionLogParser(BaseLogParser):
@@ -464,7 +566,7 @@ class BaseSys3LogParser(BaseLogParser):
     def _read_primary_log(self):
         contents = []
         for log in self._primary_log:
-            contents += json.load(codecs.open(log,  encoding='utf-8'))['events']
+            contents.extend(iter_events(log))
         return contents
 
     def event_default(self, event_json):
@@ -590,8 +692,7 @@ class BaseSys3_1LogParser(BaseSessionLogParser):
     def clean_events(self, events):
         # Add in experiment version
         events = super(BaseSys3_1LogParser,self).clean_events(events)
-        with open(self._files['event_log'][0],'r') as event_log:
-            version_info = json.load(event_log)['versions']
+        version_info = load_versions(self._files['event_log'][0])
         events.exp_version = version_info['task']['version']
         return events
 
@@ -882,36 +983,67 @@ class EventCombiner(object):
             return {}
 
 
+    @staticmethod
+    def get_field_default(dtype):
+        """
+        Gets the value given to a field in events that do not have it, as get_default would for a value of that
+        field: -999 for numbers (if it fits in the field), and empty for everything else
+        :param dtype: dtype of the field
+        :return: the default value, or None to leave the field empty
+        """
+        if dtype.kind in 'iuf' and dtype.shape == () and np.can_cast(np.min_scalar_type(-999), dtype):
+            return -999
+        return None
+
+    @classmethod
+    def copy_fields(cls, source, dest):
+        """
+        Copies the fields of source into the fields with the same names in dest, recursing into nested fields.
+        Sub-arrays that are shorter in source than in dest fill the start of the dest sub-array.
+        :param source: structured array
+        :param dest: structured array with the same number of records, and (at least) the fields in source
+        """
+        for name in source.dtype.names:
+            source_field = source[name]
+            dest_field = dest[name]
+            if source_field.shape != dest_field.shape:
+                dest_field = dest_field[(slice(None),) + tuple(slice(0, n) for n in source_field.shape[1:])]
+            if source_field.dtype.names:
+                cls.copy_fields(source_field, dest_field)
+            else:
+                dest_field[...] = source_field
+
     def combine(self):
         """
         Combines the events that were passed into the constructor
         :return: combined events, sorted by the specified sort_field
         """
+        dtypes = self.combine_dtypes([e.dtype for e in self.events])
 
-        # Convert the events to a dictionary
-        all_dict_events = []
+        # Drop the events flagged for removal, as to_dict would
+        all_events = []
         for events in self.events:
             if len(events) == 0:
                 continue
-            dict_events = to_dict(events)
-            # Add fields to each dictionary that don't appear in the other
-            if len(all_dict_events) > 0:
-                keys = [k for k in dict_events[0].keys() if k not in all_dict_events[0].keys()]
-                for key in keys:
-                    default = self.get_default(dict_events[0][key])
-                    for event in all_dict_events:
-                        event[key] = default
-                keys = [k for k in all_dict_events[0].keys() if k not in dict_events[0].keys()]
-                for key in keys:
-                    default = self.get_default(all_dict_events[0][key])
-                    for event in dict_events:
-                        event[key] = default
-            all_dict_events += dict_events
-
-        # Sort them, and return them
-        all_dict_events = sorted(all_dict_events, key=lambda d:d[self.sort_field])
-        dtypes = self.combine_dtypes([e.dtype for e in self.events])
-        return from_dict(all_dict_events,dtypes=dtypes)
+            if '_remove' in events.dtype.names:
+                events = events[events['_remove'] == 0]
+            all_events.append(events)
+
+        combined = np.zeros(sum(len(events) for events in all_events), dtypes)
+        start = 0
+        for events in all_events:
+            these_events = combined[start:start + len(events)]
+            for name in dtypes.names:
+                if name not in events.dtype.names:
+                    default = self.get_field_default(dtypes[name])
+                    if default is not None:
+                        these_events[name] = default
+            self.copy_fields(events, these_events)
+            start += len(events)
+
+        # Sort them (stably, as sorted() did), and return them
+        order = np.argsort(combined[self.sort_field], kind='mergesort')
+        return combined[order].view(np.recarray)
 
     def combine_dtypes(self,dtypes):
         assert len(dtypes)>1
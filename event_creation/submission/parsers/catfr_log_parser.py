@@ -155,7 +155,8 @@ class CatFRSessionLogParser(BaseSessionLogParser):
         self._stim_list = True
         event = self.event_default(split_line)
         event.is_stim = True
-        self.set_event_stim_params(event, jacksheet=self._jacksheet, **self._catfr2_stim_params)
+        self.set_event_stim_params(event, jacksheet=self._jacksheet,
+                                   reverse_jacksheet=self._reverse_jacksheet, **self._catfr2_stim_params)
         return event
 
     def event_instruct_video(self, split_line):
@@ -225,7 +226,8 @@ class CatFRSessionLogParser(BaseSessionLogParser):
         event.serialpos = self._serialpos
         event.is_stim = split_line[6] == 'STIM'
         if event.is_stim & self._is_fr2:
-            self.set_event_stim_params(event, jacksheet=self._jacksheet, **self._catfr2_stim_params)
+            self.set_event_stim_params(event, jacksheet=self._jacksheet,
+                                       reverse_jacksheet=self._reverse_jacksheet, **self._catfr2_stim_params)
         event.category_num = split_line[7]
         event.category = split_line[8]
 
@@ -142,7 +142,8 @@ class FRSessionLogParser(BaseSessionLogParser):
         event = BaseSessionLogParser.event_default(self, split_line)
         if self._is_fr2 and self._fr2_stim_on_time and self._fr2_stim_on_time + self.FR2_STIM_DURATION >= int(split_line[0]):
             event.is_stim = True
-            self.set_event_stim_params(event, jacksheet=self._jacksheet, **self._fr2_stim_params)
+            self.set_event_stim_params(event, jacksheet=self._jacksheet,
+                                       reverse_jacksheet=self._reverse_jacksheet, **self._fr2_stim_params)
 
         event.list = self._list
         event.stim_list = self._stim_list
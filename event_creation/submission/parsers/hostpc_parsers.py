@@ -2,15 +2,91 @@ from event_creation.submission.parsers.base_log_parser import (
     BaseLogParser,BaseSys3_1LogParser,BaseSessionLogParser)
 from event_creation.submission.readers.eeg_reader import read_jacksheet
 from event_creation.submission.parsers.fr_sys3_log_parser import FRSys3LogParser
-import pandas as pd
 import json
 from functools import wraps
 from copy import deepcopy
 import numpy as np
 from event_creation.submission.quality import fr_tests
+from event_creation.submission.configuration import config
 import os
 import dtypes
 from collections import OrderedDict
+from event_creation.submission.readers.event_log import iter_events
+
+class PandasColumns(object):
+    """
+    Reproduces the values of the rows of a DataFrame read from a list of dicts with pandas.DataFrame.from_records, and
+    iterated over with iterrows, without building the DataFrame. The keys are collected from every row with add(),
+    then each row is filled in with fill(), following the rules of pandas:
+      - Every row has every key. Keys missing from a row are NaN there.
+      - A key whose values are all integers keeps them as ints.
+      - A numeric key that is missing from a row, or that has a float or None value in a row, is a float column: its
+        integers become floats, and its Nones NaN.
+      - A key whose values are all None keeps them as None.
+      - Any other key (strings, booleans, containers, or a mix of kinds) keeps its values as they are.
+    """
+
+    def __init__(self):
+        self.n_rows = 0
+        # Key -> [kind of its values, number of rows that have it]. See value_kind for the kinds
+        self.keys = OrderedDict()
+        self._defaults = None
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    @staticmethod
+    def value_kind(value):
+        """
+        :return: int for integers, float for floats, None for None, and False for anything else
+        """
+        if value is None:
+            return None
+        elif isinstance(value, bool) or not isinstance(value, (int, long, float)):
+            return False
+        return float if isinstance(value, float) else int
+
+    @staticmethod
+    def merge_kinds(kind1, kind2):
+        """ Returns the kind of a column with values of both kinds """
+        if kind1 is False or kind2 is False:
+            return False
+        if kind1 is None and kind2 is None:
+            return None
+        if kind1 is int and kind2 is int:
+            return int
+        return float
+
+    def add(self, row):
+        """ Adds the keys and values of a row to the columns """
+        self.n_rows += 1
+        for key, value in row.items():
+            kind = self.value_kind(value)
+            if key in self.keys:
+                self.keys[key][0] = self.merge_kinds(self.keys[key][0], kind)
+                self.keys[key][1] += 1
+            else:
+                self.keys[key] = [kind, 1]
+
+    def kind(self, key):
+        """ Returns the kind of a column, once all rows have been added """
+        kind, count = self.keys[key]
+        # The NaN of the rows without the key makes a numeric column float
+        return self.merge_kinds(kind, float) if count < self.n_rows else kind
+
+    def fill(self, record, row):
+        """
+        Updates record with every key of the columns, set to the values in row as pandas would read them
+        """
+        if self._defaults is None:
+            self._defaults = dict.fromkeys(self.keys, float('nan'))
+            self._float_keys = [key for key in self.keys if self.kind(key) is float]
+        record.update(self._defaults)
+        record.update(row)
+        for key in self._float_keys:
+            value = row.get(key)
+            record[key] = float('nan') if value is None else float(value)
+
 
 def with_offset(event_handler):
     """
@@ -58,6 +134,7 @@ class BaseHostPCLogParser(BaseSessionLogParser):
         self._stim_params = OrderedDict()
         self._set_experiment_config()
         self._jacksheet = read_jacksheet(files['electrode_config'][0])
+        self._reverse_jacksheet = self.reverse_jacksheet(self._jacksheet)
 
     def _read_primary_log(self):
         """
@@ -65,29 +142,71 @@ class BaseHostPCLogParser(BaseSessionLogParser):
         :return: List of dicts, 1 per entry in the log
         """
         if isinstance(self._primary_log,(str,unicode)):
-
-            with open(self._primary_log,'r') as primary_log:
-                contents = pd.DataFrame.from_records(json.load(primary_log)['events']).dropna(subset=['msg_stub']).reset_index()
-                stubs =  pd.DataFrame.from_records([msg for msg in contents.msg_stub])
-                messages = pd.DataFrame.from_records([msg.get('data',{}) for msg in contents.msg_stub])
-
-                contents = pd.concat([contents,stubs,messages],
-                                     axis=1)
-                contents[self._MSTIME_FIELD].fillna(-1,inplace=True)
-                return [e.to_dict() for _, e in contents.iterrows()]
+            return self._records_from_events(self._log_reader(self._primary_log), include_stubs=True)
         elif isinstance(self._primary_log,list):
             all_contents = []
             for log in self._primary_log:
-                with open(log,'r') as primary_log:
-                    contents = pd.DataFrame.from_records(json.load(primary_log)['events']).dropna(
-                        subset=['msg_stub']).reset_index()
-                messages = pd.DataFrame.from_records([msg.get('data', {}) for msg in contents.msg_stub])
-                contents = pd.concat([contents, messages],
-                                     axis=1)
-                contents[self._MSTIME_FIELD].fillna(-1, inplace=True)
-                all_contents.extend([e.to_dict() for _, e in contents.iterrows()])
+                all_contents.extend(self._records_from_events(self._log_reader(log), include_stubs=False))
             return all_contents
 
+    @staticmethod
+    def _log_reader(log):
+        """
+        :param log: Path to event_log.json
+        :return: Function returning a new iterator over the entries of the log. With the stream_event_logs option,
+                 each iterator parses the log incrementally (see readers.event_log.iter_events)
+        """
+        return lambda: iter_events(log, stream=config.stream_event_logs)
+
+    def _records_from_events(self, read_events, include_stubs):
+        """
+        Flattens event log entries into one dict per entry that has a msg_stub. Each dict holds the keys of the entry,
+        an 'index' key with its position in the log, and the keys of msg_stub['data'] (and of msg_stub itself, if
+        include_stubs). Later keys take precedence over earlier ones.
+
+        Values are coerced as pandas does when the entries, msg_stubs and data are read into DataFrames (see
+        PandasColumns). The keys of the entries are collected over all entries of the log, those of msg_stub and data
+        over the entries with a msg_stub. A missing or NaN mstime is set to -1.
+
+        The log is read twice: once to collect the keys and the kinds of their values, then to build the records, so
+        that no more than one entry is held at a time when the log is streamed.
+        :param read_events: Function returning a new iterator over the entries of the log
+        :param include_stubs: Whether to include the keys of msg_stub
+        :return: List of dicts, 1 per entry with a msg_stub
+        """
+        layers = (PandasColumns(), PandasColumns(), PandasColumns())
+        for event in read_events():
+            layers[0].add(event)
+            stub = event.get('msg_stub')
+            if stub is None or stub != stub:
+                continue
+            if include_stubs:
+                layers[1].add(stub)
+            layers[2].add(stub.get('data', {}))
+
+        mstime_layers = [columns for columns in layers if self._MSTIME_FIELD in columns]
+        if not mstime_layers:
+            raise KeyError(self._MSTIME_FIELD)
+        missing_mstime = -1. if mstime_layers[-1].kind(self._MSTIME_FIELD) is float else -1
+        index_name = 'level_0' if 'index' in layers[0] else 'index'
+
+        records = []
+        for index, event in enumerate(read_events()):
+            stub = event.get('msg_stub')
+            if stub is None or stub != stub:
+                continue
+            record = {}
+            layers[0].fill(record, event)
+            record[index_name] = index
+            if include_stubs:
+                layers[1].fill(record, stub)
+            layers[2].fill(record, stub.get('data', {}))
+            mstime = record.get(self._MSTIME_FIELD, -1)
+            if mstime is None or mstime != mstime:
+                record[self._MSTIME_FIELD] = missing_mstime
+            records.append(record)
+        return records
+
     def _set_experiment_config(self):
         config_file = (self.files['experiment_config'][0] if isinstance(self.files['experiment_config'],list)
                        else self.files['experiment_config'])
@@ -124,7 +243,8 @@ class BaseHostPCLogParser(BaseSessionLogParser):
         self._stim_params = self.stim_params_from_record(event_json)
         for i, pair in enumerate(self._stim_params):
             pair_params = self._stim_params[pair]
-            self.set_event_stim_params(event, self._jacksheet, index=i, **pair_params)
+            self.set_event_stim_params(event, self._jacksheet, index=i,
+                                       reverse_jacksheet=self._reverse_jacksheet, **pair_params)
         return event
 
     def stim_params_from_record(self, event_json):
@@ -144,7 +264,8 @@ class BaseHostPCLogParser(BaseSessionLogParser):
     def event_biomarker(self,event_json):
         event=self.event_default(event_json)
         if self._phase == "STIM":
-            self.set_event_stim_params(event,self._jacksheet,0,**event_json['msg_stub'])
+            self.set_event_stim_params(event,self._jacksheet,0,
+                                       reverse_jacksheet=self._reverse_jacksheet, **event_json['msg_stub'])
         return event
 
     def clean_events(self, events):
@@ -410,7 +531,7 @@ class TiclFRParser(FRHostPCLogParser):
             }
             params.update(self._stim_params.values()[0])
             self.set_event_stim_params(event, self._jacksheet, 0,
-                                       **params)
+                                       reverse_jacksheet=self._reverse_jacksheet, **params)
             if params['position'] != 'post':
                 event['phase'] = self._list_phase
             # post-stim biomarker events are assigned the phase of the
@@ -99,6 +99,7 @@ class BaseMatConverter(object):
             self._jacksheet = read_jacksheet(files['jacksheet'])
         else:
             self._jacksheet = None
+        self._reverse_jacksheet = BaseSessionLogParser.reverse_jacksheet(self._jacksheet)
 
     def _add_fields(self, *args):
         """
@@ -491,7 +492,8 @@ class FRMatConverter(BaseMatConverter):
                 'amplitude': mat_event.stimAmp
             }
             params.update(self._fr2_stim_params)
-            BaseSessionLogParser.set_event_stim_params(py_event, self._jacksheet, **params)
+            BaseSessionLogParser.set_event_stim_params(py_event, self._jacksheet,
+                                                       reverse_jacksheet=self._reverse_jacksheet, **params)
 
         if self._experiment == 'FR3':
             raise NotImplementedError
@@ -616,7 +618,8 @@ class YCMatConverter(BaseMatConverter):
 
         stim_params['stim_on'] = mat_event['isStim']
 
-        BaseSessionLogParser.set_event_stim_params(py_event, self._jacksheet, **stim_params)
+        BaseSessionLogParser.set_event_stim_params(py_event, self._jacksheet,
+                                                   reverse_jacksheet=self._reverse_jacksheet, **stim_params)
         return py_event
 
     def convert_fields(self, mat_event, i):
@@ -937,7 +940,8 @@ class CatFRMatConverter(BaseMatConverter):
             }
             params.update(self._catfr2_stim_params)
 
-            BaseSessionLogParser.set_event_stim_params(py_event, self._jacksheet, **params)
+            BaseSessionLogParser.set_event_stim_params(py_event, self._jacksheet,
+                                                       reverse_jacksheet=self._reverse_jacksheet, **params)
 
 
 class PALMatConverter(BaseMatConverter):
@@ -1201,7 +1205,8 @@ class PALMatConverter(BaseMatConverter):
                 }
 
             params.update(self._fr2_stim_params)
-            BaseSessionLogParser.set_event_stim_params(py_event, self._jacksheet, **params)
+            BaseSessionLogParser.set_event_stim_params(py_event, self._jacksheet,
+                                                       reverse_jacksheet=self._reverse_jacksheet, **params)
 
         if self._experiment == 'PAL3':
             raise NotImplementedError
@@ -1322,7 +1327,8 @@ class PSMatConverter(BaseMatConverter):
             'pulse_width': self._PULSE_WIDTH,
             'stim_on': py_event.is_stim
         }
-        BaseSessionLogParser.set_event_stim_params(py_event, self._jacksheet, **params)
+        BaseSessionLogParser.set_event_stim_params(py_event, self._jacksheet,
+                                                   reverse_jacksheet=self._reverse_jacksheet, **params)
 
 
 CONVERTERS = {
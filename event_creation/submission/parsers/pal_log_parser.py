@@ -154,7 +154,8 @@ class PALSessionLogParser(BaseSessionLogParser):
                 self._pal2_stim_on_time + self.PAL2_STIM_DURATION >= event.mstime and \
                 event.mstime >= self._pal2_stim_on_time:
             event.is_stim = True
-            self.set_event_stim_params(event, jacksheet=self._jacksheet, stim_on=True, **self._pal2_stim_params)
+            self.set_event_stim_params(event, jacksheet=self._jacksheet, stim_on=True,
+                                       reverse_jacksheet=self._reverse_jacksheet, **self._pal2_stim_params)
         #elif self._pal2_stim_on_time and \
         #        event.list == self._pal2_stim_list and event.serialpos == self._pal2_stim_serialpos:
         #    item = event.type.item()
@@ -221,7 +222,8 @@ class PALSessionLogParser(BaseSessionLogParser):
         event.study_1 = ''
         event.study_2 = ''
         event.is_stim = True
-        self.set_event_stim_params(event, jacksheet=self._jacksheet, **self._pal2_stim_params)
+        self.set_event_stim_params(event, jacksheet=self._jacksheet,
+                                   reverse_jacksheet=self._reverse_jacksheet, **self._pal2_stim_params)
         return event
 
     def modify_stim_on(self, events):
@@ -294,7 +296,8 @@ class PALSessionLogParser(BaseSessionLogParser):
                 event.is_stim = 0
             elif stimstr =="STIM":
                 event.is_stim = 1
-                self.set_event_stim_params(event, self._jacksheet, **self._pal2_stim_params)
+                self.set_event_stim_params(event, self._jacksheet,
+                                           reverse_jacksheet=self._reverse_jacksheet, **self._pal2_stim_params)
             event.stim_type = self._stim_type
             event.stim_list = self._stim_list
             event.correct = 0
@@ -351,7 +354,8 @@ class PALSessionLogParser(BaseSessionLogParser):
                 event.is_stim = 0
             elif stimstr =="STIM":
                 event.is_stim = 1
-                self.set_event_stim_params(event, self._jacksheet, **self._pal2_stim_params)
+                self.set_event_stim_params(event, self._jacksheet,
+                                           reverse_jacksheet=self._reverse_jacksheet, **self._pal2_stim_params)
         event.stim_type = self._stim_type
         event.stim_list = self._stim_list
         event.correct = 0
@@ -406,7 +410,8 @@ class PALSessionLogParser(BaseSessionLogParser):
             event.is_stim = 0
         elif stimstr =="STIM":
             event.is_stim = 1
-            self.set_event_stim_params(event, self._jacksheet, **self._pal2_stim_params)
+            self.set_event_stim_params(event, self._jacksheet,
+                                       reverse_jacksheet=self._reverse_jacksheet, **self._pal2_stim_params)
         event.stim_type = self._stim_type
         event.stim_list = self._stim_list
 
@@ -613,7 +618,8 @@ class PALSessionLogParser(BaseSessionLogParser):
                     self._pal2_stim_is_retrieval:
                 new_event.is_stim = True
                 stim_on = new_event.mstime - self._pal2_stim_on_time < self.PAL2_STIM_DURATION
-                self.set_event_stim_params(new_event, jacksheet=self._jacksheet, stim_on=stim_on, **self._pal2_stim_params)
+                self.set_event_stim_params(new_event, jacksheet=self._jacksheet, stim_on=stim_on,
+                                           reverse_jacksheet=self._reverse_jacksheet, **self._pal2_stim_params)
 
             events = np.append(events, new_event).view(np.recarray)
 
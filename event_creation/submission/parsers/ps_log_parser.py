@@ -159,7 +159,7 @@ class PSSessionLogParser(BaseSessionLogParser):
         params['stim_duration'] = 1000. * params['n_bursts'] / params['burst_freq']
         params['stim_on'] = True
         self._previous_stim_duration = params['stim_duration'] + params['n_pulses'] * params['pulse_freq']
-        self.set_event_stim_params(event, self._jacksheet, **params)
+        self.set_event_stim_params(event, self._jacksheet, reverse_jacksheet=self._reverse_jacksheet, **params)
         return event
 
     def event_stimulating(self, split_line):
@@ -186,7 +186,7 @@ class PSSessionLogParser(BaseSessionLogParser):
         params['pulse_width'] = self.PULSE_WIDTH
         params['stim_on'] = True
         self._previous_stim_duration = params['stim_duration']
-        self.set_event_stim_params(event, self._jacksheet, **params)
+        self.set_event_stim_params(event, self._jacksheet, reverse_jacksheet=self._reverse_jacksheet, **params)
         return event
 
     def event_stim_single_pulse(self, split_line):
@@ -195,7 +195,7 @@ class PSSessionLogParser(BaseSessionLogParser):
         if not self._stim_anode_label or not self._stim_cathode_label:
             raise LogParseError('Stim occurred prior to defining stim pairs!')
 
-        self.set_event_stim_params(event, self._jacksheet,
+        self.set_event_stim_params(event, self._jacksheet, reverse_jacksheet=self._reverse_jacksheet,
                                    anode_label=self._stim_anode_label,
                                    cathode_label=self._stim_cathode_label,
                                    amplitude=float(split_line[3]),
@@ -1,4 +1,5 @@
 from .base_log_parser import BaseSessionLogParser
+import bisect
 import numpy as np
 from copy import deepcopy
 import re
@@ -40,14 +41,19 @@ class System2LogParser:
 
 
     def __init__(self, host_logs, jacksheet=None):
-        stim_events = self._empty_event()
+        stim_lines = []
         for i, log in enumerate(host_logs):
-            stim_lines = self.get_rows_by_type(log, 'STIM')
-            for line in stim_lines:
-                if len(line) > 4:
-                    stim_events = np.append(stim_events, self.make_stim_event(line, jacksheet))
-                    stim_events[-1].stim_params['file_index'][0] = i
-        self._stim_events = stim_events[1:] if stim_events.shape else stim_events
+            stim_lines.extend((i, line) for line in self.get_rows_by_type(log, 'STIM') if len(line) > 4)
+
+        if stim_lines:
+            # Fill the stim events in place in a single array
+            stim_events = BaseSessionLogParser.events_from_template(self.stim_params_template(), len(stim_lines))
+            for event_index, (i, line) in enumerate(stim_lines):
+                stim_event = self.make_stim_event(line, jacksheet, stim_events[event_index, ...])
+                stim_event.stim_params['file_index'][0] = i
+            self._stim_events = stim_events.view(np.ndarray)
+        else:
+            self._stim_events = self._empty_event()
 
     @classmethod
     def sys2_fields(cls):
@@ -86,12 +92,130 @@ class System2LogParser:
         return events
 
     def merge_events(self, events, event_template, event_to_sort_value, persistent_field_fn):
+        """
+        Merges a STIM_ON (or STIM_SINGLE_PULSE) event for each host stim event, and a STIM_OFF event for each stim with
+        more than one pulse, into the events. Each stim event is inserted after all events at or before its mstime and
+        each STIM_OFF event before all events at or after its own. The new events copy the persistent fields of the
+        event preceding them at the time they are inserted, and events occurring between a STIM_ON and its STIM_OFF are
+        marked as stim events.
+
+        :param events: The task events, normally sorted by mstime
+        :param event_template: The template from which new events are created
+        :param event_to_sort_value: Function mapping stim params to the mstime of the stim
+        :param persistent_field_fn: Function returning the fields of an event that persist into a following stim event
+        :return: The merged events
+        """
 
         merged_events = events[:]
 
         # If no stim events available
         if len(self.stim_events.shape) == 0:
             return merged_events
+
+        if np.all(np.diff(merged_events[self._TASK_SORT_FIELD]) >= 0):
+            merged_events = self._merge_sorted_events(merged_events, event_template, event_to_sort_value,
+                                                      persistent_field_fn)
+        else:
+            merged_events = self._merge_unsorted_events(merged_events, event_template, event_to_sort_value,
+                                                        persistent_field_fn)
+        merged_events = self.mark_stim_items(merged_events)
+        return merged_events
+
+    def _merge_sorted_events(self, events, event_template, event_to_sort_value, persistent_field_fn):
+        """
+        Merges the stim events into events sorted by mstime in a single pass. Since the events stay sorted as stim
+        events are inserted, insertion points are found with searchsorted on the original events. The new events are
+        kept in a short list ordered by a sort key, and the merged array is assembled once at the end.
+
+        The sort key of a new event is (mstime, group, order), where the group places the event before (0) or after (2)
+        the original events (1) with the same mstime. Among new events with the same mstime, the order reproduces the
+        positions they would have had if each had been inserted in turn.
+        """
+        sort_values = events[self._TASK_SORT_FIELD]
+        sort_dtype = events.dtype[self._TASK_SORT_FIELD]
+        events = events.copy()
+        new_keys = []
+        new_events = []
+
+        def sort_key(value, after_equal, order):
+            """
+            Returns the sort key of the order'th new event, placed after all events whose mstime is before value, and
+            if after_equal also after those whose mstime equals value. Comparisons are made against the mstime as
+            stored in the events.
+            """
+            stored_value = np.array(value, dtype=sort_dtype).item()
+            if stored_value < value or (after_equal and stored_value == value):
+                return (stored_value, 2, order)
+            return (stored_value, 0, -order)
+
+        def preceding_event(key):
+            """ Returns the event that precedes an event with the given sort key """
+            orig_index = np.searchsorted(sort_values, key[0], side='left' if key[1] == 0 else 'right') - 1
+            new_index = bisect.bisect_left(new_keys, key) - 1
+            if new_index >= 0 and (orig_index < 0 or new_keys[new_index] > (sort_values[orig_index], 1, orig_index)):
+                return new_events[new_index]
+            if orig_index >= 0:
+                return events[orig_index]
+            return BaseSessionLogParser.event_from_template(event_template)
+
+        def insert_event(key, event):
+            index = bisect.bisect_right(new_keys, key)
+            new_keys.insert(index, key)
+            new_events.insert(index, event)
+
+        for i, stim_event in enumerate(self.stim_events):
+            # Get the mstime for this host event
+            sort_value = event_to_sort_value(stim_event.stim_params)
+            stim_key = sort_key(sort_value, True, i)
+            # Copy the persistent fields from the previous event, modify the remaining fields
+            new_event = self.partial_copy(preceding_event(stim_key), event_template, persistent_field_fn)
+            new_event.type = 'STIM_ON' if stim_event.stim_params['n_pulses'][0] > 1 else 'STIM_SINGLE_PULSE'
+            new_event[self._STIM_ON_FIELD] = True
+            new_event[self._TASK_SORT_FIELD] = sort_value
+            new_event[self._STIM_PARAMS_FIELD] = stim_event.stim_params
+            insert_event(stim_key, new_event)
+
+            if stim_event.stim_params['n_pulses'][0] > 1:
+                # Do the same for the stim_off_event
+                stim_off_sub_event = deepcopy(stim_event.stim_params).view(np.recarray)
+                stim_off_sub_event.stim_on = False
+                stim_off_sub_event.hosttime += stim_off_sub_event.stim_duration
+                stim_off_value = event_to_sort_value(stim_off_sub_event)
+
+                # Modify the events between STIM and STIM_OFF to show that stim was applied
+                modify_events = [events[modify_index] for modify_index in
+                                 range(np.searchsorted(sort_values, sort_value, side='right'),
+                                       np.searchsorted(sort_values, stim_off_value, side='left'))]
+                modify_events += new_events[bisect.bisect_right(new_keys, (sort_value, 3)):
+                                            bisect.bisect_left(new_keys, (stim_off_value, -1))]
+                for modify_event in modify_events:
+                    modify_event[self._STIM_PARAMS_FIELD][0] = stim_event.stim_params[0]
+                    modify_event[self._STIM_ON_FIELD] = True
+
+                # The STIM_OFF event goes after the modified events if any, otherwise directly after the STIM event
+                stim_off_key = sort_key(stim_off_value, False, i)
+                if stim_off_key <= stim_key:
+                    stim_off_key = stim_key + (1,)
+                stim_off_event = self.partial_copy(preceding_event(stim_off_key), event_template, persistent_field_fn)
+                stim_off_event.type = 'STIM_OFF'
+                stim_off_event[self._STIM_ON_FIELD] = False
+                stim_off_event[self._STIM_PARAMS_FIELD] = stim_off_sub_event
+                stim_off_event[self._TASK_SORT_FIELD] = stim_off_value
+                insert_event(stim_off_key, stim_off_event)
+
+        # Assemble the merged events
+        insert_values = np.array([key[0] for key in new_keys], dtype=sort_dtype)
+        insert_before = np.array([key[1] == 0 for key in new_keys], dtype=bool)
+        insert_indices = np.where(insert_before,
+                                  np.searchsorted(sort_values, insert_values, side='left'),
+                                  np.searchsorted(sort_values, insert_values, side='right'))
+        return np.insert(events.view(np.ndarray), insert_indices,
+                         np.concatenate([np.atleast_1d(event) for event in new_events]))
+
+    def _merge_unsorted_events(self, merged_events, event_template, event_to_sort_value, persistent_field_fn):
+        """
+        Merges the stim events into events that are not sorted by mstime, inserting each stim event in turn
+        """
         for i, stim_event in enumerate(self.stim_events):
             # Get the mstime for this host event
             sort_value = event_to_sort_value(stim_event.stim_params)
@@ -126,7 +250,7 @@ class System2LogParser:
 
                 # Modify the events between STIM and STIM_OFF to show that stim was applied
                 for modify_index in modify_indices:
-                    merged_events[modify_index][self._STIM_PARAMS_FIELD][0] = stim_event[0]
+                    merged_events[modify_index][self._STIM_PARAMS_FIELD][0] = stim_event.stim_params[0]
                     merged_events[modify_index][self._STIM_ON_FIELD] = True
 
                 # Insert the STIM_OFF event after the modified events if any, otherwise directly after the STIM event
@@ -140,7 +264,6 @@ class System2LogParser:
                 # Merge the stim off event
                 merged_events = np.append(merged_events[:insert_index],
                                           np.append(stim_off_event, merged_events[insert_index:]))
-        merged_events = self.mark_stim_items(merged_events)
         return merged_events
 
     @staticmethod
@@ -158,8 +281,15 @@ class System2LogParser:
         return round(duration_sec*1000, -1)
 
     @classmethod
-    def make_stim_event(cls, row, jacksheet=None):
-        stim_event = cls._empty_event()
+    def make_stim_event(cls, row, jacksheet=None, stim_event=None):
+        """
+        :param row: A STIM line of the host log, split on '~'
+        :param jacksheet: Mapping of channel # -> channel name
+        :param stim_event: An empty stim event to fill in. Created if not provided.
+        :return: The stim event
+        """
+        if stim_event is None:
+            stim_event = cls._empty_event()
         stim_params = {}
         stim_params['hosttime'] = int(row[0])
         for item in row:
@@ -6,6 +6,7 @@ import re
 from .base_log_parser import BaseLogParser, BaseSys3LogParser
 from .electrode_config_parser import ElectrodeConfig
 from ..log import logger
+from ..readers.event_log import iter_events
 
 
 class System3LogParser(object):
@@ -61,26 +62,28 @@ class System3LogParser(object):
         self.source_time_field = self.SOURCE_TIME_FIELD
         self.source_time_multiplier = self.SOURCE_TIME_MULTIPLIER
 
-        stim_events = self._empty_event()
+        stim_dicts = []
         for i, (log, electrode_config_file) in enumerate(zip(event_logs, electrode_config_files)):
             electrode_config = ElectrodeConfig(electrode_config_file)
+            jacksheet = electrode_config.as_jacksheet()
 
             # This is necessary because v3.1.7 stores Odin status messages as
             # events and improperly doesn't have the right key. In later
             # verisons, this is fixed to store Odin status messages elsewhere.
-            event_dict = [event for event in json.load(open(log))['events'] if self._LABEL_FIELD in event]
-
-            stim_dicts = [event for event in event_dict if event[self._LABEL_FIELD] == self._STIM_LABEL]
-
-            for event_json in stim_dicts:
-                new_event = self.make_stim_event(event_json, electrode_config)
-                stim_events = np.append(stim_events, new_event)
-
-        self._stim_events = stim_events[1:] if stim_events.shape else stim_events
-
-        if stim_events.shape:
-            logger.info("Found {} stim events".format(stim_events.shape))
+            event_dict = [event for event in iter_events(log) if self._LABEL_FIELD in event]
+
+            stim_dicts.extend((event_json, electrode_config, jacksheet) for event_json in event_dict
+                              if event_json[self._LABEL_FIELD] == self._STIM_LABEL)
+
+        if stim_dicts:
+            # Fill the stim events in place in a single array
+            stim_events = BaseLogParser.events_from_template(self.stim_params_template(), len(stim_dicts))
+            for i, (event_json, electrode_config, jacksheet) in enumerate(stim_dicts):
+                self.make_stim_event(event_json, electrode_config, stim_events[i, ...], jacksheet)
+            self._stim_events = stim_events.view(np.ndarray)
+            logger.info("Found {} stim events".format(self._stim_events.shape))
         else:
+            self._stim_events = self._empty_event()
             logger.warn("Found no stim events")
 
     @property
@@ -211,8 +214,18 @@ class System3LogParser(object):
     def get_n_pulses(params):
         return params['pulse_freq'] * params['stim_duration'] / (1000 * 1000)
 
-    def make_stim_event(self, stim_dict, electrode_config):
-        stim_event = self._empty_event()
+    def make_stim_event(self, stim_dict, electrode_config, stim_event=None, jacksheet=None):
+        """
+        :param stim_dict: The STIM entry of the event log
+        :param electrode_config: The ElectrodeConfig of the session
+        :param stim_event: An empty stim event to fill in. Created if not provided.
+        :param jacksheet: The jacksheet of electrode_config. Created if not provided.
+        :return: The stim event
+        """
+        if stim_event is None:
+            stim_event = self._empty_event()
+        if jacksheet is None:
+            jacksheet = electrode_config.as_jacksheet()
         stim_params = {}
         stim_params['host_time'] = stim_dict[self.source_time_field] * self.source_time_multiplier
         if 'stim_channels' in stim_dict[self._STIM_PARAMS_FIELD]:
@@ -226,7 +239,7 @@ class System3LogParser(object):
                 stim_channel = electrode_config.stim_channels[channel]
                 anode_numbers = stim_channel.anodes[0] if len(stim_channel.anodes)==1 else -1
                 cathode_numbers = stim_channel.cathodes[0] if len(stim_channel.cathodes)==1 else -1
-                BaseLogParser.set_event_stim_params(stim_event,electrode_config.as_jacksheet(),i,
+                BaseLogParser.set_event_stim_params(stim_event,jacksheet,i,
                                                     anode_number=anode_numbers,
                                                     cathode_number=cathode_numbers,
                                                     **stim_params)
@@ -246,7 +259,7 @@ class System3LogParser(object):
             cathode_numbers = stim_channels.cathodes
 
             for i, (anode_num, cathode_num) in enumerate(zip(anode_numbers, cathode_numbers)):
-                BaseLogParser.set_event_stim_params(stim_event, electrode_config.as_jacksheet(), i,
+                BaseLogParser.set_event_stim_params(stim_event, jacksheet, i,
                                                     anode_number=anode_num,
                                                     cathode_number=cathode_num,
                                                     **stim_params)
@@ -18,6 +18,7 @@ from .parsers.math_parser import MathLogParser
 from .parsers.ltpfr2_log_parser import LTPFR2SessionLogParser
 from .parsers.ltpfr_log_parser import LTPFRSessionLogParser
 from .parsers.mat_converter import MathMatConverter
+from .readers import event_log
 from .transfer_config import TransferConfig
 from .tasks import ImportJsonMontageTask, CleanLeafTask
 from .transferer import generate_ephys_transferer, generate_session_transferer, generate_localization_transferer,\
@@ -287,6 +288,9 @@ class TransferPipeline(object):
         except Exception as e:
             self.on_failure()
             raise
+        finally:
+            # Event logs read by this pipeline's parsers are not needed by later pipelines
+            event_log.clear_cache()
 
 
 def build_split_pipeline(subject, montage, experiment, session, protocol='r1', groups=tuple(), code=None,
@@ -8,6 +8,7 @@ import os
 import re
 import numpy as np
 import json
+from multiprocessing.pool import ThreadPool
 from shutil import copy
 from scipy.linalg import pinv
 
@@ -20,11 +21,89 @@ except ImportError:
     warnings.warn("pyEDFlib not available")
 
 from .. import fileutil
+from ..configuration import config
 from ..log import logger
 from .nsx_utility.brpylib import NsxFile
 from ..exc import EEGError
 from ..parsers.electrode_config_parser import ElectrodeConfig
 
+class ChannelWriter(object):
+    """
+    Writes split channel data to files on a pool of threads, so that writes to (latency-bound) network storage
+    overlap with each other and with reading the next channel.
+
+    The first write to a file truncates it, and subsequent writes to the same file append to it in the order in which
+    they were submitted. Use as a context manager, or call close() to wait for all writes to finish.
+    """
+
+    def __init__(self, n_threads=1, fsync=False):
+        """
+        constructor
+        :param n_threads: Number of threads on which to write. If 1, data is written immediately in the calling thread
+        :param fsync: If true, files are fsync'd before being closed, so that all data is on disk once close() returns
+        """
+        self._pool = ThreadPool(n_threads) if n_threads > 1 else None
+        self._fsync = fsync
+        self._files = {}
+        self._pending = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *_):
+        self.close(wait=exc_type is None)
+
+    def _write(self, filename, data):
+        if filename not in self._files:
+            self._files[filename] = open(filename, 'wb')
+        data.tofile(self._files[filename])
+
+    def write(self, filename, data):
+        """
+        Writes (or appends) data to the file
+        :param filename: The file to write
+        :param data: np.ndarray to be written in binary form
+        """
+        if self._pool is None:
+            self._write(filename, data)
+            return
+        # Wait for any previous write to this file so writes are applied in order
+        if filename in self._pending:
+            self._pending.pop(filename).get()
+        self._pending[filename] = self._pool.apply_async(self._write, (filename, data))
+
+    def wait(self):
+        """
+        Blocks until all submitted writes have completed, re-raising any error that occurred while writing
+        """
+        pending, self._pending = self._pending, {}
+        for result in pending.values():
+            result.get()
+
+    def close(self, wait=True):
+        """
+        Waits for all writes to finish (optionally syncing them to disk) and closes all files
+        :param wait: If false, outstanding writes are abandoned (e.g. if splitting has already failed)
+        """
+        try:
+            if wait:
+                self.wait()
+                for channel_file in self._files.values():
+                    channel_file.flush()
+                    if self._fsync:
+                        os.fsync(channel_file.fileno())
+        finally:
+            if self._pool is not None:
+                if wait:
+                    self._pool.close()
+                else:
+                    self._pool.terminate()
+                self._pool.join()
+            for channel_file in self._files.values():
+                channel_file.close()
+            self._files = {}
+
+
 class EEG_reader(object):
 
     DATA_FORMAT = 'int16'
@@ -32,6 +111,9 @@ class EEG_reader(object):
     STRFTIME = '%d%b%y_%H%M'
     MAX_CHANNELS = 256
 
+    # Number of samples read at a time by readers that split recordings in blocks
+    SPLIT_BLOCK_SAMPLES = 2 ** 16
+
     EPOCH = datetime.datetime.utcfromtimestamp(0)
 
     def get_start_time(self):
@@ -84,6 +166,13 @@ class EEG_reader(object):
     def _split_data(self, location, basename):
         return NotImplementedError
 
+    def channel_writer(self):
+        """
+        :return: A ChannelWriter through which split channel files should be written, on the number of threads given by
+                 the split_writer_threads option, and fsync'd if fsync_split_files is set
+        """
+        return ChannelWriter(int(config.split_writer_threads), config.fsync_split_files)
+
 
     def get_matching_jacksheet_dict_label(self, label, jacksheet_dict, channel_map):
         if label in channel_map:
@@ -118,6 +207,7 @@ class HD5_reader(EEG_reader):
         self.start_datetime = None
         self.num_samples = None
         self._h5file = None
+        self._transform = None
 
     @property
     def h5file(self):
@@ -162,21 +252,41 @@ class HD5_reader(EEG_reader):
         else:
             super(HD5_reader, self).write_sources(location,basename+'.h5')
 
+    def read_time_series(self, start, stop):
+        """
+        Reads a range of samples from the timeseries, applying the bipolar to monopolar transform if present
+        :param start: First sample to read
+        :param stop: Sample after the last sample to read
+        :return: np.ndarray of shape (channels, samples)
+        """
+        timeseries = self.h5file.root.timeseries
+        if self.by_row:
+            time_series = timeseries[start:stop, :].T
+        else:
+            time_series = timeseries[:, start:stop]
+        if 'bipolar_to_monopolar_matrix' in self.h5file.root:
+            if self._transform is None:
+                self._transform = self.h5file.root.bipolar_to_monopolar_matrix.read()
+            time_series = np.dot(self._transform, time_series).astype(self.DATA_FORMAT)
+        return time_series
+
     def _split_data(self, location, basename):
         if self.should_split:
-            time_series = self.h5file.get_node('/','timeseries').read()
-            if self.by_row:
-                time_series = time_series.T
-            if 'bipolar_to_monopolar_matrix' in self.h5file.root:
-                transform = self.h5file.root.bipolar_to_monopolar_matrix.read()
-                time_series = np.dot(transform,time_series).astype(self.DATA_FORMAT)
-            ports = self.h5file.root.ports
+            ports = self.h5file.root.ports[:]
+            names = self.h5file.root.names[:]
+            filenames = [os.path.join(location, basename + ('.%03d' % port)) for port in ports]
+            n_samples = self.get_n_samples()
             for i, port in enumerate(ports):
-                filename = os.path.join(location, basename + ('.%03d' % port))
-                data = time_series[i]
-                logger.debug("Writing channel {} ({})".format(self.h5file.root.names[i], port))
-                logger.debug('len(data):%s'%len(data))
-                data.tofile(filename)
+                logger.debug("Writing channel {} ({})".format(names[i], port))
+            logger.debug('len(data):%s' % n_samples)
+            with self.channel_writer() as writer:
+                # Read, transform and write SPLIT_BLOCK_SAMPLES samples at a time so that memory usage does not
+                # depend on the length of the session
+                for start in range(0, n_samples, self.SPLIT_BLOCK_SAMPLES):
+                    time_series = self.read_time_series(start, start + self.SPLIT_BLOCK_SAMPLES)
+                    for i, filename in enumerate(filenames):
+                        writer.write(filename, time_series[i])
+                    writer.wait()
         else:
             filename= os.path.join(location,basename+'.h5')
             logger.debug('Moving HD5 file')
@@ -185,6 +295,9 @@ class HD5_reader(EEG_reader):
 
 class NK_reader(EEG_reader):
 
+    # If true, data is split by reading blocks of SPLIT_BLOCK_SAMPLES samples rather than the entire recording at once
+    STREAM_SPLIT = True
+
     def __init__(self, nk_filename, jacksheet_filename=None, channel_map_filename=None):
         self.raw_filename = nk_filename
         if jacksheet_filename:
@@ -200,7 +313,7 @@ class NK_reader(EEG_reader):
         self.sample_rate = None
         self.start_datetime = None
         self.num_samples = None
-        self._data = None
+        self._waveform = None
 
     def get_source_file(self):
         return self.raw_filename
@@ -337,248 +450,300 @@ class NK_reader(EEG_reader):
 
         return {i+1:c[0] for i,c in enumerate(channels)}
 
-    def get_data(self, jacksheet_dict, channel_map):
-        eeg_file = self.raw_filename
-        elec_file = os.path.splitext(eeg_file)[0] + '.21E'
+    def _read_header(self, f, jacksheet_dict):
+        """
+        Reads the header of an open .EEG file, leaving the file positioned at the start of the waveform data
+        :param f: The .EEG file, opened in binary mode
+        :param jacksheet_dict: Mapping of channel label -> jacksheet number
+        :return: (number of recorded channels,
+                  index into the filtered jacksheet numbers for each recorded channel (-1 if unused),
+                  filtered jacksheet numbers,
+                  AD offset at 0V)
+        """
+        elec_file = os.path.splitext(self.raw_filename)[0] + '.21E'
+        # Skipping device block
+        deviceBlockLen = 128
+        f.seek(deviceBlockLen)
+
+        # Reading EEG1 control block
+        _ = f.read(1)  # block ID
+        device_type = self.char_(f, 16)  # Device type
+        new_format = device_type[:9] == 'EEG-1200A'
+        number_of_blocks = self.uint8(f)
+        if number_of_blocks > 1:
+            raise EEGError('%s EEG2 Control blocks detected' % number_of_blocks)
+        block_address = self.int32(f)
+        _ = f.read(16)  # EEG control block name
+
+        # Reading EEG2 Control block
+        f.seek(block_address, 0)
+        _ = f.read(1)  # Block ID
+        _ = f.read(16)  # Data format
+        number_of_blocks = self.uint8(f)
+        if number_of_blocks > 1:
+            raise EEGError('%d waveform blocks detected' % number_of_blocks)
+        block_address = self.int32(f)
+        _ = f.read(16)  # Name of waveform block
+
+        # Reading waveform block
+        f.seek(block_address, 0)
+        _ = f.read(1)  # Block ID
+        _ = f.read(16)  # Data format
+        _ = f.read(1)  # Data type
+        L = self.uint8(f)  # Byte length of one data
+        M = self.uint8(f)  # Mark/event flag
+
+        T_year = self.uint8(f)
+        T_month = self.uint8(f)
+        T_day = self.uint8(f)
+        T_hour = self.uint8(f)
+        T_minute = self.uint8(f)
+        T_second = self.uint8(f)
+
+        logger.debug('Date of session: %d/%d/%d\n' % (T_month, T_day, T_year))
+        logger.debug('Time of start: %02d:%02d:%02d\n' % (T_hour, T_minute, T_second))
+
+        sample_rate = self.uint16(f)
+        sample_rate_conversion = {
+            int('C064', 16): 100,
+            int('C068', 16): 200,
+            int('C068', 16): 500,
+            int('C3E8', 16): 1000,
+            int('C7D0', 16): 2000,
+            int('D388', 16): 5000,
+            int('E710', 16): 10000
+        }
 
-        with open(eeg_file, 'rb') as f:
-            # Skipping device block
-            deviceBlockLen = 128
-            f.seek(deviceBlockLen)
+        if sample_rate in sample_rate_conversion:
+            actual_sample_rate = sample_rate_conversion[sample_rate]
+            self.sample_rate = actual_sample_rate
+        else:
+            raise EEGError('Unknown sample rate')
+
+        num_100_ms_blocks = self.uint32(f)
+        logger.debug('Length of session: %2.2f hours\n' % (num_100_ms_blocks / 10. / 3600.))
+        num_samples = actual_sample_rate * num_100_ms_blocks / 10.
+        self.num_samples = num_samples
+        ad_off = self.int16(f)
+        ad_val = self.uint16(f)
+        bit_len = self.uint8(f)
+        com_flag = self.uint8(f)
+        num_channels = self.uint8(f)
+
+        if (num_channels == 1 and num_samples - actual_sample_rate == 0) and not new_format:
+            raise EEGError('Expecting old format, but 1 channel for 1 second')
+        elif num_channels > 1 and new_format:
+            raise EEGError('Expecting new format, but > 1 channel')
+
+        if new_format:
+            logger.debug('NEW FORMAT...')
+
+            waveform_block_old_format = 39 + 10 + 2 * actual_sample_rate + float(M) * actual_sample_rate
+            control_block_eeg1_new = 1072
+            block_address_eeg2 = block_address + waveform_block_old_format + control_block_eeg1_new
+
+            # EEG2 Format
+            add_try = block_address_eeg2
+            f.seek(add_try, 0)
+            _ = self.uint8(f)  # block ID
+            _ = self.char_(f, 16)  # data format
+            _ = self.uint16(f)  # # of waveform blocks
+            _ = self.char_(f)  # Reserved
+            wave_block_new = self.int64(f)  # Address of block 1
+
+            # EEG2 waveform format
+            f.seek(wave_block_new, 0)
+            _ = self.uint8(f)  # block ID
+            _ = self.char_(f, 16)  # Device format
+            _ = self.uint8(f)  # Data type
+            L = self.uint8(f)  # Byte length of one data
+            M = self.uint8(f)  # Mark/event flag
 
-            # Reading EEG1 control block
-            _ = f.read(1)  # block ID
-            device_type = self.char_(f, 16)  # Device type
-            new_format = device_type[:9] == 'EEG-1200A'
-            number_of_blocks = self.uint8(f)
-            if number_of_blocks > 1:
-                raise EEGError('%s EEG2 Control blocks detected' % number_of_blocks)
-            block_address = self.int32(f)
-            _ = f.read(16)  # EEG control block name
+            #  Now things get a little different with the new header
+            _ = self.char_(f, 20)  # Start time string
+            actual_sample_rate = self.uint32(f)  # Data interval (sample rate)
+            self.sample_rate = actual_sample_rate
+            num_100_ms_blocks = self.uint64(f)  # Length of session
 
-            # Reading EEG2 Control block
-            f.seek(block_address, 0)
-            _ = f.read(1)  # Block ID
-            _ = f.read(16)  # Data format
-            number_of_blocks = self.uint8(f)
-            if number_of_blocks > 1:
-                raise EEGError('%d waveform blocks detected' % number_of_blocks)
-            block_address = self.int32(f)
-            _ = f.read(16)  # Name of waveform block
+            num_samples = actual_sample_rate * num_100_ms_blocks / 10
+            self.num_samples = num_samples
+            ad_off = self.int16(f)  # AD offset at 0V
+            ad_val = self.uint16(f)  # ACD val for 1 division
+            bit_len = self.uint16(f)  # Bit length of one sample
+            com_flag = self.uint16(f)  # Data compression
+            reserve_l = self.uint16(f)  # Reserve length
+            _ = self.char_(f, reserve_l)  # Reserve data
 
-            # Reading waveform block
-            f.seek(block_address, 0)
-            _ = f.read(1)  # Block ID
-            _ = f.read(16)  # Data format
-            _ = f.read(1)  # Data type
-            L = self.uint8(f)  # Byte length of one data
-            M = self.uint8(f)  # Mark/event flag
+            num_channels = self.uint32(f)  # Number of RAW recordings
 
-            T_year = self.uint8(f)
-            T_month = self.uint8(f)
-            T_day = self.uint8(f)
-            T_hour = self.uint8(f)
-            T_minute = self.uint8(f)
-            T_second = self.uint8(f)
-
-            logger.debug('Date of session: %d/%d/%d\n' % (T_month, T_day, T_year))
-            logger.debug('Time of start: %02d:%02d:%02d\n' % (T_hour, T_minute, T_second))
-
-            sample_rate = self.uint16(f)
-            sample_rate_conversion = {
-                int('C064', 16): 100,
-                int('C068', 16): 200,
-                int('C068', 16): 500,
-                int('C3E8', 16): 1000,
-                int('C7D0', 16): 2000,
-                int('D388', 16): 5000,
-                int('E710', 16): 10000
-            }
+        lines = [line.strip() for line in open(elec_file).readlines()]
+        end_range = lines.index('[SD_DEF]')
+        split_lines = [line.split('=') for line in lines[:end_range] if '=' in line]
+        nums_21e, names_21e = zip(*split_lines[:end_range])
+        nums_21e = [int(n) for n in nums_21e]
+
+        channel_order = range(10) + [22, 23] + range(10, 19) + [20, 21] + range(24, 37) + [74, 75] + \
+                        range(100, 254) + [50, 51]
 
-            if sample_rate in sample_rate_conversion:
-                actual_sample_rate = sample_rate_conversion[sample_rate]
-                self.sample_rate = actual_sample_rate
+        jacksheet_nums = np.arange(len(channel_order)) + 1
+        names_21e_ordered = np.chararray(len(channel_order), 16)
+        nums_21e_ordered = np.array([-1 for _ in channel_order])
+        for i, chan_num in enumerate(channel_order):
+            if not chan_num in nums_21e:
+                names_21e_ordered[i] = ''
+                continue
+            names_21e_ordered[i] = names_21e[nums_21e.index(chan_num)]
+            nums_21e_ordered[i] = chan_num
+
+        jacksheet_nums = jacksheet_nums[names_21e_ordered != '']
+        nums_21e_ordered = nums_21e_ordered[names_21e_ordered != '']
+        names_21e_ordered = names_21e_ordered[names_21e_ordered != '']
+
+        data_num_to_21e_index = np.zeros(num_channels) - 1
+
+        channel_mask = np.array(
+            [not self.get_matching_jacksheet_dict_label(name, jacksheet_dict, self.channel_map) is None
+             for name in names_21e_ordered])
+        nums_21e_filtered = nums_21e_ordered[channel_mask]
+        names_21e_filtered = names_21e_ordered[channel_mask]
+        jacksheet_filtered = [
+            jacksheet_dict[self.get_matching_jacksheet_dict_label(name, jacksheet_dict, self.channel_map)]
+            for name in names_21e_filtered]
+
+        for e_name, e_num in jacksheet_dict.items():
+            if e_num not in jacksheet_filtered:
+                logger.critical("skipping electruode {}: {}".format(e_num, e_name))
+
+        gain = [-1 for _ in range(num_channels)]
+        for i in range(num_channels):
+            chan = self.int16(f)
+            matching_row = (nums_21e_filtered == chan)
+            if matching_row.any():
+                data_num_to_21e_index[i] = np.where(matching_row)[0]
             else:
-                raise EEGError('Unknown sample rate')
+                data_num_to_21e_index[i] = -1
+
+            f.seek(6, 1)
+            chan_sensitivity = self.uint8(f)
+            raw_cal = self.uint8(f)
+            cal_conversion = {
+                0: 1000.,
+                1: 2.,
+                2: 5.,
+                3: 10.,
+                4: 20.,
+                5: 50.,
+                6: 100.,
+                7: 200.,
+                8: 500.,
+                9: 1000.
+            }
+            gain[i] = cal_conversion[raw_cal] / float(ad_val)
+
+        if not len(np.unique(gain)) == 1:
+            raise EEGError('All channels do not have the same gain')
+        self.gain = gain[0]
+
+        if not (np.count_nonzero(data_num_to_21e_index != -1) == len(nums_21e_filtered)):
+            bad_indices = [not i in data_num_to_21e_index for i in range(len(names_21e_filtered))]
+            bad_names = names_21e_filtered[np.array(bad_indices)]
+            good_names = names_21e_filtered[np.logical_not(np.array(bad_indices))]
+            unique_bad_names = bad_names[np.array([bad_name not in good_names for bad_name in bad_names])]
+            if len(unique_bad_names) > 0:
+                raise EEGError('Could not find recording for channels:\n%s' % unique_bad_names)
+
+        return num_channels, data_num_to_21e_index, jacksheet_filtered, ad_off
 
-            num_100_ms_blocks = self.uint32(f)
-            logger.debug('Length of session: %2.2f hours\n' % (num_100_ms_blocks / 10. / 3600.))
-            num_samples = actual_sample_rate * num_100_ms_blocks / 10.
+    def get_waveform(self, jacksheet_dict):
+        """
+        Memory-maps the interleaved waveform data, so that individual channels or sample ranges can be read without
+        reading the rest of the file
+        :param jacksheet_dict: Mapping of channel label -> jacksheet number
+        :return: (np.memmap of shape (samples, channels + 1),
+                  mapping of jacksheet number -> column of the memmap in which that channel is recorded,
+                  AD offset at 0V)
+        """
+        with open(self.raw_filename, 'rb') as f:
+            num_channels, data_num_to_21e_index, jacksheet_filtered, ad_off = self._read_header(f, jacksheet_dict)
+            data_offset = f.tell()
+            sample_bytes = np.dtype('int16').itemsize * int(num_channels + 1)
+            available_samples = (os.fstat(f.fileno()).st_size - data_offset) // sample_bytes
+
+        num_samples = int(self.num_samples)
+        if available_samples < num_samples:
+            logger.warn(
+                'Number of samples specified in file is wrong. Specified: {}, actual: {}'.format(self.num_samples,
+                                                                                                 available_samples))
+            num_samples = available_samples
             self.num_samples = num_samples
-            ad_off = self.int16(f)
-            ad_val = self.uint16(f)
-            bit_len = self.uint8(f)
-            com_flag = self.uint8(f)
-            num_channels = self.uint8(f)
-
-            if (num_channels == 1 and num_samples - actual_sample_rate == 0) and not new_format:
-                raise EEGError('Expecting old format, but 1 channel for 1 second')
-            elif num_channels > 1 and new_format:
-                raise EEGError('Expecting new format, but > 1 channel')
-
-            if new_format:
-                logger.debug('NEW FORMAT...')
-
-                waveform_block_old_format = 39 + 10 + 2 * actual_sample_rate + float(M) * actual_sample_rate
-                control_block_eeg1_new = 1072
-                block_address_eeg2 = block_address + waveform_block_old_format + control_block_eeg1_new
-
-                # EEG2 Format
-                add_try = block_address_eeg2
-                f.seek(add_try, 0)
-                _ = self.uint8(f)  # block ID
-                _ = self.char_(f, 16)  # data format
-                _ = self.uint16(f)  # # of waveform blocks
-                _ = self.char_(f)  # Reserved
-                wave_block_new = self.int64(f)  # Address of block 1
-
-                # EEG2 waveform format
-                f.seek(wave_block_new, 0)
-                _ = self.uint8(f)  # block ID
-                _ = self.char_(f, 16)  # Device format
-                _ = self.uint8(f)  # Data type
-                L = self.uint8(f)  # Byte length of one data
-                M = self.uint8(f)  # Mark/event flag
-
-                #  Now things get a little different with the new header
-                _ = self.char_(f, 20)  # Start time string
-                actual_sample_rate = self.uint32(f)  # Data interval (sample rate)
-                self.sample_rate = actual_sample_rate
-                num_100_ms_blocks = self.uint64(f)  # Length of session
-
-                num_samples = actual_sample_rate * num_100_ms_blocks / 10
-                self.num_samples = num_samples
-                ad_off = self.int16(f)  # AD offset at 0V
-                ad_val = self.uint16(f)  # ACD val for 1 division
-                bit_len = self.uint16(f)  # Bit length of one sample
-                com_flag = self.uint16(f)  # Data compression
-                reserve_l = self.uint16(f)  # Reserve length
-                _ = self.char_(f, reserve_l)  # Reserve data
-
-                num_channels = self.uint32(f)  # Number of RAW recordings
-
-            lines = [line.strip() for line in open(elec_file).readlines()]
-            end_range = lines.index('[SD_DEF]')
-            split_lines = [line.split('=') for line in lines[:end_range] if '=' in line]
-            nums_21e, names_21e = zip(*split_lines[:end_range])
-            nums_21e = [int(n) for n in nums_21e]
-
-            channel_order = range(10) + [22, 23] + range(10, 19) + [20, 21] + range(24, 37) + [74, 75] + \
-                            range(100, 254) + [50, 51]
-
-            jacksheet_nums = np.arange(len(channel_order)) + 1
-            names_21e_ordered = np.chararray(len(channel_order), 16)
-            nums_21e_ordered = np.array([-1 for _ in channel_order])
-            for i, chan_num in enumerate(channel_order):
-                if not chan_num in nums_21e:
-                    names_21e_ordered[i] = ''
-                    continue
-                names_21e_ordered[i] = names_21e[nums_21e.index(chan_num)]
-                nums_21e_ordered[i] = chan_num
-
-            jacksheet_nums = jacksheet_nums[names_21e_ordered != '']
-            nums_21e_ordered = nums_21e_ordered[names_21e_ordered != '']
-            names_21e_ordered = names_21e_ordered[names_21e_ordered != '']
-
-            data_num_to_21e_index = np.zeros(num_channels) - 1
-
-            channel_mask = np.array(
-                [not self.get_matching_jacksheet_dict_label(name, jacksheet_dict, self.channel_map) is None
-                 for name in names_21e_ordered])
-            nums_21e_filtered = nums_21e_ordered[channel_mask]
-            names_21e_filtered = names_21e_ordered[channel_mask]
-            jacksheet_filtered = [
-                jacksheet_dict[self.get_matching_jacksheet_dict_label(name, jacksheet_dict, self.channel_map)]
-                for name in names_21e_filtered]
-
-            for e_name, e_num in jacksheet_dict.items():
-                if e_num not in jacksheet_filtered:
-                    logger.critical("skipping electruode {}: {}".format(e_num, e_name))
-
-            gain = [-1 for _ in range(num_channels)]
-            for i in range(num_channels):
-                chan = self.int16(f)
-                matching_row = (nums_21e_filtered == chan)
-                if matching_row.any():
-                    data_num_to_21e_index[i] = np.where(matching_row)[0]
-                else:
-                    data_num_to_21e_index[i] = -1
-
-                f.seek(6, 1)
-                chan_sensitivity = self.uint8(f)
-                raw_cal = self.uint8(f)
-                cal_conversion = {
-                    0: 1000.,
-                    1: 2.,
-                    2: 5.,
-                    3: 10.,
-                    4: 20.,
-                    5: 50.,
-                    6: 100.,
-                    7: 200.,
-                    8: 500.,
-                    9: 1000.
-                }
-                gain[i] = cal_conversion[raw_cal] / float(ad_val)
-
-            if not len(np.unique(gain)) == 1:
-                raise EEGError('All channels do not have the same gain')
-            self.gain = gain[0]
-
-            if not (np.count_nonzero(data_num_to_21e_index != -1) == len(nums_21e_filtered)):
-                bad_indices = [not i in data_num_to_21e_index for i in range(len(names_21e_filtered))]
-                bad_names = names_21e_filtered[np.array(bad_indices)]
-                good_names = names_21e_filtered[np.logical_not(np.array(bad_indices))]
-                unique_bad_names = bad_names[np.array([bad_name not in good_names for bad_name in bad_names])]
-                if len(unique_bad_names) > 0:
-                    raise EEGError('Could not find recording for channels:\n%s' % unique_bad_names)
-
-            # Get the data!
-            logger.debug('Reading...')
-            data = np.fromfile(f, 'int16', int((num_channels + 1) * num_samples))
-            if len(data) / (num_channels + 1) != num_samples:
-                num_samples = len(data) / (num_channels + 1)
-                logger.warn(
-                    'Number of samples specified in file is wrong. Specified: {}, actual: {}'.format(self.num_samples,
-                                                                                                     num_samples))
-                self.num_samples = num_samples
-            data = data.reshape((int(num_samples), int(num_channels + 1))).T
-            # data = np.array(self.uint16(f, int((num_channels + 1) * num_samples))).reshape((int(num_samples), int(num_channels + 1))).T
-            logger.debug('Done.')
-
-            # Filter only for relevant channels
-            data_num_mask = np.array(data_num_to_21e_index != -1)
-            data = data[np.append(data_num_mask, False), :]
-            data_num_to_21e_index = data_num_to_21e_index[data_num_mask]
-
-            # Remove offset
-            data = data + ad_off
-            data_dict = {jacksheet_filtered[int(data_num_to_21e_index[i])]: data[i, :] for i in range(data.shape[0])}
-            return data_dict
+
+        waveform = np.memmap(self.raw_filename, 'int16', 'r', offset=data_offset,
+                             shape=(num_samples, int(num_channels + 1)))
+        return waveform, self._channel_columns(data_num_to_21e_index, jacksheet_filtered), ad_off
+
+    def get_data(self, jacksheet_dict, channel_map):
+        waveform, channel_columns, ad_off = self.get_waveform(jacksheet_dict)
+        logger.debug('Reading...')
+        data_dict = {channel: np.asarray(waveform[:, column]) + ad_off
+                     for channel, column in channel_columns.items()}
+        logger.debug('Done.')
+        return data_dict
 
     def channel_data(self, channel):
-        if not self._data:
+        if self._waveform is None:
             if not self.jacksheet:
                 raise EEGError("Cannot split EEG without jacksheet")
-            self._data = self.get_data(self.jacksheet, self.channel_map)
-        return self._data[channel]
+            self._waveform = self.get_waveform(self.jacksheet)
+        waveform, channel_columns, ad_off = self._waveform
+        return np.asarray(waveform[:, channel_columns[channel]]) + ad_off
+
+    @staticmethod
+    def _channel_columns(data_num_to_21e_index, jacksheet_filtered):
+        """
+        :return: Mapping of jacksheet number -> column of the waveform data in which that channel is recorded
+        """
+        return {jacksheet_filtered[int(index)]: column
+                for column, index in enumerate(data_num_to_21e_index) if index != -1}
 
     def _split_data(self, location, basename):
         if not os.path.exists(location):
             fileutil.makedirs(location)
         if not self.jacksheet:
             raise EEGError('Jacksheet not specified')
+        if self.STREAM_SPLIT:
+            self._split_data_streaming(location, basename)
+            return
         data = self.get_data(self.jacksheet, self.channel_map)
         if not self.sample_rate:
             raise EEGError('Sample rate not determined')
 
         sys.stdout.flush()
-        for channel, channel_data in data.items():
-            filename = os.path.join(location, basename + ('.%03d' % channel))
+        with self.channel_writer() as writer:
+            for channel, channel_data in data.items():
+                filename = os.path.join(location, basename + ('.%03d' % channel))
 
-            logger.debug(channel)
-            sys.stdout.flush()
-            channel_data.astype(self.DATA_FORMAT).tofile(filename)
+                logger.debug(channel)
+                sys.stdout.flush()
+                writer.write(filename, channel_data.astype(self.DATA_FORMAT))
+
+    def _split_data_streaming(self, location, basename):
+        """
+        Splits the data SPLIT_BLOCK_SAMPLES samples at a time, appending each block to the channel files, so that
+        memory usage does not depend on the length of the recording
+        """
+        waveform, channel_columns, ad_off = self.get_waveform(self.jacksheet)
+        if not self.sample_rate:
+            raise EEGError('Sample rate not determined')
+
+        with self.channel_writer() as writer:
+            for start in range(0, len(waveform), self.SPLIT_BLOCK_SAMPLES):
+                block = waveform[start:start + self.SPLIT_BLOCK_SAMPLES]
+                logger.debug('Splitting samples {}-{}'.format(start, start + len(block)))
+                for channel, column in channel_columns.items():
+                    filename = os.path.join(location, basename + ('.%03d' % channel))
+                    writer.write(filename, (block[:, column] + ad_off).astype(self.DATA_FORMAT))
+                # Bound the number of blocks held in memory by outstanding writes
+                writer.wait()
 
 
 class Multi_NSx_reader(EEG_reader):
@@ -670,8 +835,6 @@ class NSx_reader(EEG_reader):
         else:
             self.channel_map = dict()
 
-        self._data = None
-
     def get_source_file(self):
         return self.raw_filename
 
@@ -688,37 +851,34 @@ class NSx_reader(EEG_reader):
     def labels(self):
         return {channel:num for num, channel in self.jacksheet.items()}
 
-    @property
-    def data(self):
-        if not self._data:
-            self._data = self.nsx_info['data'] # I apologize for this.
-        return self._data
-
     def channel_data(self, channel):
-        channels = np.array(self.data['elec_ids'])
-        return self.data['data'][channels==channel, :]
+        return self.nsx_info['reader'].getelecdata([channel], data_headers=self.nsx_info['data_headers'])
 
     @classmethod
     def get_nsx_info(cls, nsx_file):
+        """
+        Reads the metadata for an NSx file from its headers, without reading any of the data.
+
+        The headers are those that getdata() lists, which this used to read them from: a packet that goes back in time
+        (after the clocks of two NSPs are synced) is listed twice (see NsxFile.getdataheaders). n_samples, the number
+        of samples in all packets but the first, therefore counts the samples of such a packet twice, as it always has.
+        """
         reader = NsxFile(nsx_file)
         _, extension = os.path.splitext(nsx_file)
-        data = reader.getdata()
-        headers = data['data_headers']
+        headers = reader.getdataheaders()
 
         if len(headers) > 1:
             pre_data_points = headers[0]['NumDataPoints']
-
-            # Have to get the data starting at a sample after the last segment starts
-            # or reader fills it with all zeros. Because blackrock.
-            data_actual = reader.getdata(start_time_s = float(pre_data_points+1)/data['samp_per_s'])
         else:
             pre_data_points = -1
-            data_actual = data
 
-        data['data'][:,pre_data_points+1:] = data_actual['data']
+        if reader.basic_header['FileSpec'] == '2.1':
+            elec_ids = list(reader.basic_header['ChannelID'])
+        else:
+            elec_ids = [header['ElectrodeID'] for header in reader.extended_headers]
 
         start_time = reader.basic_header['TimeOrigin']
-        total_data_points = sum([header['NumDataPoints'] for header in data['data_headers']])
+        total_data_points = sum([header['NumDataPoints'] for header in headers])
         used_data_points = total_data_points - pre_data_points
         sample_rate = NSx_reader.SAMPLE_RATES[extension]
         length_ms = used_data_points / float(sample_rate) * 1000.
@@ -728,25 +888,47 @@ class NSx_reader(EEG_reader):
                 'n_samples': used_data_points,
                 'sample_rate': sample_rate,
                 'reader': reader,
-                'data': data}
+                'data_headers': headers,
+                'elec_ids': elec_ids}
 
     def _split_data(self, location, basename):
-        channels = np.array(self.data['elec_ids'])
-        buffer_size = self.data['data_headers'][-1]['Timestamp'] / (self.TIC_RATE / self.get_sample_rate())
+        reader = self.nsx_info['reader']
+        headers = self.nsx_info['data_headers']
+        channels = np.array(self.nsx_info['elec_ids'])
+        buffer_size = headers[-1]['Timestamp'] / (self.TIC_RATE / self.get_sample_rate())
+        num_samples = reader.getnumsamples(headers)
+
+        recording_channels = []
+        filenames = []
         for label, channel in self.labels.items():
             recording_channel = channel - self.lowest_channel
             if recording_channel < 0 or not recording_channel in channels:
                 logger.debug('Not getting channel {} from file {}'.format(channel, self.raw_filename))
                 continue
-            filename = os.path.join(location, basename + '.%03d' % channel)
             logger.debug('%s: %s' % (label, channel))
-            data = self.data['data'][channels==recording_channel, :].astype(self.DATA_FORMAT)
-            if len(data) == 0:
-                raise EEGError("EEG File {} contains no data "
-                                                   "for channel {}".format(self.raw_filename, recording_channel))
-            data = np.concatenate((np.ones((1, buffer_size), self.DATA_FORMAT) * data[0,0], data), 1)
-            data.tofile(filename)
-            sys.stdout.flush()
+            recording_channels.append(recording_channel)
+            filenames.append(os.path.join(location, basename + '.%03d' % channel))
+
+        if not recording_channels:
+            return
+        if num_samples == 0:
+            raise EEGError("EEG File {} contains no data "
+                           "for channels {}".format(self.raw_filename, recording_channels))
+
+        with self.channel_writer() as writer:
+            # Each channel is preceded by buffer_size copies of its first sample
+            first_samples = reader.getelecdata(recording_channels, 0, 1, headers).astype(self.DATA_FORMAT)
+            for filename, first_sample in zip(filenames, first_samples):
+                writer.write(filename, np.ones((1, buffer_size), self.DATA_FORMAT) * first_sample[0])
+
+            # Read SPLIT_BLOCK_SAMPLES samples of every channel at a time, rather than the whole file
+            for start in range(0, num_samples, self.SPLIT_BLOCK_SAMPLES):
+                data = reader.getelecdata(recording_channels, start, start + self.SPLIT_BLOCK_SAMPLES, headers)
+                data = data.astype(self.DATA_FORMAT)
+                for filename, channel_data in zip(filenames, data):
+                    writer.write(filename, channel_data)
+                writer.wait()
+                sys.stdout.flush()
 
 
 class EDF_reader(EEG_reader):
@@ -821,28 +1003,29 @@ class EDF_reader(EEG_reader):
     def _split_data(self, location, basename):
         sys.stdout.flush()
         used_jacksheet_labels = []
-        for channel, header in self.headers.items():
-            if self.jacksheet:
-                label = self.get_matching_jacksheet_dict_label(header['label'], self.jacksheet, self.channel_map)
-                if not label or label in used_jacksheet_labels:
-                    logger.info("skipping channel {}".format(header['label']))
-                    continue
-                if label.upper() in self.jacksheet:
-                    out_channel = self.jacksheet[label.upper()]
-                    used_jacksheet_labels.append(label.upper())
-                elif label in self.jacksheet:
-                    out_channel = self.jacksheet[label]
-                    used_jacksheet_labels.append(label)
+        with self.channel_writer() as writer:
+            for channel, header in self.headers.items():
+                if self.jacksheet:
+                    label = self.get_matching_jacksheet_dict_label(header['label'], self.jacksheet, self.channel_map)
+                    if not label or label in used_jacksheet_labels:
+                        logger.info("skipping channel {}".format(header['label']))
+                        continue
+                    if label.upper() in self.jacksheet:
+                        out_channel = self.jacksheet[label.upper()]
+                        used_jacksheet_labels.append(label.upper())
+                    elif label in self.jacksheet:
+                        out_channel = self.jacksheet[label]
+                        used_jacksheet_labels.append(label)
+                    else:
+                        logger.info("skipping channel {}".format(label))
                 else:
-                    logger.info("skipping channel {}".format(label))
-            else:
-                out_channel = channel
-            filename = os.path.join(location, basename + '.%03d' % (out_channel))
+                    out_channel = channel
+                filename = os.path.join(location, basename + '.%03d' % (out_channel))
 
-            logger.debug('{}: {}'.format(out_channel, header['label']))
-            sys.stdout.flush()
-            data = self.reader.readSignal(channel).astype(self.DATA_FORMAT)
-            data.tofile(filename)
+                logger.debug('{}: {}'.format(out_channel, header['label']))
+                sys.stdout.flush()
+                data = self.reader.readSignal(channel).astype(self.DATA_FORMAT)
+                writer.write(filename, data)
         if self.jacksheet:
             for label in self.jacksheet:
                 if label not in used_jacksheet_labels:
@@ -1080,15 +1263,16 @@ class EGI_reader(EEG_reader):
             fileutil.makedirs(location)
 
         # Write EEG channel files
-        for i in range(self.data.shape[0]):
-            if self.chans[i]['kind'] in (2, 202):  # EEG/EOG channels
-                filename = os.path.join(location, basename + '.' + self.chans[i]['ch_name'][-3:])
-            else:  # "Event" channels
-                filename = os.path.join(location, basename + '.' + self.chans[i]['ch_name'])
-            logger.debug(str(i+1))
-            sys.stdout.flush()
-            # Each row of self._data contains all samples for one channel or event, so write each row to its own file
-            self.data[i].tofile(filename)
+        with self.channel_writer() as writer:
+            for i in range(self.data.shape[0]):
+                if self.chans[i]['kind'] in (2, 202):  # EEG/EOG channels
+                    filename = os.path.join(location, basename + '.' + self.chans[i]['ch_name'][-3:])
+                else:  # "Event" channels
+                    filename = os.path.join(location, basename + '.' + self.chans[i]['ch_name'])
+                logger.debug(str(i+1))
+                sys.stdout.flush()
+                # Each row of self._data contains all samples for one channel or event, so write each row to its own file
+                writer.write(filename, self.data[i])
 
         # Write the sample rate, data format, and amplifier gain to two params.txt files in the noreref folder
         logger.debug('Writing param files.')
@@ -1418,20 +1602,21 @@ class BDF_reader(EEG_reader):
         if not os.path.exists(location):
             fileutil.makedirs(location)
 
-        # Write EEG channel files
-        for i in range(self.data.shape[0]):
-            filename = os.path.join(location, basename + ('.' + self.names[i]))
+        with self.channel_writer() as writer:
+            # Write EEG channel files
+            for i in range(self.data.shape[0]):
+                filename = os.path.join(location, basename + ('.' + self.names[i]))
+                logger.debug(i + 1)
+                sys.stdout.flush()
+                # Each row of self._data contains all samples for one channel or event
+                writer.write(filename, self.data[i])
+
+            # Write sync pulse channel file
+            filename = os.path.join(location, basename + '.Status')
             logger.debug(i + 1)
             sys.stdout.flush()
             # Each row of self._data contains all samples for one channel or event
-            self.data[i].tofile(filename)
-
-        # Write sync pulse channel file
-        filename = os.path.join(location, basename + '.Status')
-        logger.debug(i + 1)
-        sys.stdout.flush()
-        # Each row of self._data contains all samples for one channel or event
-        self.sync.tofile(filename)
+            writer.write(filename, self.sync)
 
         logger.debug('Saved.')
 
@@ -0,0 +1,99 @@
+"""
+Shared reader for RAMulator/host PC event_log.json files.
+
+The same event log is read by the events task, the System 3 parsers and the System 3 aligner. Each log is parsed once
+and the document is cached, keyed by its path, modification time and size, so that later readers in the same pipeline
+run get the parsed document back rather than re-reading the file. The cache holds the most recently used
+MAX_CACHED_LOGS documents, and is cleared when a pipeline finishes. Cached documents are shared between callers and
+must not be modified; iter_events yields shallow copies of the entries, which parsers are free to modify.
+
+With stream=True, the entries under 'events' are instead parsed incrementally with ijson (if installed), so that the
+whole document is never held in memory at once. Any version of ijson will do: the Decimal numbers it yields for
+non-integers are converted to floats, as json.load returns them.
+"""
+import codecs
+import json
+import os
+from collections import OrderedDict
+from decimal import Decimal
+
+from ..log import logger
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+MAX_CACHED_LOGS = 2
+
+_cache = OrderedDict()
+
+
+def _cache_key(filename):
+    stat = os.stat(filename)
+    return os.path.abspath(filename), stat.st_mtime, stat.st_size
+
+
+def load_event_log(filename):
+    """
+    Returns the parsed contents of an event log, reading the file only if it is not cached or has changed since
+    it was cached
+    :param filename: Path to event_log.json
+    :return: dict with the contents of the log
+    """
+    key = _cache_key(filename)
+    if key in _cache:
+        document = _cache.pop(key)
+    else:
+        for cached_key in [cached_key for cached_key in _cache if cached_key[0] == key[0]]:
+            del _cache[cached_key]
+        with codecs.open(filename, encoding='utf-8') as event_log:
+            document = json.load(event_log)
+    _cache[key] = document
+    while len(_cache) > MAX_CACHED_LOGS:
+        _cache.popitem(last=False)
+    return document
+
+
+def iter_events(filename, stream=False):
+    """
+    Iterates over shallow copies of the entries under 'events' in an event log
+    :param filename: Path to event_log.json
+    :param stream: If True and ijson is available, parse the entries incrementally instead of loading the document.
+                   A document that is already cached is used either way
+    """
+    if stream and _cache_key(filename) not in _cache:
+        if ijson is not None:
+            return _stream_events(filename)
+        logger.warn('ijson not available; reading {} in full'.format(filename))
+    return (dict(event) for event in load_event_log(filename)['events'])
+
+
+def _stream_events(filename):
+    with open(filename, 'rb') as event_log:
+        for event in ijson.items(event_log, 'events.item'):
+            yield _decimals_to_floats(event)
+
+
+def _decimals_to_floats(value):
+    """ Replaces the Decimal numbers in a parsed JSON value with floats """
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, dict):
+        return {key: _decimals_to_floats(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_decimals_to_floats(item) for item in value]
+    return value
+
+
+def load_versions(filename):
+    """
+    Returns the 'versions' entry of an event log
+    :param filename: Path to event_log.json
+    """
+    return load_event_log(filename)['versions']
+
+
+def clear_cache():
+    """ Drops all cached event logs """
+    _cache.clear()
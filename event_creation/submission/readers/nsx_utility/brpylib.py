@@ -999,6 +999,102 @@ class NsxFile:
 
         return output
 
+    def getdataheaders(self):
+        """
+        This function is used to return the headers of all data packets in the NSx datafile without reading any data.
+
+        :return: data_headers: {list} dictionaries of all data headers, as listed in getdata()['data_headers'], each
+                                      with an additional 'DataOffset' entry giving the file position of the packet data
+        """
+
+        if self.basic_header['FileSpec'] == '2.1':
+            num_data_pts = (ospath.getsize(self.datafile.name) - self.basic_header['BytesInHeader']) \
+                           // (DATA_BYTE_SIZE * self.basic_header['ChannelCount'])
+            return [{'Timestamp': TIMESTAMP_NULL_21, 'NumDataPoints': num_data_pts,
+                     'DataOffset': self.basic_header['BytesInHeader']}]
+
+        data_headers = []
+        d_ptr        = 0
+        file_size    = ospath.getsize(self.datafile.name)
+
+        self.datafile.seek(self.basic_header['BytesInHeader'], 0)
+        while self.datafile.tell() < file_size:
+            header               = processheaders(self.datafile, nsx_header_dict['data'])
+            header['DataOffset'] = self.datafile.tell()
+            if header['Header'] == 0:  print('Invalid Header.  File may be corrupt')
+
+            # getdata() re-reads, and so lists twice, the header of a packet that goes backwards in time
+            if header['NumDataPoints'] > 0:
+                timestamp_sample = round(header['Timestamp'] / self.basic_header['Period'])
+                if timestamp_sample < d_ptr:  data_headers.append(dict(header))
+                d_ptr = timestamp_sample + header['NumDataPoints']
+
+            data_headers.append(header)
+            self.datafile.seek(header['NumDataPoints'] * self.basic_header['ChannelCount'] * DATA_BYTE_SIZE, 1)
+
+        return data_headers
+
+    def getnumsamples(self, data_headers=None):
+        """
+        :param data_headers: [optional] {list} data headers as returned by getdataheaders()
+        :return: {int} the number of samples per electrode returned by getdata() with default arguments
+        """
+        if data_headers is None:  data_headers = self.getdataheaders()
+        timestamp    = data_headers[-1]['Timestamp']
+        num_data_pts = data_headers[-1]['NumDataPoints']
+        return int(ceil(timestamp / self.basic_header['Period']) + num_data_pts)
+
+    def getelecdata(self, elec_ids, start_sample=0, stop_sample=None, data_headers=None):
+        """
+        This function is used to lazily read a range of samples for a subset of electrodes.  Data packets are memory
+        mapped, so only the requested samples are read from disk.  Packets are placed and scaled as in getdata() with
+        default arguments (later packets overwrite earlier ones, time between packets is filled with zeros), so that
+        getelecdata(elec_ids) == getdata(elec_ids)['data'].
+
+        :param elec_ids:      {list}  List of elec_ids to extract (e.g., [13])
+        :param start_sample:  [optional] {int}  First sample to extract
+        :param stop_sample:   [optional] {int}  Sample after the last sample to extract (defaults to end of data)
+        :param data_headers:  [optional] {list} data headers as returned by getdataheaders(), to avoid re-reading them
+        :return: data:        {numpy array} float32 array of shape (len(elec_ids), stop_sample - start_sample)
+        """
+
+        if data_headers is None:  data_headers = self.getdataheaders()
+
+        if self.basic_header['FileSpec'] == '2.1':  all_elec_ids = list(self.basic_header['ChannelID'])
+        else:                                      all_elec_ids = [d['ElectrodeID'] for d in self.extended_headers]
+        elec_id_indices = [all_elec_ids.index(e) for e in elec_ids]
+
+        num_samples = self.getnumsamples(data_headers)
+        if stop_sample is None or stop_sample > num_samples:  stop_sample = num_samples
+        start_sample = min(start_sample, stop_sample)
+
+        data_pt_size = self.basic_header['ChannelCount'] * DATA_BYTE_SIZE
+        data         = np.zeros((len(elec_ids), stop_sample - start_sample), dtype=np.float32)
+
+        last_offset = None
+        for header in data_headers:
+            # Skip empty packets and packets listed twice
+            if header['NumDataPoints'] == 0 or header['DataOffset'] == last_offset:  continue
+            last_offset = header['DataOffset']
+
+            timestamp_sample = int(round(header['Timestamp'] / self.basic_header['Period']))
+            first = max(start_sample, timestamp_sample)
+            last  = min(stop_sample, timestamp_sample + header['NumDataPoints'])
+            if first >= last:  continue
+
+            mm = np.memmap(self.datafile, dtype=np.int16, mode='r',
+                           offset=int(header['DataOffset'] + (first - timestamp_sample) * data_pt_size),
+                           shape=(int(last - first), self.basic_header['ChannelCount']))
+            data[:, first - start_sample:last - start_sample] = mm[:, elec_id_indices].T
+            del mm
+
+        # All data must be scaled based on scaling factors from extended header
+        for i, idx in enumerate(elec_id_indices):
+            if self.basic_header['FileSpec'] == '2.1':  data[i] *= UV_PER_BIT_21
+            else:                                      data[i] *= getdigfactor(self.extended_headers, idx)
+
+        return data
+
     def savesubsetnsx(self, elec_ids='all', file_size=None, file_time_s=None, file_suffix=''):
         """
         This function is used to save a subset of data based on electrode IDs, file sizing, or file data time.  If
@@ -3,11 +3,13 @@ import re
 import json
 import traceback
 import shutil
+from collections import defaultdict
 
 import fileutil
 from .log import logger
-from .configuration import paths
+from .configuration import config, paths
 from .exc import ProcessingError
+from .viewers.recarray import to_json, to_npy
 
 try:
     from ptsa.data.readers import BaseEventReader
@@ -33,12 +35,25 @@ class PipelineTask(object):
     def set_pipeline(self, pipeline):
         self.pipeline = pipeline
 
-    def create_file(self, filename, contents, label, index_file=True):
-        with fileutil.open_with_perms(os.path.join(self.destination, filename), 'w') as f:
+    def create_file(self, filename, contents, label, index_file=True, mode='w'):
+        with fileutil.open_with_perms(os.path.join(self.destination, filename), mode) as f:
             f.write(contents)
         if index_file:
             self.pipeline.register_output(filename, label)
 
+    def create_event_files(self, filename, events, label):
+        """
+        Writes events to filename as JSON and, if the write_npy_events config option is set, to the matching .npy file,
+        registered in the index as <label>_npy
+        :param filename: Name of the .json events file
+        :param events: recarray of events
+        :param label: Label of the JSON file in the index
+        """
+        self.create_file(filename, to_json(events), label)
+        if config.write_npy_events:
+            self.create_file(os.path.splitext(filename)[0] + '.npy', to_npy(events), '{}_npy'.format(label),
+                             mode='wb')
+
     def run(self, files, db_folder):
         self.destination = db_folder
         try:
@@ -151,30 +166,163 @@ class CleanLeafTask(PipelineTask):
 
 class IndexAggregatorTask(PipelineTask):
     """
+    Aggregates the index.json files of every current_processed directory in a protocol into <protocol>.json.
 
+    A manifest alongside <protocol>.json records the path, modification time and size of each index when it was read,
+    so only the entries of <protocol>.json with an index that has changed since the last aggregation are re-read.
     """
     PROTOCOLS_DIR = os.path.join(paths.db_root, 'protocols')
     PROTOCOLS = ('r1', 'ltp')
     PROCESSED_DIRNAME = 'current_processed'
+    SOURCE_DIRNAME = 'current_source'
     INDEX_FILENAME = 'index.json'
+    MANIFEST_FILENAME = '.{}_index_manifest.json'
 
     @classmethod
     def build_index(cls, protocol):
-        index_files = cls.find_index_files(os.path.join(cls.PROTOCOLS_DIR, protocol))
-        d = {}
-        for index_file in index_files:
-            cls.build_single_file_index(index_file, d)
-        return d
+        """
+        Aggregates every index in protocol, re-reading only the indexes that have changed since the last aggregation
+        """
+        manifest, index = cls.load_manifest(protocol), cls.read_index(protocol)
+        if manifest is None or index is None:
+            manifest, index = {}, {}
+        cls.update_index(index, manifest, cls.find_index_files(os.path.join(cls.PROTOCOLS_DIR, protocol)),
+                         os.path.relpath(os.path.join(cls.PROTOCOLS_DIR, protocol), paths.db_root))
+        return manifest, index
 
     @classmethod
     def find_index_files(cls, root_dir):
         result = []
         for root, dirs, files in os.walk(root_dir):
             if cls.PROCESSED_DIRNAME in dirs and \
-                    cls.INDEX_FILENAME in os.listdir(os.path.join(root, cls.PROCESSED_DIRNAME)):
+                    os.path.isfile(os.path.join(root, cls.PROCESSED_DIRNAME, cls.INDEX_FILENAME)):
                 result.append(os.path.join(root, cls.PROCESSED_DIRNAME, cls.INDEX_FILENAME))
+            # Indexes are only read through current_processed, so the timestamped source and processed
+            # directories (which hold the bulk of the files) need not be walked
+            dirs[:] = [dir for dir in dirs if dir not in (cls.PROCESSED_DIRNAME, cls.SOURCE_DIRNAME) and
+                       not re.match(CleanDbTask.SOURCE_REGEX, dir) and not re.match(CleanDbTask.PROCESSED_REGEX, dir)]
         return result
 
+    @classmethod
+    def manifest_path(cls, protocol):
+        return os.path.join(cls.PROTOCOLS_DIR, cls.MANIFEST_FILENAME.format(protocol))
+
+    @classmethod
+    def index_path(cls, protocol):
+        return os.path.join(cls.PROTOCOLS_DIR, '{}.json'.format(protocol))
+
+    @classmethod
+    def load_manifest(cls, protocol):
+        """
+        :return: The manifest written by the last aggregation of protocol, or None if there is none
+        """
+        try:
+            with open(cls.manifest_path(protocol)) as manifest_file:
+                return json.load(manifest_file)
+        except (IOError, ValueError):
+            return None
+
+    @classmethod
+    def read_index(cls, protocol):
+        """
+        :return: The aggregated index written by the last aggregation of protocol, or None if there is none
+        """
+        try:
+            with open(cls.index_path(protocol)) as index_file:
+                return json.load(index_file)
+        except (IOError, ValueError):
+            return None
+
+    @classmethod
+    def write_manifest(cls, protocol, manifest):
+        try:
+            with fileutil.atomic_open_with_perms(cls.manifest_path(protocol)) as f:
+                json.dump(manifest, f)
+        except (IOError, OSError):
+            logger.warn('Unable to write index manifest ' + cls.manifest_path(protocol))
+
+    @staticmethod
+    def index_signature(index_path):
+        stat = os.stat(index_path)
+        return [os.path.realpath(index_path), stat.st_mtime, stat.st_size]
+
+    @staticmethod
+    def entry_dir(rel_path):
+        """
+        :return: The directory of the index entry that the index file at rel_path is aggregated into,
+                 e.g. subjects/R1001P/experiments/FR1/sessions/0 for subjects/R1001P/.../sessions/0/behavioral/...
+        """
+        return os.path.dirname(os.path.dirname(os.path.dirname(rel_path)))
+
+    @classmethod
+    def update_index(cls, index, manifest, index_files, rel_dir):
+        """
+        Brings an aggregated index up to date with the index files in a directory, re-reading only the entries of the
+        index with a new, changed or deleted index file
+        :param index: The aggregated index, updated in place
+        :param manifest: Maps the path of each index file in index (relative to the database root) to its path,
+                         modification time and size when it was read. Updated in place
+        :param index_files: Paths to every index file in the directory
+        :param rel_dir: The directory, relative to the database root. Index files outside of it are left as they are
+        :return: The paths of the index files that have changed
+        """
+        signatures = dict((os.path.relpath(index_path, paths.db_root), cls.index_signature(index_path))
+                          for index_path in index_files)
+        changed = [rel_path for rel_path in set(manifest) | set(signatures)
+                   if rel_path.startswith(rel_dir + os.sep) and manifest.get(rel_path) != signatures.get(rel_path)]
+        for rel_path in changed:
+            manifest.pop(rel_path, None)
+        manifest.update(signatures)
+
+        entry_files = defaultdict(list)
+        # Entries of index files further down (e.g. the montages of a localization) are nested in the entries above
+        child_keys = defaultdict(set)
+        for rel_path in sorted(manifest):
+            entry_dir = cls.entry_dir(rel_path)
+            entry_files[entry_dir].append(rel_path)
+            dir_names = entry_dir.split(os.sep)
+            for i in range(1, len(dir_names)):
+                child_keys[os.path.join(*dir_names[:i])].add(dir_names[i])
+
+        changed_entries = dict((cls.entry_dir(rel_path), rel_path) for rel_path in changed)
+        for entry_dir in sorted(changed_entries):
+            entry_list = cls.list_from_index_path(os.path.join(paths.db_root, changed_entries[entry_dir]))
+            cls.rebuild_entry(index, entry_list, entry_files[entry_dir], child_keys[entry_dir])
+        return changed
+
+    @classmethod
+    def rebuild_entry(cls, index, entry_list, entry_files, child_keys):
+        """
+        Replaces an entry of the aggregated index with the contents of the index files that are aggregated into it,
+        removing the entry if there are none
+        :param entry_list: The (key, value) pairs leading to the entry, as returned by list_from_index_path
+        :param entry_files: Paths to the index files of the entry, relative to the database root
+        :param child_keys: Keys of the entry that hold the entries of other index files
+        """
+        parents = []
+        sub_d = index
+        for key, value in entry_list:
+            parents.append((sub_d, key, value))
+            sub_d = sub_d.setdefault(key, {}).setdefault(value, {})
+        for key in list(sub_d):
+            if key not in child_keys:
+                del sub_d[key]
+
+        for rel_path in entry_files:
+            index_path = os.path.join(paths.db_root, rel_path)
+            logger.debug('Reading index {}'.format(index_path))
+            with open(index_path) as index_file:
+                cls.add_to_index(index_path, json.load(index_file), index)
+
+        # Remove the entry, and any of its parents that are left empty
+        for parent, key, value in parents[::-1]:
+            if parent[key][value]:
+                break
+            del parent[key][value]
+            if parent[key]:
+                break
+            del parent[key]
+
     @classmethod
     def build_single_file_index(cls, index_path, d):
         """
@@ -183,7 +331,13 @@ class IndexAggregatorTask(PipelineTask):
         :param d: dictionary to be appended to
         :return:
         """
-        index = json.load(open(index_path))
+        cls.add_to_index(index_path, json.load(open(index_path)), d)
+
+    @classmethod
+    def add_to_index(cls, index_path, index, d):
+        """
+        Adds to the current index "d" the contents "index" of the index file at "index_path"
+        """
         info_list = cls.list_from_index_path(index_path)
 
         sub_d = d
@@ -222,28 +376,42 @@ class IndexAggregatorTask(PipelineTask):
                 raise Exception('Could not locate {} in {}'.format(paths.db_root, index_path))
         return path_list[::-1]
 
+    @classmethod
+    def write_index(cls, protocol, manifest, index):
+        """
+        Writes the aggregated index, followed by its manifest. The manifest is only written along with the index, so
+        that it never describes an index that was not written.
+        """
+        try:
+            with fileutil.atomic_open_with_perms(cls.index_path(protocol)) as f:
+                json.dump(index, f, sort_keys=True, indent=2)
+        except (IOError, OSError):
+            logger.warn('Unable to open file ' + cls.index_path(protocol) + ' with write permissions.')
+            return
+        cls.write_manifest(protocol, manifest)
+
     def run(self, *_):
         for protocol in self.PROTOCOLS:
-            index = self.build_index(protocol)
-            try:
-                with fileutil.open_with_perms(os.path.join(self.PROTOCOLS_DIR, '{}.json'.format(protocol)), 'w') as f:
-                    json.dump(index, f, sort_keys=True, indent=2)
-            except IOError:
-                logger.warn('Unable to open file ' + os.path.join(self.PROTOCOLS_DIR, '{}.json'.format(protocol)) + ' with write permissions.')
+            self.write_index(protocol, *self.build_index(protocol))
+
+    def run_subjects(self, subjects, protocol):
+        """
+        Updates the aggregated index of protocol with the indexes of the given subjects, without searching the
+        directories of any other subject
+        """
+        manifest, index = self.load_manifest(protocol), self.read_index(protocol)
+        if manifest is None or index is None:
+            # Without both, the indexes of the other subjects are not known
+            self.write_index(protocol, *self.build_index(protocol))
+            return
+        for subject in sorted(set(subjects)):
+            subject_dir = os.path.join(self.PROTOCOLS_DIR, protocol, 'subjects', subject)
+            self.update_index(index, manifest, self.find_index_files(subject_dir),
+                              os.path.relpath(subject_dir, paths.db_root))
+        self.write_index(protocol, manifest, index)
 
     def run_single_subject(self, subject, protocol):
-        try:
-            index_file = open(os.path.join(self.PROTOCOLS_DIR, '{}.json'.format(protocol)), 'r')
-            index = json.load(index_file)
-        except:
-            index = {}
-        subject_dir = os.path.join(self.PROTOCOLS_DIR, protocol, 'subjects', subject)
-        subj_index_files = self.find_index_files(subject_dir)
-        for subj_index_file in subj_index_files:
-            self.build_single_file_index(subj_index_file, index)
-
-        with fileutil.open_with_perms(os.path.join(self.PROTOCOLS_DIR, '{}.json'.format(protocol)), 'w') as f:
-            json.dump(index, f, sort_keys=True, indent=2)
+        self.run_subjects([subject], protocol)
 
 
 def change_current(source_folder, *args):
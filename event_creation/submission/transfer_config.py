@@ -7,9 +7,12 @@ import yaml
 import hashlib
 import fileutil
 import shutil
-from collections import defaultdict
+import tempfile
+import time
+from collections import defaultdict, OrderedDict
+from multiprocessing.pool import ThreadPool
 
-from .configuration import paths
+from .configuration import paths, config
 from .log import logger
 from .exc import ConfigurationError
 
@@ -48,6 +51,12 @@ class TransferConfig(object):
         self.filename = filename
         self.groups = groups
         self.kwargs = kwargs
+        self.n_threads = int(config.transfer_threads)
+        self.transfer_mode = config.transfer_mode
+        if self.transfer_mode not in TransferFile.TRANSFER_MODES:
+            raise ConfigurationError("Transfer mode {} not known. Must be one of {}".format(
+                self.transfer_mode, ', '.join(TransferFile.TRANSFER_MODES)))
+        self.timings = OrderedDict()
 
         self._raw_config = yaml.load(open(filename))
         self._files = build_group_index(self._raw_config['files'], groups)
@@ -72,18 +81,66 @@ class TransferConfig(object):
     def get_file(self, name):
         return self._files.get(name)
 
+    def set_checksum_cache(self, cache):
+        for file in self._files.values():
+            file.set_checksum_cache(cache)
+
+    def map_files(self, func, files, step):
+        """
+        Calls func on each of files, on a pool of n_threads threads if n_threads > 1, and records the time each call
+        took under step in timings. Files are independent of each other, so the results (returned in the order of
+        files) are the same either way.
+        """
+        def timed(file):
+            start = time.time()
+            result = func(file)
+            return result, time.time() - start
+
+        if self.n_threads <= 1 or len(files) <= 1:
+            results = [timed(file) for file in files]
+        else:
+            pool = ThreadPool(min(self.n_threads, len(files)))
+            try:
+                results = pool.map(timed, files)
+            finally:
+                pool.close()
+                pool.join()
+
+        for file, (_, elapsed) in zip(files, results):
+            self.timings.setdefault(file.name, OrderedDict())[step] = elapsed
+        return [result for result, _ in results]
+
+    @staticmethod
+    def _locate(file):
+        try:
+            file.locate()
+            return file.located
+        except ConfigurationError:
+            return False
+
     def locate_origin_files(self):
         logger.debug("Locating files {}".format(self._files))
-        for file in self.valid_files:
-            try:
-                file.locate()
-                if file.located:
-                    logger.debug("File {} located".format(file.name))
-                else:
-                    logger.debug("Could not locate {}".format(file.name))
-            except ConfigurationError:
+        files = self.valid_files
+        for file, located in zip(files, self.map_files(self._locate, files, 'locate')):
+            if located:
+                logger.debug("File {} located".format(file.name))
+            else:
                 logger.debug("Could not locate {}".format(file.name))
 
+    def calculate_checksums(self, files):
+        """
+        Calculates the checksums of files (which must be located)
+        :return: The md5 hex digest of each file
+        """
+        return self.map_files(lambda file: file.checksum.hexdigest(), files, 'checksum')
+
+    def timing_report(self):
+        """
+        :return: The time spent locating and checksumming each file
+        """
+        return '\n'.join('{}: {}'.format(name, ', '.join('{} {:.3f} s'.format(step, t) for step, t in steps.items()))
+                         for name, steps in self.timings.items())
+
     def missing_files(self):
         missing_files = []
         for file in self.valid_files:
@@ -107,8 +164,64 @@ class TransferConfig(object):
                     missing_files.append(file)
         return missing_files
 
+class ChecksumCache(object):
+    """
+    On-disk cache of TransferFile checksums. Each checksum is stored along with the (path, size, mtime, inode) of every
+    file whose contents it covers, and is reused for as long as none of those files has changed.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._entries = {}
+        self._modified = False
+        if os.path.exists(filename):
+            try:
+                with open(filename, 'r') as cache_file:
+                    self._entries = json.load(cache_file)
+            except ValueError:
+                logger.warn("Could not read checksum cache {}".format(filename))
+
+    def get(self, name, signature):
+        entry = self._entries.get(name)
+        if entry is not None and entry['files'] == signature:
+            return entry['md5']
+        return None
+
+    def set(self, name, signature, md5):
+        self._entries[name] = dict(files=signature, md5=md5)
+        self._modified = True
+
+    def save(self):
+        """ Writes the cache (if it has changed and its directory exists) through a temporary file """
+        directory = os.path.dirname(self.filename)
+        if not self._modified or not os.path.isdir(directory):
+            return
+        handle, temp_filename = tempfile.mkstemp(dir=directory, prefix='.checksum_cache')
+        with os.fdopen(handle, 'w') as cache_file:
+            json.dump(self._entries, cache_file)
+        os.chmod(temp_filename, 0o644)
+        os.rename(temp_filename, self.filename)
+        self._modified = False
+
+
+class CachedChecksum(object):
+    """ Stands in for the md5 object of a TransferFile whose checksum was found in a ChecksumCache """
+
+    def __init__(self, md5):
+        self._md5 = md5
+
+    def hexdigest(self):
+        return self._md5
+
+
 class TransferFile(object):
 
+    # Contents are read in blocks of this many bytes when calculating checksums
+    CHECKSUM_BLOCK_SIZE = 1 << 20
+
+    # Ways in which files of type 'file' can be placed in the destination (see place_file)
+    TRANSFER_MODES = ('copy', 'reflink', 'hardlink')
+
     REQUIRED_PROPERTIES = ('name', 'type', 'groups', 'multiple', 'required', 'checksum_contents',
                            'origin_directory', 'origin_file', 'destination')
 
@@ -143,6 +256,7 @@ class TransferFile(object):
 
         self._checksum = hashlib.md5()
         self._checksum_calculated = False
+        self._checksum_cache = None
 
         self._transferred_files = []
 
@@ -204,7 +318,17 @@ class TransferFile(object):
 
         return os.path.join(root, destination_directory_name)
 
-    def transfer(self, root):
+    def transfer(self, root, mode='copy', previous_root=None, previous_index=None):
+        """
+        Transfers the origin files into root
+        :param mode: How each file is placed in root: 'copy', 'reflink' (a copy-on-write clone, where the filesystem
+                     supports it) or 'hardlink' (where origin and destination share a filesystem), falling back to
+                     a copy. A hard link shares its contents with the origin file, so is only appropriate where
+                     origin files are not modified once uploaded
+        :param previous_root: Root of the previous transfer of the same files. Unless mode is 'copy', files whose
+                              contents have not changed since then are linked or cloned from there instead
+        :param previous_index: The index of the previous transfer, with the checksums used to identify those files
+        """
         if self.name=='output_log':
             pass
 
@@ -217,10 +341,13 @@ class TransferFile(object):
             fileutil.makedirs(containing_dir)
 
         if self.type == 'directory':
+            previous_containing_dir = self.destination_containing_directory(previous_root) if previous_root else None
             for file in self.files.values():
-                file.transfer(containing_dir)
+                file.transfer(containing_dir, mode, previous_containing_dir, previous_index)
             return
 
+        reuse_previous = mode != 'copy' and previous_root is not None and self.unchanged_since(previous_index)
+
         for origin, destination_dir in zip(self.origin_paths, self.destination_directories):
 
             destination_filename = os.path.split(origin)[-1] if self.multiple else self._destination
@@ -231,9 +358,14 @@ class TransferFile(object):
             if self.type == 'file':
                 if not os.path.exists(os.path.dirname(destination_path)):
                     os.makedirs(os.path.dirname(destination_path))
-                logger.debug("Copying file {} to {}".format(origin, destination_path))
-                shutil.copyfile(origin, destination_path)
-                logger.debug("File {} copied successfully".format(origin))
+                source = origin
+                if reuse_previous:
+                    previous_path = os.path.join(previous_root, destination_dir, destination_filename)
+                    if os.path.isfile(previous_path) and os.path.getsize(previous_path) == os.path.getsize(origin):
+                        source = previous_path
+                logger.debug("Transferring file {} to {}".format(source, destination_path))
+                method = self.place_file(source, destination_path, mode)
+                logger.debug("File {} {} successfully".format(source, method))
                 self._transferred_files.append(destination_path)
 
             elif self.type == 'link':
@@ -245,6 +377,40 @@ class TransferFile(object):
             else:
                 raise ConfigurationError("File type {} not known. Must be 'file', 'directory', or 'link'".format(self.type))
 
+    def unchanged_since(self, index):
+        """
+        Whether the origin files have the same names and, per their checksum, the same contents as in a previous
+        transferred index. Only possible if the checksum covers the contents of the files
+        """
+        if not self._checksum_contents or not index or self.name not in index:
+            return False
+        entry = index[self.name]
+        return ([os.path.basename(filename) for filename in entry.get('origin_files', [])] ==
+                [os.path.basename(filename) for filename in self.origin_paths] and
+                self.matches_transferred_index(entry))
+
+    @staticmethod
+    def place_file(source, destination, mode='copy'):
+        """
+        Places a copy of source at destination, as a hard link or copy-on-write clone if mode allows and the
+        filesystem supports it
+        :return: How the file was placed: 'linked', 'cloned' or 'copied'
+        """
+        if mode == 'hardlink':
+            try:
+                os.link(source, destination)
+                return 'linked'
+            except OSError as e:
+                logger.debug("Could not hard link {}: {}".format(source, e))
+        if mode in ('hardlink', 'reflink'):
+            try:
+                fileutil.reflink(source, destination)
+                return 'cloned'
+            except (IOError, OSError) as e:
+                logger.debug("Could not clone {}: {}".format(source, e))
+        shutil.copyfile(source, destination)
+        return 'copied'
+
 
     @property
     def checksum(self):
@@ -252,26 +418,66 @@ class TransferFile(object):
             self.calculate_checksum()
         return self._checksum
 
+    def set_checksum_cache(self, cache):
+        self._checksum_cache = cache
+        for file in self.files.values():
+            file.set_checksum_cache(cache)
+
     def contents_to_check(self):
-        contents = []
+        """
+        Yields the contents covered by the checksum: the basenames of the origin files or, if checksum_contents,
+        their contents, read CHECKSUM_BLOCK_SIZE bytes at a time
+        """
         if self.located:
             if not self._checksum_contents:
                 for filename in self.origin_paths:
-                    contents.append(os.path.basename(filename))
+                    yield os.path.basename(filename)
             else:
                 for filename in self.origin_paths:
-                    contents.append(open(filename).read())
+                    with open(filename, 'rb') as origin_file:
+                        for block in iter(lambda: origin_file.read(self.CHECKSUM_BLOCK_SIZE), b''):
+                            yield block
 
             for file in self.files.values():
-                contents.extend(file.contents_to_check())
+                for element in file.contents_to_check():
+                    yield element
+
+    def checksum_signature(self):
+        """
+        Describes everything the checksum depends on: the basenames of the origin files or, if checksum_contents,
+        their paths, sizes, modification times and inodes
+        """
+        signature = []
+        if self.located:
+            if not self._checksum_contents:
+                signature.extend([os.path.basename(filename)] for filename in self.origin_paths)
+            else:
+                for filename in self.origin_paths:
+                    stat = os.stat(filename)
+                    signature.append([os.path.abspath(filename), stat.st_size, stat.st_mtime, stat.st_ino])
 
-        return contents
+            for file in self.files.values():
+                signature.append(file.checksum_signature())
+        return signature
 
     def calculate_checksum(self):
+        signature = None
+        if self._checksum_cache is not None:
+            signature = self.checksum_signature()
+            md5 = self._checksum_cache.get(self.name, signature)
+            if md5 is not None:
+                logger.debug("Using cached checksum of {}".format(self.name))
+                self._checksum = CachedChecksum(md5)
+                self._checksum_calculated = True
+                return
+
         for element in self.contents_to_check():
             self._checksum.update(element)
         self._checksum_calculated = True
 
+        if self._checksum_cache is not None:
+            self._checksum_cache.set(self.name, signature, self._checksum.hexdigest())
+
     def format(self, **kwargs):
         new_kwargs  = dict(**kwargs)
 
@@ -10,7 +10,7 @@ from . import fileutil
 from .exc import TransferError
 from .configuration import paths
 from .log import logger
-from .transfer_config import TransferConfig
+from .transfer_config import TransferConfig, ChecksumCache
 from .transfer_inputs import TRANSFER_INPUTS
 
 
@@ -27,6 +27,7 @@ class Transferer(object):
     INDEX_NAME='index.json'
     STRFTIME = '%Y%m%d.%H%M%S'
     TRANSFER_TYPE_NAME='TRANSFER_TYPE'
+    CHECKSUM_CACHE_NAME = '.checksum_cache.json'
 
     JSON_FILES = {}
 
@@ -45,6 +46,8 @@ class Transferer(object):
         self.transferred_filenames = {}
 
         self.transfer_config = TransferConfig(config_filename, groups, **kwargs)
+        self.checksum_cache = ChecksumCache(os.path.join(self.destination_root, self.CHECKSUM_CACHE_NAME))
+        self.transfer_config.set_checksum_cache(self.checksum_cache)
 
         self.old_symlink = None
         self.transfer_aborted = False
@@ -95,6 +98,7 @@ class Transferer(object):
         index = self.transferred_index()
         with fileutil.open_with_perms(os.path.join(self.destination_current, self.INDEX_NAME), 'w') as index_file:
             json.dump(index, index_file, indent=2)
+        self.checksum_cache.save()
 
     def write_transfer_type(self):
         with fileutil.open_with_perms(os.path.join(self.destination_current, self.TRANSFER_TYPE_NAME), 'w') as type_file:
@@ -111,17 +115,26 @@ class Transferer(object):
     def matches_existing_checksum(self):
         old_index = self.load_previous_index()
         self.transfer_config.locate_origin_files()
-        for file in self.transfer_config.located_files():
-
-            if file.name not in old_index:
-                logger.info("Found new file: {}".format(file.name))
-                return False
-
-            if not file.matches_transferred_index(old_index[file.name]):
-                logger.info("Found differing file: {}".format(file.name))
-                return False
-
-        return True
+        try:
+            located_files = self.transfer_config.located_files()
+            # If there are no new files, all checksums are needed, so they are calculated up front (concurrently,
+            # if configured)
+            if all(file.name in old_index for file in located_files):
+                self.transfer_config.calculate_checksums(located_files)
+            logger.debug("Located and checksummed files:\n{}".format(self.transfer_config.timing_report()))
+            for file in located_files:
+
+                if file.name not in old_index:
+                    logger.info("Found new file: {}".format(file.name))
+                    return False
+
+                if not file.matches_transferred_index(old_index[file.name]):
+                    logger.info("Found differing file: {}".format(file.name))
+                    return False
+
+            return True
+        finally:
+            self.checksum_cache.save()
 
     def _transfer_files(self):
         if not os.path.exists(self.destination_root):
@@ -134,8 +147,16 @@ class Transferer(object):
             self.transfer_aborted = True
             raise TransferError("No files to transfer")
 
+        # Unless copying, unchanged files can be linked or cloned from the previous transfer
+        mode = self.transfer_config.transfer_mode
+        previous_root = None
+        previous_index = {}
+        if mode != 'copy' and self.previous_label:
+            previous_root = os.path.join(self.destination_root, self.previous_label)
+            previous_index = self.load_previous_index()
+
         for file in self.transfer_config.located_files():
-            file.transfer(self.destination_labelled)
+            file.transfer(self.destination_labelled, mode, previous_root, previous_index)
             self.transferred_files.append(file)
             self.transferred_filenames.update(file.transferred_filenames())
 
@@ -4,7 +4,9 @@ import json
 import numpy
 import unicodedata
 from collections import defaultdict
+from operator import itemgetter
 import re
+import io
 
 PPRINT_PADDING = 2
 
@@ -97,11 +99,98 @@ class MyEncoder(json.JSONEncoder):
         else:
             return super(MyEncoder, self).default(obj)
 
-def to_json(arr, fp=None):
+def to_json_dict(arr):
+    """
+    Converts a recarray to the same list of dicts as to_dict, but with native Python values, converting one field
+    at a time with tolist() instead of one record at a time. Falls back to to_dict for dtypes it does not handle.
+    """
+    if arr.ndim != 1 or not arr.dtype.names:
+        return to_dict(arr)
+    records = arr.view(np.ndarray)
+    if '_remove' in records.dtype.names:
+        records = records[records['_remove'] == 0]
+    dicts = _records_to_dicts(records)
+    return dicts if dicts is not None else to_dict(arr)
+
+def _records_to_dicts(arr):
+    names = [name for name in arr.dtype.names if name != '_remove']
+    columns = []
+    for name in names:
+        column = _column_to_list(arr[name], arr.dtype.fields[name][0])
+        if column is None:
+            return None
+        columns.append(column)
+    return [dict(zip(names, values)) for values in zip(*columns)] if columns else [{} for _ in range(len(arr))]
+
+def _column_to_list(column, dtype):
+    """
+    Converts one field of a recarray to a list with one value per record, or returns None if to_dict should be used
+    """
+    base, shape = dtype.base, dtype.shape
+    if not base.names:
+        return column.tolist()
+    if shape == ():
+        # Single sub-records become a dict of all their fields (including _remove), as in to_dict
+        if any(base.fields[name][0].base.names for name in base.names):
+            return None
+        values = zip(*[column[name].tolist() for name in base.names])
+        return [dict(zip(base.names, record_values)) for record_values in values]
+    if len(shape) == 1 and shape[0] > 1:
+        # Arrays of sub-records become a list of dicts, without the sub-records flagged in _remove
+        flat = column.reshape(-1)
+        if '_remove' in base.names:
+            keep = flat['_remove'] == 0
+            flat = flat[keep]
+            ends = np.cumsum(keep.reshape(-1, shape[0]).sum(1)).tolist()
+        else:
+            ends = range(shape[0], len(flat) + 1, shape[0])
+        dicts = _records_to_dicts(flat)
+        if dicts is None:
+            return None
+        return [dicts[start:end] for start, end in zip([0] + list(ends[:-1]), ends)]
+    return None
+
+def to_json(arr, fp=None, compact=False):
+    """
+    Serializes a recarray to JSON, sorted by key and indented by 2 spaces, or on a single line if compact
+    :param arr: recarray to serialize
+    :param fp: File object to write to. If not given, the JSON is returned as a string
+    :param compact: Whether to leave out indentation and whitespace
+    """
+    kwargs = {'separators': (',', ':')} if compact else {'indent': 2}
     if fp:
-        json.dump(to_dict(arr), fp, cls=MyEncoder, indent=2, sort_keys=True)
+        json.dump(to_json_dict(arr), fp, cls=MyEncoder, sort_keys=True, **kwargs)
     else:
-        return json.dumps(to_dict(arr), cls=MyEncoder, indent=2, sort_keys=True)
+        return json.dumps(to_json_dict(arr), cls=MyEncoder, sort_keys=True, **kwargs)
+
+def to_npy(arr, fp=None):
+    """
+    Saves a recarray in .npy format, keeping its (possibly nested) dtype. As with to_json, records flagged in
+    '_remove' are dropped along with the '_remove' field itself.
+    :param arr: recarray to save
+    :param fp: File object to write to. If not given, the contents are returned as a string
+    """
+    if arr.ndim == 0:
+        arr = arr.reshape(-1)[:0]
+    arr = arr.view(np.ndarray)
+    if arr.dtype.names and '_remove' in arr.dtype.names:
+        names = [name for name in arr.dtype.names if name != '_remove']
+        kept = arr[~arr['_remove'].astype(bool)]
+        arr = np.zeros(len(kept), [(name, arr.dtype.fields[name][0]) for name in names])
+        for name in names:
+            arr[name] = kept[name]
+    if fp:
+        np.save(fp, arr, allow_pickle=False)
+    else:
+        buf = io.BytesIO()
+        np.save(buf, arr, allow_pickle=False)
+        return buf.getvalue()
+
+def from_npy(npy_filename):
+    """
+    Loads a recarray saved with to_npy
+    """
+    return np.load(npy_filename, allow_pickle=False).view(np.recarray)
 
 def get_element_dtype(element):
     if isinstance(element, dict):
@@ -151,6 +240,9 @@ def from_json(json_filename):
 def from_dict(d,dtypes=None):
     if not isinstance(d, list):
         d = [d]
+    if len(d) == 0:
+        # As for a single empty record, e.g. the events file of a session without events
+        return np.array([]).view(np.recarray)
 
     list_names = []
 
@@ -160,14 +252,16 @@ def from_dict(d,dtypes=None):
 
     list_info = defaultdict(lambda *_: {'len': 0, 'dtype': None})
 
-    for entry in d:
-        for k in list_names:
-            list_info[k]['len'] = max(list_info[k]['len'], len(entry[k]))
-            if not list_info[k]['dtype'] and len(entry[k]) > 0:
-                if isinstance(entry[k][0], dict):
-                    list_info[k]['dtype'] = mkdtype(entry[k][0])
-                else:
-                    list_info[k]['dtype'] = get_element_dtype(entry[k])
+    for k in list_names:
+        lists = [entry[k] for entry in d]
+        list_info[k]['len'] = max(map(len, lists))
+        # The element dtype is inferred once, from the first non-empty list
+        first = next((v for v in lists if len(v) > 0), None)
+        if first is not None:
+            if isinstance(first[0], dict):
+                list_info[k]['dtype'] = mkdtype(first[0])
+            else:
+                list_info[k]['dtype'] = get_element_dtype(first)
     if dtypes is None:
         dtypes = []
         for k, v in d[0].items():
@@ -178,7 +272,13 @@ def from_dict(d,dtypes=None):
 
     if dtypes:
         arr = np.zeros(len(d), dtypes).view(np.recarray)
-        copy_values(d, arr, list_info)
+        try:
+            fill_columns(d, arr, list_info)
+        except (TypeError, ValueError):
+            # fill_columns raises TypeError for records that copy_values treats differently, and numpy raises TypeError
+            # or ValueError for columns that cannot be assigned at once. These are copied (or fail) exactly as before.
+            arr = np.zeros(len(d), dtypes).view(np.recarray)
+            copy_values(d, arr, list_info)
     else:
         arr = np.array([])
     return arr.view(np.recarray)
@@ -220,6 +320,98 @@ def copy_values(dict_list, rec_arr, list_info=None):
     for k, v in dict_fields.items():
         copy_values( v, rec_arr[k])
 
+def fill_columns(dict_list, rec_arr, list_info=None):
+    """
+    Columnar equivalent of copy_values: gathers the values of each field from all the dicts and assigns them with
+    a single assignment per field. Accents are only stripped from strings that are not plain ASCII.
+    Raises an exception for input that copy_values would treat differently (e.g. a dict where the first record has
+    a scalar), in which case rec_arr may be partially filled.
+    """
+    if len(dict_list) == 0:
+        return
+
+    first = dict_list[0]
+    keys = list(set().union(*dict_list))
+    complete = min(map(len, dict_list)) == len(keys)
+    if complete:
+        # Transpose the records into columns in one pass
+        get_values = itemgetter(*keys)
+        columns = zip(*map(get_values, dict_list)) if len(keys) > 1 else [map(get_values, dict_list)]
+        columns = dict(zip(keys, map(list, columns)))
+    for k in keys:
+        if isinstance(first.get(k), dict):
+            sub_dicts = columns[k] if complete else [sub_dict[k] for sub_dict in dict_list]
+            if not _all_of_type(sub_dicts, dict):
+                raise TypeError('Field {} is not a dict in every record'.format(k))
+            fill_columns(sub_dicts, rec_arr[k])
+            continue
+
+        rows = None
+        if complete:
+            values = columns[k]
+        else:
+            rows = [i for i, sub_dict in enumerate(dict_list) if k in sub_dict]
+            values = [dict_list[i][k] for i in rows]
+
+        if list_info and k in list_info:
+            column = _list_column(values, list_info[k])
+        else:
+            types = set(map(type, values))
+            if any(issubclass(t, (dict, list)) for t in types):
+                raise TypeError('Field {} has nested values'.format(k))
+            if rec_arr.dtype.fields[k][0].kind in 'SUO' and any(issubclass(t, basestring) for t in types):
+                values = _strip_column(values, types)
+            column = values
+
+        if rows is None:
+            rec_arr[k] = column
+        else:
+            rec_arr[k][rows] = column
+
+def _all_of_type(values, cls):
+    return all(issubclass(t, cls) for t in set(map(type, values)))
+
+def _strip_column(values, types):
+    """
+    Applies strip_accents to the strings in values that are not plain ASCII
+    """
+    if all(issubclass(t, basestring) for t in types):
+        try:
+            u''.join(values).encode('ascii')
+            return values
+        except UnicodeError:
+            pass
+    return [strip_accents(v) if isinstance(v, basestring) and not _is_ascii(v) else v for v in values]
+
+def _list_column(lists, info):
+    """
+    Builds the (records x list length) array that copy_values would assign to a list field one record at a time
+    """
+    block = np.zeros((len(lists), info['len']), info['dtype'])
+    lengths = [len(v) for v in lists]
+    elements = [element for v in lists for element in v]
+    if elements:
+        rows = np.repeat(np.arange(len(lists)), lengths)
+        cols = np.arange(len(elements)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        if isinstance(elements[0], dict):
+            if not _all_of_type(elements, dict):
+                raise TypeError('List elements are not all dicts')
+            flat = np.zeros(len(elements), info['dtype'])
+            fill_columns(elements, flat)
+        else:
+            if any(issubclass(t, (dict, list)) for t in set(map(type, elements))):
+                raise TypeError('List elements are nested')
+            flat = elements
+        block[rows, cols] = flat
+    return block
+
+def _is_ascii(s):
+    try:
+        s.encode('ascii')
+        return True
+    except UnicodeError:
+        return False
+
 def strip_accents(s):
     try:
         return str(''.join(c for c in unicodedata.normalize('NFD', unicode(s))
@@ -1,5 +1,10 @@
+import os
 import sys
 
+import pytest
+
+from ..submission.transfer_config import TransferFile
+
 from_test = False
 
 this  = sys.modules[__name__]
@@ -11,6 +16,49 @@ def pytest_configure(config):
 def pytest_unconfigure(config):
     this.from_test = False
 
+
+class RecordingPipeline(object):
+    """ Records the files registered by tasks, in place of a pipeline """
+
+    def __init__(self):
+        self.outputs = {}
+
+    def register_output(self, filename, label):
+        self.outputs[label] = filename
+
+
+@pytest.fixture
+def pipeline():
+    return RecordingPipeline()
+
+
+@pytest.fixture
+def origin_dir(tmpdir):
+    """ A directory of raw EEG files to transfer """
+    origin = tmpdir.mkdir('origin')
+    for i in range(3):
+        origin.join('raw_{}.ns2'.format(i)).write(os.urandom(300000 + i), mode='wb')
+    return str(origin)
+
+
+@pytest.fixture
+def make_transfer_file(origin_dir):
+    """
+    :return: Function returning a located TransferFile for the files in origin_dir, checksummed through cache if given
+    """
+    def make(cache=None):
+        transfer_file = TransferFile(name='raw_eeg', type='file', groups=[], multiple=True, required=True,
+                                     checksum_contents=True, origin_directory=origin_dir, origin_file='*.ns2',
+                                     destination='raw_eeg/')
+        transfer_file.expand_files(())
+        transfer_file.format()
+        transfer_file.locate()
+        if cache is not None:
+            transfer_file.set_checksum_cache(cache)
+        return transfer_file
+    return make
+
+
 if __name__ == '__main__':
     pytest_configure(None)
     print(from_test)
\ No newline at end of file
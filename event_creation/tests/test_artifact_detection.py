@@ -0,0 +1,165 @@
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+from ..submission.detection.artifact_detection import ArtifactDetector, _init_worker
+from ..submission.helpers import butter_filt
+
+
+CHANNELS = ['001', '002', '003', '127']
+SAMPLE_RATE = 500
+N_SAMPLES = 3000
+# The find_bad_events parameters in milliseconds, and the equivalent get_event_eeg parameters in samples
+DETECTION_ARGS = (100, -20, 40, [[58, 62]])
+LOAD_ARGS = (50, -10, 20, [[58, 62]])
+
+EVENT_DTYPE = [('type', 'S20'), ('eegfile', 'S256'), ('eegoffset', 'int64'), ('badEvent', 'b1'),
+               ('badEventChannel', 'S8', 132)]
+
+
+def write_recording(rng, noreref_dir, reref_dir, basename):
+    for chan in CHANNELS:
+        data = rng.randint(-2000, 2000, N_SAMPLES).astype('int16')
+        # Add a few large artifacts
+        data[rng.randint(0, N_SAMPLES, 10)] = rng.choice([-30000, 30000], 10)
+        data.tofile(os.path.join(noreref_dir, basename + '.' + chan))
+    rng.randint(-100, 100, N_SAMPLES).astype('int16').tofile(os.path.join(reref_dir, basename + '.ref'))
+
+
+def make_detector(tmpdir, basenames, seed=0):
+    rng = np.random.RandomState(seed)
+    noreref_dir, reref_dir = str(tmpdir.mkdir('noreref')), str(tmpdir.mkdir('reref'))
+    with open(os.path.join(reref_dir, 'params.txt'), 'w') as params_file:
+        params_file.write('samplerate {}\ndataformat int16\nsystem EGI'.format(SAMPLE_RATE))
+    for basename in basenames:
+        write_recording(rng, noreref_dir, reref_dir, basename)
+    # Events interleave the recordings, and include one event right at the start of a recording and one without eeg
+    events = np.zeros(40, dtype=EVENT_DTYPE).view(np.recarray)
+    events.type = ['WORD' if i % 3 else 'REC_WORD' for i in range(len(events))]
+    events.eegfile = [basenames[i % len(basenames)] for i in range(len(events))]
+    events.eegoffset = rng.randint(0, N_SAMPLES - 200, len(events))
+    events.eegoffset[0] = 5
+    events.eegfile[-1] = ''
+    return ArtifactDetector(events, basenames, noreref_dir, reref_dir, n_workers=0)
+
+
+def per_event_eeg(detector, chan, events, ev_length, offset, buff, filtfreq):
+    """ Reads and filters one event at a time, all from the recording of the first event with eeg """
+    len_with_buffer = ev_length + 3 * buff
+    offsets = (offset - buff + events.eegoffset)
+    offsets[np.where(offsets < 0)[0]] = 0
+    data = np.zeros((len(events), len_with_buffer))
+    chan_data = None
+    for i in range(len(events)):
+        if events[i].eegfile == '':
+            continue
+        if chan_data is None:
+            ref = np.fromfile(os.path.join(detector.reref_dir, events[i].eegfile + '.ref'), detector.data_fmt)
+            chan_data = np.fromfile(os.path.join(detector.noreref_dir, events[i].eegfile) + '.' + str(chan),
+                                    detector.data_fmt).astype('float') - ref
+        data[i] = chan_data[offsets[i]:offsets[i]+len_with_buffer]
+        data[i] = butter_filt(data[i], filtfreq, detector.sample_rate, filt_type='bandstop', order=1)
+    return data[:, buff:buff + ev_length]
+
+
+def dense_bad_events(detector, chans, ev_length, offset, buff, filtfreq):
+    """ Thresholds the eeg of every channel, loaded into a single array """
+    data = np.array([detector.get_event_eeg(chan, detector.events, ev_length, offset, buff, filtfreq)
+                     for chan in chans])
+    pres_ev_ind = np.where(np.logical_and(detector.events.type == 'WORD', detector.events.eegfile != ''))[0]
+    chans_to_use = np.where(np.array([(chan not in detector.weak_chans) for chan in chans]))[0]
+    data_to_use = data[np.ix_(chans_to_use, pres_ev_ind, )]
+    avg = data_to_use.mean()
+    stddev = data_to_use.std()
+    return avg, stddev, np.logical_or(data > avg + 4 * stddev, data < avg - 4 * stddev).any(2)
+
+
+def bad_event_channels(events):
+    return [set(chan for chan in event.badEventChannel if chan != '') for event in events]
+
+
+def test_event_eeg_matches_per_event_filtering(tmpdir):
+    detector = make_detector(tmpdir, ['R1001P_FR1_0'])
+    for chan in CHANNELS:
+        expected = per_event_eeg(detector, chan, detector.events, *LOAD_ARGS)
+        np.testing.assert_allclose(detector.get_event_eeg(chan, detector.events, *LOAD_ARGS), expected)
+
+
+def test_event_eeg_reads_each_events_recording(tmpdir):
+    # get_event_eeg reads each event from its own recording, so it matches per_event_eeg run on each recording's events
+    basenames = ['R1001P_FR1_0_part0', 'R1001P_FR1_0_part1']
+    detector = make_detector(tmpdir, basenames)
+    events = detector.events
+    data = detector.get_event_eeg('002', events, *LOAD_ARGS)
+    for basename in basenames:
+        ev_inds = np.where(events.eegfile == basename)[0]
+        np.testing.assert_allclose(data[ev_inds], per_event_eeg(detector, '002', events[ev_inds], *LOAD_ARGS))
+    assert not data[events.eegfile == ''].any()
+
+
+def test_thresholds_match_dense_thresholds(tmpdir):
+    detector = make_detector(tmpdir, ['R1001P_FR1_0'])
+    avg, stddev, bad_evchans = dense_bad_events(detector, CHANNELS, *LOAD_ARGS)
+    expected = [set(np.array(CHANNELS)[bad_evchans[:, i]]) for i in range(len(detector.events))]
+    assert any(expected) and not all(expected)
+
+    detector.find_bad_events(*DETECTION_ARGS)
+    saved_avg, saved_stddev = np.loadtxt(os.path.join(detector.reref_dir, 'mean_stddev.txt'))
+    np.testing.assert_allclose([saved_avg, saved_stddev], [avg, stddev])
+    assert bad_event_channels(detector.events) == expected
+    assert list(detector.events.badEvent) == [bool(chans) for chans in expected]
+
+    # Thresholds loaded from the saved mean and standard deviation find the same events
+    detector.events.badEvent = False
+    detector.events.badEventChannel = ''
+    detector.find_bad_events(*DETECTION_ARGS)
+    assert bad_event_channels(detector.events) == expected
+
+
+def test_merged_moments_match_numpy():
+    rng = np.random.RandomState(0)
+    chunks = [rng.normal(rng.uniform(-100, 100), rng.uniform(1, 50), size) for size in (0, 1, 7, 1000, 0, 20000, 3)]
+    count, avg, sq_dev = 0, 0., 0.
+    for chunk in chunks:
+        count, avg, sq_dev = ArtifactDetector.merge_moments((count, avg, sq_dev), ArtifactDetector.moments(chunk))
+    all_samples = np.concatenate(chunks)
+    assert count == all_samples.size
+    np.testing.assert_allclose(avg, np.mean(all_samples))
+    np.testing.assert_allclose(np.sqrt(sq_dev / count), np.std(all_samples))
+
+
+def test_pooled_channels_match_serial(tmpdir):
+    detector = make_detector(tmpdir, ['R1001P_FR1_0'])
+    args_list = [(chan, np.arange(0, len(detector.events), 2)) + LOAD_ARGS for chan in CHANNELS]
+    serial = detector.map_channels('channel_summary', args_list)
+
+    detector._pool = Pool(2, initializer=_init_worker, initargs=(detector,))
+    try:
+        pooled = detector.map_channels('channel_summary', args_list)
+    finally:
+        detector._pool.close()
+        detector._pool.join()
+        detector._pool = None
+
+    assert len(pooled) == len(serial)
+    for (pooled_moments, pooled_max, pooled_min), (moments, ev_max, ev_min) in zip(pooled, serial):
+        assert pooled_moments == moments
+        assert np.array_equal(pooled_max, ev_max) and np.array_equal(pooled_min, ev_min)
+
+
+def test_open_eeg_file(tmpdir):
+    detector = make_detector(tmpdir, ['R1001P_FR1_0'])
+    path = os.path.join(detector.noreref_dir, 'R1001P_FR1_0.001')
+    data = detector.open_eeg_file(path)
+    assert isinstance(data, np.memmap) and not data.flags.writeable
+    assert data.dtype == np.dtype('int16')
+    assert np.array_equal(data, np.fromfile(path, 'int16'))
+    assert np.array_equal(detector.ref_chans['R1001P_FR1_0'],
+                          np.fromfile(os.path.join(detector.reref_dir, 'R1001P_FR1_0.ref'), 'int16'))
+
+    # Empty files cannot be memory mapped
+    empty_path = str(tmpdir.join('empty.001'))
+    open(empty_path, 'wb').close()
+    empty = detector.open_eeg_file(empty_path)
+    assert empty.shape == (0,) and empty.dtype == np.dtype('int16')
@@ -0,0 +1,81 @@
+import numpy as np
+from numpy.lib import recfunctions
+
+from ..submission.events_tasks import EventCombinationTask
+from ..submission.parsers.base_log_parser import EventCombiner
+from ..submission.viewers.recarray import to_dict, from_dict, to_json, from_json
+
+
+def dict_combine(events, sort_field='mstime'):
+    """ Combines the events as lists of dicts, giving each the keys of the others with EventCombiner.get_default """
+    all_dict_events = []
+    for these_events in events:
+        dict_events = to_dict(these_events)
+        if len(all_dict_events) > 0:
+            for key in [k for k in dict_events[0].keys() if k not in all_dict_events[0].keys()]:
+                default = EventCombiner.get_default(dict_events[0][key])
+                for event in all_dict_events:
+                    event[key] = default
+            for key in [k for k in all_dict_events[0].keys() if k not in dict_events[0].keys()]:
+                default = EventCombiner.get_default(all_dict_events[0][key])
+                for event in dict_events:
+                    event[key] = default
+        all_dict_events += dict_events
+    all_dict_events = sorted(all_dict_events, key=lambda d: d[sort_field])
+    dtypes = EventCombiner(events).combine_dtypes([e.dtype for e in events])
+    return from_dict(all_dict_events, dtypes=dtypes)
+
+
+def make_task_events(n, rng):
+    events = [{'type': str(rng.choice(['WORD', 'REC_WORD'])), 'mstime': int(rng.randint(0, 10 ** 6)),
+               'list': int(rng.randint(1, 25)), 'item_name': str(rng.choice(['CAT', 'DOG'])),
+               'recalled': int(rng.randint(0, 2)), 'rectime': float(rng.rand()),
+               'stim_params': [{'amplitude': 0.5, 'anode_label': 'LA1'}] * int(rng.randint(0, 3))}
+              for _ in range(n)]
+    events[0]['stim_params'] = [{'amplitude': 0.5, 'anode_label': 'LA1'}]
+    return from_dict(events)
+
+
+def make_math_events(n, rng):
+    return from_dict([{'type': 'PROB', 'mstime': int(rng.randint(0, 10 ** 6)), 'list': 1,
+                       'answer': int(rng.randint(0, 99)), 'test': [1, 2, 3], 'iscorrect': 1, 'rectime': 1.5}
+                      for _ in range(n)])
+
+
+def test_combine_matches_dicts():
+    rng = np.random.RandomState(0)
+    events = [make_task_events(300, rng), make_math_events(100, rng)]
+    combined = EventCombiner(events).combine()
+    expected = dict_combine(events)
+    assert combined.dtype == expected.dtype
+    for name in expected.dtype.names:
+        assert (combined[name] == expected[name]).all(), name
+    assert (combined[combined.type == 'PROB'].item_name == '').all()
+    assert (combined[combined.type == 'PROB'].recalled == -999).all()
+
+
+def test_combine_drops_removed_events():
+    rng = np.random.RandomState(1)
+    task_events = make_task_events(10, rng)
+    task_events = recfunctions.append_fields(task_events, '_remove', np.arange(10) % 2, usemask=False,
+                                             asrecarray=True)
+    combined = EventCombiner([task_events, make_math_events(5, rng)]).combine()
+    assert len(combined) == 10
+    assert (np.diff(combined.mstime) >= 0).all()
+
+
+def test_combination_task_with_empty_events_file(tmpdir, pipeline):
+    rng = np.random.RandomState(2)
+    task_events = make_task_events(10, rng)
+    # The math events of a session without math, as written by the parser
+    for label, events in (('task', task_events), ('math', make_math_events(5, rng)[:0])):
+        with open(str(tmpdir.join('{}_events.json'.format(label))), 'w') as events_file:
+            to_json(events, events_file)
+
+    task = EventCombinationTask(['task', 'math'], sort_field='mstime')
+    task.set_pipeline(pipeline)
+    task.run({}, str(tmpdir))
+    assert pipeline.outputs == {'all_events': 'all_events.json'}
+    combined = from_json(str(tmpdir.join('all_events.json')))
+    assert len(combined) == 10
+    assert (combined.mstime == np.sort(task_events.mstime)).all()
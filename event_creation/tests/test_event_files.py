@@ -0,0 +1,42 @@
+import json
+import os
+
+import numpy as np
+
+from ..submission.configuration import config
+from ..submission.tasks import PipelineTask
+from ..submission.viewers.recarray import from_npy
+
+
+def make_task(destination, pipeline):
+    task = PipelineTask()
+    task.set_pipeline(pipeline)
+    task.destination = destination
+    return task
+
+
+def make_events():
+    events = np.zeros(3, [('type', 'S64'), ('mstime', 'i8')]).view(np.recarray)
+    events.type = ['WORD', 'REC_WORD', 'WORD']
+    events.mstime = [1000, 2000, 3000]
+    return events
+
+
+def test_npy_events_are_opt_in(tmpdir, pipeline):
+    assert config.write_npy_events is False
+    task = make_task(str(tmpdir), pipeline)
+    task.create_event_files('task_events.json', make_events(), 'task_events')
+    assert os.listdir(str(tmpdir)) == ['task_events.json']
+    assert task.pipeline.outputs == {'task_events': 'task_events.json'}
+    assert [event['mstime'] for event in json.load(open(str(tmpdir.join('task_events.json'))))] == [1000, 2000, 3000]
+
+
+def test_write_npy_events(tmpdir, pipeline, monkeypatch):
+    monkeypatch.setitem(config.options, 'write_npy_events', True)
+    events = make_events()
+    task = make_task(str(tmpdir), pipeline)
+    task.create_event_files('task_events.json', events, 'task_events')
+    assert sorted(os.listdir(str(tmpdir))) == ['task_events.json', 'task_events.npy']
+    assert task.pipeline.outputs == {'task_events': 'task_events.json', 'task_events_npy': 'task_events.npy'}
+    npy_events = from_npy(str(tmpdir.join('task_events.npy')))
+    assert npy_events.dtype == events.dtype and np.array_equal(npy_events, events)
@@ -0,0 +1,111 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ..submission.configuration import config
+from ..submission.parsers.hostpc_parsers import BaseHostPCLogParser
+from ..submission.parsers.ps_log_parser import LocationSearchLogParser
+from ..submission.readers import event_log
+
+
+EVENTS = [
+    {'type': 'HEARTBEAT', 'orig_timestamp': 10.0},
+    {'type': 'STATE', 'orig_timestamp': 11.0, 'session': 0, 'msg_stub': {
+        'name': 'ENCODING', 'event_label': 'WORD', 'list': 1,
+        'data': {'word': 'CAT', 'serialpos': 1, 'list': 1, 'note': None, 'is_stim': False}}},
+    {'type': 'STATE', 'session': 0, 'msg_stub': {
+        'name': 'ENCODING', 'event_label': 'WORD', 'list': 1,
+        'data': {'word': 'DOG', 'serialpos': None, 'phase': 'BASELINE', 'list': 1, 'note': None, 'is_stim': True}}},
+    {'type': 'STIM', 'orig_timestamp': 13.5, 'index': 7, 'session': 0, 'msg_stub': {
+        'name': 'STIM', 'list': 2, 'data': {'list': 2, 'amplitude': 0.5, 'note': None}}},
+    {'type': 'STIM', 'orig_timestamp': 14, 'index': 8, 'session': 0, 'msg_stub': {
+        'name': 'STIM', 'list': 2.5, 'data': {'list': 2, 'amplitude': 1, 'note': None}}},
+]
+
+
+def pandas_records(events, include_stubs):
+    """ Reads the records through DataFrames, as the parser did before PandasColumns """
+    contents = pd.DataFrame.from_records(events).dropna(subset=['msg_stub']).reset_index()
+    frames = [contents]
+    if include_stubs:
+        frames.append(pd.DataFrame.from_records([msg for msg in contents.msg_stub]))
+    frames.append(pd.DataFrame.from_records([msg.get('data', {}) for msg in contents.msg_stub]))
+    contents = pd.concat(frames, axis=1)
+    contents['orig_timestamp'].fillna(-1, inplace=True)
+    return [e.to_dict() for _, e in contents.iterrows()]
+
+
+def same_value(a, b):
+    if isinstance(a, float) and isinstance(b, float) and np.isnan(a) and np.isnan(b):
+        return True
+    # pandas upcasts the integers of numeric columns with missing or float values to floats
+    return type(a) is type(b) and a == b
+
+
+def assert_same_records(records, expected):
+    assert len(records) == len(expected)
+    for record, reference in zip(records, expected):
+        assert set(record) == set(reference)
+        for key in reference:
+            assert same_value(record[key], reference[key]), key
+
+
+@pytest.mark.parametrize('include_stubs', [True, False])
+def test_records_match_pandas(include_stubs):
+    parser = BaseHostPCLogParser.__new__(BaseHostPCLogParser)
+    records = parser._records_from_events(lambda: iter(EVENTS), include_stubs)
+    assert_same_records(records, pandas_records(EVENTS, include_stubs))
+
+
+@pytest.mark.parametrize('stream', [False, True], ids=['loaded', 'streamed'])
+def test_read_primary_log(tmpdir, monkeypatch, stream):
+    if stream:
+        pytest.importorskip('ijson')
+    monkeypatch.setitem(config.options, 'stream_event_logs', stream)
+    log = tmpdir.join('event_log.json')
+    log.write(json.dumps({'events': EVENTS}))
+    event_log.clear_cache()
+    parser = BaseHostPCLogParser.__new__(BaseHostPCLogParser)
+    parser._primary_log = str(log)
+    assert_same_records(parser._read_primary_log(), pandas_records(EVENTS, True))
+    # A streamed log is never loaded as a whole
+    assert len(event_log._cache) == (0 if stream else 1)
+
+
+def test_streamed_events_match_json(tmpdir):
+    pytest.importorskip('ijson')
+    log = tmpdir.join('event_log.json')
+    log.write(json.dumps({'events': EVENTS}))
+    event_log.clear_cache()
+    streamed = list(event_log.iter_events(str(log), stream=True))
+    # Non-integers are floats, as with json.load, rather than the Decimals ijson yields
+    assert json.dumps(streamed, sort_keys=True) == json.dumps(EVENTS, sort_keys=True)
+
+
+def test_event_log_cached_until_modified(tmpdir):
+    log = tmpdir.join('event_log.json')
+    log.write(json.dumps({'events': EVENTS, 'versions': {'Ramulator': '3.3.0'}}))
+    event_log.clear_cache()
+    document = event_log.load_event_log(str(log))
+    assert event_log.load_event_log(str(log)) is document
+    assert event_log.load_versions(str(log)) == {'Ramulator': '3.3.0'}
+
+    log.write(json.dumps({'events': EVENTS[:1], 'versions': {'Ramulator': '3.4.0'}}))
+    log.setmtime(log.mtime() + 10)
+    assert event_log.load_versions(str(log)) == {'Ramulator': '3.4.0'}
+    assert len(event_log._cache) == 1
+
+
+def test_parsing_leaves_cached_log_unchanged(tmpdir):
+    log = tmpdir.join('event_log.json')
+    log.write(json.dumps({'events': EVENTS}))
+    event_log.clear_cache()
+    parser = LocationSearchLogParser.__new__(LocationSearchLogParser)
+    parser._primary_log = [str(log)]
+    for event_json in parser._read_primary_log():
+        # As in BaseHostPCLogParser.event_stim
+        event_json[parser._MSTIME_FIELD] = -1
+    assert event_log.load_event_log(str(log))['events'] == EVENTS
+    assert list(event_log.iter_events(str(log))) == EVENTS
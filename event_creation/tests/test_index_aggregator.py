@@ -0,0 +1,142 @@
+import json
+import os
+
+import pytest
+
+from ..submission.configuration import paths
+from ..submission.tasks import IndexAggregatorTask
+
+
+def write_index(db_root, entry_dir, info, processed='20170101.120000_processed', index_type='behavioral'):
+    type_dir = os.path.join(db_root, 'protocols', 'r1', 'subjects', entry_dir, index_type)
+    processed_dir = os.path.join(type_dir, processed)
+    os.makedirs(processed_dir)
+    with open(os.path.join(processed_dir, 'index.json'), 'w') as index_file:
+        json.dump({'files': {'all_events': 'all_events.json'}, 'info': info}, index_file)
+    current = os.path.join(type_dir, 'current_processed')
+    if os.path.islink(current):
+        os.unlink(current)
+    os.symlink(processed, current)
+
+
+def write_session_index(db_root, subject, session, processed='20170101.120000_processed'):
+    write_index(db_root, os.path.join(subject, 'experiments', 'FR1', 'sessions', str(session)), {'session': session},
+                processed)
+
+
+def index_path(subject, session):
+    return os.path.join('protocols', 'r1', 'subjects', subject, 'experiments', 'FR1', 'sessions', str(session),
+                        'behavioral', 'current_processed', 'index.json')
+
+
+def full_index(protocol):
+    """ Aggregates the protocol from scratch, reading every index file under it """
+    d = {}
+    for index_file in IndexAggregatorTask.find_index_files(os.path.join(IndexAggregatorTask.PROTOCOLS_DIR, protocol)):
+        IndexAggregatorTask.build_single_file_index(index_file, d)
+    return d
+
+
+def read_index():
+    with open(os.path.join(IndexAggregatorTask.PROTOCOLS_DIR, 'r1.json')) as index_file:
+        return json.load(index_file)
+
+
+@pytest.fixture
+def db_root(tmpdir, monkeypatch):
+    db_root = str(tmpdir)
+    monkeypatch.setattr(paths, 'db_root', db_root)
+    monkeypatch.setattr(IndexAggregatorTask, 'PROTOCOLS_DIR', os.path.join(db_root, 'protocols'))
+    monkeypatch.setattr(IndexAggregatorTask, 'PROTOCOLS', ('r1',))
+    for subject in ('R1001P', 'R1002P'):
+        for session in range(2):
+            write_session_index(db_root, subject, session)
+    return db_root
+
+
+@pytest.fixture
+def read_indexes(monkeypatch):
+    """ Records the path of each index file added to an aggregated index """
+    read = []
+    add_to_index = IndexAggregatorTask.add_to_index.__func__
+
+    def recording_add_to_index(cls, index_path, index, d):
+        read.append(os.path.relpath(index_path, paths.db_root))
+        add_to_index(cls, index_path, index, d)
+    monkeypatch.setattr(IndexAggregatorTask, 'add_to_index', classmethod(recording_add_to_index))
+    return read
+
+
+def test_aggregate_only_rereads_changed_indexes(db_root, read_indexes):
+    IndexAggregatorTask().run()
+    assert read_index() == full_index('r1')
+    # The manifest only holds the signature of each index
+    manifest = IndexAggregatorTask.load_manifest('r1')
+    assert sorted(manifest) == sorted(index_path(subject, session)
+                                      for subject in ('R1001P', 'R1002P') for session in range(2))
+    assert manifest[index_path('R1001P', 0)] == IndexAggregatorTask.index_signature(
+        os.path.join(db_root, index_path('R1001P', 0)))
+
+    write_session_index(db_root, 'R1002P', 1, processed='20170102.120000_processed')
+    write_session_index(db_root, 'R1003P', 0)
+    os.unlink(os.path.join(db_root, os.path.dirname(index_path('R1001P', 1))))
+    del read_indexes[:]
+    IndexAggregatorTask().run()
+    read = sorted(read_indexes)
+    assert read_index() == full_index('r1')
+    assert read == [index_path('R1002P', 1), index_path('R1003P', 0)]
+    assert '1' not in read_index()['protocols']['r1']['subjects']['R1001P']['experiments']['FR1']['sessions']
+
+    del read_indexes[:]
+    IndexAggregatorTask().run()
+    assert read_indexes == []
+
+
+def test_nested_entries(db_root):
+    # The entry of a localization holds the entries of its montages
+    write_index(db_root, os.path.join('R1001P', 'localizations', '0'), {'localization': 0}, index_type='neuroradiology')
+    write_index(db_root, os.path.join('R1001P', 'localizations', '0', 'montages', '0'), {'montage': 0},
+                index_type='neuroradiology')
+    IndexAggregatorTask().run()
+    assert read_index() == full_index('r1')
+
+    write_index(db_root, os.path.join('R1001P', 'localizations', '0'), {'localization': 1},
+                processed='20170102.120000_processed', index_type='neuroradiology')
+    IndexAggregatorTask().run()
+    assert read_index() == full_index('r1')
+    localization = read_index()['protocols']['r1']['subjects']['R1001P']['localizations']['0']
+    assert localization['localization'] == 1 and localization['montages']['0']['montage'] == 0
+
+    os.unlink(os.path.join(db_root, 'protocols', 'r1', 'subjects', 'R1001P', 'localizations', '0', 'neuroradiology',
+                           'current_processed'))
+    IndexAggregatorTask().run()
+    assert read_index() == full_index('r1')
+    assert list(read_index()['protocols']['r1']['subjects']['R1001P']['localizations']['0']) == ['montages']
+
+
+def test_run_single_subject(db_root, read_indexes, monkeypatch):
+    IndexAggregatorTask().run_single_subject('R1001P', 'r1')
+    assert read_index() == full_index('r1')
+
+    searched = []
+    find_index_files = IndexAggregatorTask.find_index_files.__func__
+
+    def recording_find_index_files(cls, root_dir):
+        searched.append(os.path.relpath(root_dir, db_root))
+        return find_index_files(cls, root_dir)
+    monkeypatch.setattr(IndexAggregatorTask, 'find_index_files', classmethod(recording_find_index_files))
+
+    os.unlink(os.path.join(db_root, os.path.dirname(index_path('R1001P', 1))))
+    write_session_index(db_root, 'R1001P', 2)
+    # Changes to the indexes of other subjects are only picked up when their subject is aggregated
+    write_session_index(db_root, 'R1002P', 2)
+    del read_indexes[:]
+    IndexAggregatorTask().run_single_subject('R1001P', 'r1')
+    assert searched == [os.path.join('protocols', 'r1', 'subjects', 'R1001P')]
+    assert read_indexes == [index_path('R1001P', 2)]
+    sessions = read_index()['protocols']['r1']['subjects']['R1001P']['experiments']['FR1']['sessions']
+    assert sorted(sessions) == ['0', '2']
+    assert '2' not in read_index()['protocols']['r1']['subjects']['R1002P']['experiments']['FR1']['sessions']
+
+    IndexAggregatorTask().run_subjects(['R1002P'], 'r1')
+    assert read_index() == full_index('r1')
@@ -0,0 +1,65 @@
+import numpy as np
+
+from ..submission.parsers.base_log_parser import BaseLogParser
+from ..submission.viewers.recarray import to_json, from_json
+
+
+class ListLogParser(BaseLogParser):
+    """ Parses a list of (type, mstime) entries, without reading any files """
+
+    def __init__(self, contents):
+        self._contents = contents
+        self._fields = self._BASE_FIELDS
+        self._protocol, self._subject, self._montage, self._experiment, self._session = 'r1', 'R1001P', '0.0', 'FR1', 0
+        self._allow_unparsed_events = True
+        self._type_to_new_event = {'WORD': self.event_word, 'REC_START': self.event_word}
+        self._type_to_modify_events = {'REC_START': self.drop_words}
+
+    def _get_raw_event_type(self, raw_event):
+        return raw_event[0]
+
+    def event_word(self, raw_event):
+        event = self._empty_event
+        event.type, event.mstime = raw_event
+        return event
+
+    @staticmethod
+    def drop_words(events):
+        # Also modifies the seed event, which is removed from the parsed events
+        events[0].type = 'SEED'
+        return events[events.type != 'WORD']
+
+
+def test_parse():
+    events = ListLogParser([('WORD', 10), ('SKIP', 15), ('WORD', 20)]).parse()
+    assert events.shape == (2,)
+    assert list(events.type) == ['WORD', 'WORD'] and list(events.mstime) == [10, 20]
+    assert (events.subject == 'R1001P').all()
+
+
+def test_parse_without_events(tmpdir):
+    for contents in ([], [('SKIP', 10)]):
+        events = ListLogParser(contents).parse()
+        assert isinstance(events, np.recarray)
+        assert events.shape == (0,)
+        assert events.dtype == ListLogParser([])._empty_event.dtype
+
+        # The events file of the session is read back (e.g. to combine events) as empty events
+        events_file = str(tmpdir.join('task_events.json'))
+        with open(events_file, 'w') as f:
+            to_json(events, f)
+        read_events = from_json(events_file)
+        assert isinstance(read_events, np.recarray) and read_events.shape == (0,)
+
+
+def test_parse_when_only_seed_event_remains():
+    # A modify handler that drops all parsed events and modifies the seed event leaves only the seed event, which is
+    # not returned
+    parser = ListLogParser([('WORD', 10), ('WORD', 20)])
+    parser._type_to_modify_events = {'WORD': parser.drop_words}
+    events = parser.parse()
+    assert isinstance(events, np.recarray)
+    assert events.shape == (0,)
+
+    events = ListLogParser([('WORD', 10), ('REC_START', 20)]).parse()
+    assert list(events.type) == ['REC_START'] and list(events.mstime) == [20]
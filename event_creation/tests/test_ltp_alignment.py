@@ -0,0 +1,76 @@
+from __future__ import print_function
+
+import timeit
+
+import numpy as np
+import pytest
+
+from ..submission.alignment.LTPAligner import times_to_offsets, match_sequence
+
+
+def naive_match_sequence(needle, haystack, maxdiff):
+    """ Compares the needle with each window of the haystack in turn """
+    for i in range(len(haystack) - len(needle)):
+        if np.abs(haystack[i:i + len(needle)] - needle).max() < maxdiff:
+            return i
+    return None
+
+
+def naive_windows(behav_ms, ephys_ms, window, thresh_ms):
+    """ Searches for the start and end windows as times_to_offsets does, with naive_match_sequence """
+    s_ind = e_ind = None
+    for i in range(len(ephys_ms) - window):
+        s_ind = naive_match_sequence(np.diff(ephys_ms[i:i + window]), np.diff(behav_ms), thresh_ms)
+        if s_ind is not None:
+            break
+    for i in range(len(ephys_ms) - window):
+        e_ind = naive_match_sequence(np.diff(ephys_ms[::-1][i:i + window]), np.diff(behav_ms[::-1]), thresh_ms)
+        if e_ind is not None:
+            e_ind = len(behav_ms) - e_ind - window
+            break
+    return s_ind, e_ind
+
+
+def make_pulses(num_pulses, seed, jitter=3, drop_frac=.02, num_spurious=50):
+    """
+    Builds a behavioral pulse train with random 800-1200 ms intervals, and the ephys pulse train that records it with
+    clock drift, timing jitter, dropped pulses, and spurious pulses before and after the session
+    """
+    rng = np.random.RandomState(seed)
+    behav_ms = np.cumsum(rng.randint(800, 1200, num_pulses)) + 10 ** 12
+    ephys_ms = (behav_ms - behav_ms[0]) * 1.0001 + 5000 + rng.randint(-jitter, jitter + 1, num_pulses)
+    ephys_ms = ephys_ms[rng.rand(num_pulses) >= drop_frac]
+    before = -np.cumsum(rng.randint(800, 1200, num_spurious))[::-1] + ephys_ms[0]
+    after = np.cumsum(rng.randint(800, 1200, num_spurious)) + ephys_ms[-1]
+    return behav_ms, np.r_[before, ephys_ms, after].astype(int)
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('window', [5, 20, 100])
+def test_windows_match_naive(seed, window):
+    behav_ms, ephys_ms = make_pulses(1000, seed)
+    offsets, s_ind, e_ind = times_to_offsets(behav_ms, ephys_ms, behav_ms, 500, window=window, thresh_ms=10)
+    assert (s_ind, e_ind) == naive_windows(behav_ms, ephys_ms, window, 10)
+
+
+def test_match_sequence():
+    rng = np.random.RandomState(0)
+    haystack = rng.randint(0, 20, 500)
+    for start in range(0, 480, 7):
+        needle = haystack[start:start + 4] + rng.randint(-2, 3, 4)
+        assert match_sequence(needle, haystack, 3) == naive_match_sequence(needle, haystack, 3)
+    assert match_sequence(np.array([100, 100]), haystack, 3) is None
+
+
+def test_no_window():
+    behav_ms, ephys_ms = make_pulses(200, 0)
+    with pytest.raises(ValueError):
+        times_to_offsets(behav_ms, np.cumsum(np.ones(300, dtype=int) * 1000), behav_ms, 500)
+
+
+if __name__ == '__main__':
+    # Time the window search of a session with 3000 pulses, naive and indexed
+    behav_ms, ephys_ms = make_pulses(3000, 0)
+    naive = timeit.timeit(lambda: naive_windows(behav_ms, ephys_ms, 100, 10), number=1)
+    indexed = timeit.timeit(lambda: times_to_offsets(behav_ms, ephys_ms, behav_ms, 500), number=10) / 10
+    print('Original: {:.3f} s, indexed: {:.4f} s ({:.0f}x)'.format(naive, indexed, naive / indexed))
@@ -0,0 +1,129 @@
+import os
+from datetime import datetime
+from struct import pack
+
+import numpy as np
+import pytest
+
+from ..submission.readers.eeg_reader import NSx_reader
+from ..submission.readers.nsx_utility.brpylib import NsxFile, getdigfactor
+
+
+ELEC_IDS = [1, 2, 3, 129]
+
+
+def write_nsx(filename, packets, period=1):
+    """
+    Writes a minimal NSx 2.3 file
+    :param packets: List of (timestamp, int16 array of shape (samples, channels))
+    """
+    origin = datetime(2017, 1, 1)
+    basic = pack('<2BI16s256sII8HI', 2, 3, 0, b'raw', b'', period, 30000,
+                 origin.year, origin.month, 0, origin.day, 0, 0, 0, 0, len(ELEC_IDS))
+    # Front end channels (connectors < 5) share a scaling factor, analog inputs have their own
+    extended = b''.join(pack('<2sH16sBBhhhh16sIIHIIH', b'CC', elec_id, 'chan{}'.format(elec_id).encode(),
+                             1 if elec_id < 129 else 5, elec_id % 32, -32767, 32767,
+                             -8191 if elec_id < 129 else -5000, 8191 if elec_id < 129 else 5000,
+                             b'uV', 0, 0, 0, 0, 0, 0)
+                        for elec_id in ELEC_IDS)
+    bytes_in_header = 8 + len(basic) + len(extended)
+    basic = basic[:2] + pack('<I', bytes_in_header) + basic[6:]
+    with open(filename, 'wb') as nsx_file:
+        nsx_file.write(b'NEURALCD' + basic + extended)
+        for timestamp, data in packets:
+            nsx_file.write(pack('<BII', 1, timestamp, len(data)))
+            nsx_file.write(data.astype('<i2').tobytes())
+
+
+def random_packet(rng, samples):
+    return rng.randint(-1000, 1000, (samples, len(ELEC_IDS))).astype(np.int16)
+
+
+def scale(reader):
+    return np.array([getdigfactor(reader.extended_headers, i) for i in range(len(ELEC_IDS))], np.float32)[:, None]
+
+
+def getdata_channels(reader):
+    """
+    Reads every channel as NSx_reader did before reading data lazily: with getdata(), then, if the file has several
+    packets, again from the sample after the first packet
+    :return: The data, and the number of samples NSx_reader reported for it
+    """
+    data = reader.getdata()
+    headers = data['data_headers']
+    if len(headers) > 1:
+        pre_data_points = headers[0]['NumDataPoints']
+        data_actual = reader.getdata(start_time_s=float(pre_data_points + 1) / data['samp_per_s'])
+    else:
+        pre_data_points = -1
+        data_actual = data
+    data['data'][:, pre_data_points + 1:] = data_actual['data']
+    return data['data'], sum(header['NumDataPoints'] for header in headers) - pre_data_points
+
+
+@pytest.mark.parametrize('timestamp', [0, 40])
+def test_single_segment(tmpdir, timestamp):
+    packet = random_packet(np.random.RandomState(0), 500)
+    filename = str(tmpdir.join('single.ns2'))
+    write_nsx(filename, [(timestamp, packet)])
+    reader = NsxFile(filename)
+
+    data = reader.getelecdata(ELEC_IDS)
+    # Samples before the first packet are zeros
+    assert np.allclose(data, np.c_[np.zeros((len(ELEC_IDS), timestamp)), packet.T * scale(reader)])
+    assert np.array_equal(reader.getelecdata([2, 129]), data[[1, 3]])
+    assert np.array_equal(reader.getelecdata([3], 100, 250), data[2:3, 100:250])
+    assert reader.getnumsamples() == data.shape[1]
+    if timestamp == 0:
+        # Under Python 2, getdata() leaves a first packet that starts after the beginning of the file as zeros
+        assert np.array_equal(data, reader.getdata()['data'])
+        assert np.array_equal(reader.getelecdata([2, 129]), reader.getdata([2, 129])['data'])
+
+
+def test_multi_segment_overlap(tmpdir):
+    # A second NSP clock sync starts a new packet that goes back in time, overlapping the end of the first
+    rng = np.random.RandomState(1)
+    first, synced = random_packet(rng, 300), random_packet(rng, 400)
+    filename = str(tmpdir.join('multi.ns2'))
+    write_nsx(filename, [(0, first), (200, synced)])
+    reader = NsxFile(filename)
+
+    data = reader.getelecdata(ELEC_IDS)
+    # Samples before the sync come from the first packet; from the sync on, the synced packet replaces them
+    assert data.shape == (len(ELEC_IDS), 600)
+    assert np.allclose(data[:, :200], first[:200].T * scale(reader))
+    assert np.allclose(data[:, 200:], synced.T * scale(reader))
+    assert np.array_equal(reader.getelecdata([129], 150, 250), data[3:, 150:250])
+    # The headers are those of getdata(), which lists the synced packet twice
+    headers = reader.getdataheaders()
+    for header in headers:
+        del header['DataOffset']
+    assert headers == reader.getdata()['data_headers']
+
+
+def test_nsx_reader_multi_segment(tmpdir):
+    # A 1000 Hz recording, in which the clocks are synced 200 samples in
+    period = NSx_reader.TIC_RATE // 1000
+    rng = np.random.RandomState(2)
+    first, synced = random_packet(rng, 300), random_packet(rng, 400)
+    filename = str(tmpdir.join('multi.ns2'))
+    write_nsx(filename, [(0, first), (200 * period, synced)], period)
+    nsx_reader = NSx_reader(filename)
+    nsx_reader.jacksheet = dict((elec_id, 'E{}'.format(elec_id)) for elec_id in ELEC_IDS)
+
+    expected, n_samples = getdata_channels(NsxFile(filename))
+    # The samples from the sync up to the re-read are the only ones that differ. They are read from the synced
+    # packet; under Python 2, getdata() left the samples of the first packet there, followed by a zero.
+    expected[:, 200:301] = synced[:101].T * scale(nsx_reader.nsx_info['reader'])
+    assert nsx_reader.get_n_samples() == n_samples
+    for i, elec_id in enumerate(ELEC_IDS):
+        assert np.array_equal(nsx_reader.channel_data(elec_id), expected[i:i + 1])
+
+    location = str(tmpdir.mkdir('noreref'))
+    nsx_reader._split_data(location, 'multi')
+    assert sorted(os.listdir(location)) == sorted('multi.{:03d}'.format(elec_id) for elec_id in ELEC_IDS)
+    for i, elec_id in enumerate(ELEC_IDS):
+        # Each channel is preceded by one copy of its first sample per sample before the sync
+        split = np.fromfile(os.path.join(location, 'multi.{:03d}'.format(elec_id)), 'int16')
+        channel = expected[i].astype('int16')
+        assert np.array_equal(split, np.r_[np.ones(200, 'int16') * channel[0], channel])
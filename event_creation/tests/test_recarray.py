@@ -0,0 +1,105 @@
+import io
+import json
+import timeit
+
+import numpy as np
+import pytest
+
+from ..submission.viewers import recarray
+from ..submission.viewers.recarray import to_npy, from_npy, to_dict, to_json, from_dict, MyEncoder
+
+
+STIM_DTYPE = [('amplitude', 'f4'), ('anode_label', 'S64'), ('stim_on', 'b1'), ('_remove', 'b1')]
+EVENT_DTYPE = [('type', 'S64'), ('mstime', 'i8'), ('eegoffset', 'i8'),
+               ('stim_params', STIM_DTYPE, (2,)), ('_remove', 'b1')]
+
+
+def make_events(n=5):
+    events = np.zeros(n, EVENT_DTYPE).view(np.recarray)
+    events.type = np.resize(['WORD', 'REC_WORD', 'STIM', 'WORD', 'REC_START'], n)
+    events.mstime = np.arange(n) * 1000
+    events.eegoffset = np.arange(n) * 500
+    events.stim_params.amplitude[:, 0] = np.arange(n) / 4.
+    events.stim_params.anode_label[:, 0] = 'LA1'
+    events.stim_params._remove[:, 1] = True
+    events._remove[1::3] = True
+    return events
+
+
+def record_json(events):
+    """ Serializes the dicts of to_dict, built one record at a time """
+    return json.dumps(to_dict(events), cls=MyEncoder, indent=2, sort_keys=True)
+
+
+def test_json_matches_records():
+    events = make_events(20)
+    assert to_json(events) == record_json(events)
+    assert json.loads(to_json(events, compact=True)) == json.loads(record_json(events))
+    assert to_json(events[:0]) == record_json(events[:0])
+
+
+def record_from_dict(d, dtypes=None):
+    """ Loads the dicts with copy_values, one record at a time, by making fill_columns fail """
+    def fail(*_):
+        raise TypeError()
+    fill_columns = recarray.fill_columns
+    recarray.fill_columns = fail
+    try:
+        return from_dict(d, dtypes)
+    finally:
+        recarray.fill_columns = fill_columns
+
+
+def assert_same_array(a, b):
+    assert a.dtype == b.dtype
+    assert a.tobytes() == b.tobytes()
+
+
+def test_from_dict_matches_records():
+    d = json.loads(to_json(make_events(20)))
+    d[2]['type'] = u'caf\xe9'
+    d[3]['nested'] = {'value': 1.5, 'label': 'x'}
+    for entry in d:
+        entry.setdefault('nested', {'value': 0.5, 'label': 'y'})
+    del d[5]['eegoffset']
+    events = from_dict(d)
+    assert_same_array(events, record_from_dict(d))
+    assert events[2].type == 'cafe'
+
+
+def test_from_dict_with_dtypes_matches_records():
+    d = json.loads(to_json(make_events(20)))
+    # As in EventCombiner: a wider stim_params field than any list in the dicts, and a field missing from them
+    dtypes = EVENT_DTYPE[:3] + [('stim_params', STIM_DTYPE[:-1], (10,)), ('extra', 'f8')]
+    assert_same_array(from_dict(d, dtypes), record_from_dict(d, dtypes))
+
+
+def test_from_dict_raises_unexpected_errors(monkeypatch):
+    def fail(*_):
+        raise KeyError('type')
+    monkeypatch.setattr(recarray, 'fill_columns', fail)
+    with pytest.raises(KeyError):
+        from_dict(json.loads(to_json(make_events())))
+
+
+def test_npy_round_trip():
+    events = make_events()
+    loaded = from_npy(io.BytesIO(to_npy(events)))
+
+    assert '_remove' not in loaded.dtype.names
+    assert loaded.dtype['stim_params'] == events.dtype['stim_params']
+    assert len(loaded) == (events._remove == 0).sum()
+    assert to_dict(loaded) == to_dict(events)
+
+
+def test_npy_empty_events():
+    loaded = from_npy(io.BytesIO(to_npy(np.zeros((), EVENT_DTYPE).view(np.recarray))))
+    assert len(loaded) == 0
+
+
+if __name__ == '__main__':
+    # Time loading a 20000-event session, one record at a time and one field at a time
+    d = json.loads(to_json(make_events(20000)))
+    by_record = timeit.timeit(lambda: record_from_dict(d), number=1)
+    by_field = timeit.timeit(lambda: from_dict(d), number=1)
+    print('from_dict by record: {:.3f} s, by field: {:.3f} s ({:.1f}x)'.format(by_record, by_field, by_record / by_field))
@@ -0,0 +1,50 @@
+import os
+import pickle
+
+import pytest
+
+from ..submission.automation import run_by_subject, ImporterStatus
+
+
+def run_item(item):
+    return item, os.getpid()
+
+
+def interrupt_last(item):
+    if item == 'last':
+        raise KeyboardInterrupt()
+    return item
+
+
+def test_run_by_subject():
+    subjects = ['R1001P', 'R1002P', 'R1001P', 'R1003P', 'R1002P', 'R1001P']
+    items = ['{}_{}'.format(subject, i) for i, subject in enumerate(subjects)]
+
+    serial = list(run_by_subject(run_item, items, subjects, n_workers=0))
+    assert [i for i, _ in serial] == list(range(len(items)))
+    assert [item for _, (item, _) in serial] == items
+    assert set(pid for _, (_, pid) in serial) == {os.getpid()}
+
+    parallel = dict(run_by_subject(run_item, items, subjects, n_workers=3))
+    assert [parallel[i][0] for i in range(len(items))] == items
+    for subject in set(subjects):
+        # Each subject's items are run in a single worker process
+        pids = set(parallel[i][1] for i, item_subject in enumerate(subjects) if item_subject == subject)
+        assert len(pids) == 1 and os.getpid() not in pids
+
+
+def test_results_kept_when_interrupted():
+    results = []
+    with pytest.raises(KeyboardInterrupt):
+        for _, value in run_by_subject(interrupt_last, ['first', 'second', 'last'], ['R1001P', 'R1002P', 'R1003P'],
+                                       n_workers=0):
+            results.append(value)
+    assert results == ['first', 'second']
+
+
+def test_status_pickles():
+    status = ImporterStatus('Events Builder', dict(subject='R1001P', experiment='FR1', session=0))
+    status.set_error('processing', 'bad events')
+    loaded = pickle.loads(pickle.dumps(status))
+    assert loaded.describe() == status.describe()
+    assert 'bad events' in loaded.describe_errors()
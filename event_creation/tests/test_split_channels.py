@@ -0,0 +1,235 @@
+import json
+import os
+import time
+from struct import pack
+
+import numpy as np
+import pytest
+import tables
+
+from ..submission.configuration import config
+from ..submission.readers.eeg_reader import ChannelWriter, EEG_reader, HD5_reader, NK_reader, EDF_reader, EGI_reader, \
+    BDF_reader
+
+
+N_SAMPLES = 1000
+# Smaller than (and not a divisor of) N_SAMPLES, so that recordings are split in several blocks, the last one partial
+BLOCK_SAMPLES = 300
+BASENAME = 'R1001P_01Jan17_1200'
+
+
+@pytest.fixture(params=[1, 8], ids=['serial', 'threaded'])
+def writer_threads(request, monkeypatch):
+    monkeypatch.setitem(config.options, 'split_writer_threads', request.param)
+    monkeypatch.setattr(EEG_reader, 'SPLIT_BLOCK_SAMPLES', BLOCK_SAMPLES)
+    return request.param
+
+
+def assert_split_files(location, expected):
+    """
+    :param expected: Mapping of the extension of each channel file -> the data the original implementation wrote to it
+    """
+    assert sorted(os.listdir(location)) == sorted(BASENAME + '.' + extension for extension in expected)
+    for extension, data in expected.items():
+        split = np.fromfile(os.path.join(location, BASENAME + '.' + extension), data.dtype)
+        assert np.array_equal(split, data.flatten()), extension
+
+
+class DelayedBlock(object):
+    """ Writes its data after a delay, so that writes to the same file could finish out of order if not serialized """
+
+    def __init__(self, data, delay):
+        self.data = data
+        self.delay = delay
+
+    def tofile(self, f):
+        time.sleep(self.delay)
+        self.data.tofile(f)
+
+
+@pytest.mark.parametrize('n_threads', [1, 8])
+def test_channel_writer_appends_in_order(tmpdir, n_threads):
+    rng = np.random.RandomState(0)
+    filenames = [str(tmpdir.join('channel.{:03d}'.format(i))) for i in range(10)]
+    # The first write to a file replaces any previous contents
+    with open(filenames[0], 'wb') as stale_file:
+        stale_file.write(b'stale')
+    blocks = dict((filename, [rng.randint(-1000, 1000, rng.randint(0, 50)).astype('int16') for _ in range(20)])
+                  for filename in filenames)
+    with ChannelWriter(n_threads) as writer:
+        for i in range(20):
+            for filename in filenames:
+                writer.write(filename, DelayedBlock(blocks[filename][i], rng.uniform(0, 0.002)))
+            if i % 7 == 0:
+                writer.wait()
+    for filename in filenames:
+        assert np.array_equal(np.fromfile(filename, 'int16'), np.concatenate(blocks[filename]))
+
+
+def test_channel_writer_options(monkeypatch):
+    writer = EEG_reader().channel_writer()
+    assert writer._pool is None and not writer._fsync
+    monkeypatch.setitem(config.options, 'split_writer_threads', 4)
+    monkeypatch.setitem(config.options, 'fsync_split_files', True)
+    writer = EEG_reader().channel_writer()
+    try:
+        assert writer._pool is not None and writer._fsync
+    finally:
+        writer.close()
+
+
+@pytest.mark.parametrize('n_threads', [1, 8])
+def test_channel_writer_raises_write_errors(tmpdir, n_threads):
+    with pytest.raises(IOError):
+        with ChannelWriter(n_threads) as writer:
+            writer.write(str(tmpdir.join('channel.001')), np.zeros(10, 'int16'))
+            writer.write(str(tmpdir.join('missing', 'channel.002')), np.zeros(10, 'int16'))
+
+
+def write_nk(filename, waveform, chan_nums, ad_off):
+    """
+    Writes a minimal (old format) Nihon Kohden .EEG file, recorded at 1000 Hz
+    :param waveform: int16 array of shape (samples, channels + 1), with a column for each recorded channel followed by
+                     the marks
+    :param chan_nums: The number (in the .21E file) of each recorded channel
+    """
+    eeg1_address = 128
+    eeg2_address = eeg1_address + 38
+    waveform_address = eeg2_address + 38
+    header = b'\0' * eeg1_address
+    header += pack('<B16sBi16s', 0, b'EEG-1100A', 1, eeg2_address, b'')
+    header += pack('<B16sBi16s', 0, b'', 1, waveform_address, b'')
+    header += pack('<B16sBBB6BHIhHBBB', 0, b'', 0, 2, 0, 0x17, 0x01, 0x01, 0x12, 0, 0, 0xC3E8, len(waveform) // 100,
+                   ad_off, 100, 16, 0, len(chan_nums))
+    header += b''.join(pack('<h6xBB', chan_num, 0, 1) for chan_num in chan_nums)
+    with open(filename, 'wb') as eeg_file:
+        eeg_file.write(header)
+        eeg_file.write(waveform.astype('<i2').tobytes())
+
+
+@pytest.fixture
+def nk_reader(tmpdir):
+    labels = ['LA1', 'LA2', 'LA3', 'LA4', 'LA5']
+    with open(str(tmpdir.join('recording.21E')), 'w') as elec_file:
+        elec_file.write('[ELECTRODE]\n' + ''.join('{}={}\n'.format(i, label) for i, label in enumerate(labels)) +
+                        '[SD_DEF]\n')
+    waveform = np.random.RandomState(0).randint(-1000, 1000, (N_SAMPLES, len(labels) + 1)).astype('int16')
+    # Channels are recorded out of order, and LA5 is recorded but not in the jacksheet
+    write_nk(str(tmpdir.join('recording.EEG')), waveform, [2, 0, 4, 1, 3], -3)
+    reader = NK_reader(str(tmpdir.join('recording.EEG')))
+    reader.jacksheet = {'LA1': 1, 'LA2': 2, 'LA3': 3, 'LA4': 4}
+    # Each channel in the jacksheet gets its recorded column, offset by the AD offset
+    expected = dict(('{:03d}'.format(channel), (waveform[:, column] - 3).astype('int16'))
+                    for channel, column in ((1, 1), (2, 3), (3, 0), (4, 4)))
+    return reader, expected
+
+
+@pytest.mark.parametrize('stream_split', [True, False], ids=['streamed', 'whole'])
+def test_nk_split(tmpdir, nk_reader, writer_threads, stream_split, monkeypatch):
+    monkeypatch.setattr(NK_reader, 'STREAM_SPLIT', stream_split)
+    reader, expected = nk_reader
+    location = str(tmpdir.mkdir('noreref'))
+    reader._split_data(location, BASENAME)
+    assert reader.sample_rate == 1000 and reader.num_samples == N_SAMPLES
+    assert_split_files(location, expected)
+
+
+@pytest.mark.parametrize('by_row', [False, True], ids=['by_column', 'by_row'])
+@pytest.mark.parametrize('transformed', [False, True], ids=['monopolar', 'bipolar_to_monopolar'])
+def test_hd5_split(tmpdir, writer_threads, by_row, transformed):
+    rng = np.random.RandomState(0)
+    ports = np.array([1, 2, 3, 10])
+    timeseries = rng.randint(-1000, 1000, (len(ports), N_SAMPLES)).astype('int16')
+    transform = rng.randint(-1, 2, (len(ports), len(ports))).astype('float64')
+    config_filename = str(tmpdir.join('experiment_config.json'))
+    with open(config_filename, 'w') as config_file:
+        json.dump({'global_settings': {'sampling_rate': 1000}}, config_file)
+    hd5_filename = str(tmpdir.join('eeg_timeseries.h5'))
+    with tables.open_file(hd5_filename, 'w') as h5file:
+        h5file.create_array('/', 'timeseries', timeseries.T if by_row else timeseries)
+        if by_row:
+            h5file.root.timeseries.attrs['orient'] = 'row'
+        h5file.create_array('/', 'ports', ports)
+        h5file.create_array('/', 'names', np.array(['LA1', 'LA2', 'LA3', 'LB1']))
+        if transformed:
+            h5file.create_array('/', 'bipolar_to_monopolar_matrix', transform)
+
+    # Each port gets its row of the timeseries, transformed to monopolar if the file has the transform
+    if transformed:
+        timeseries = np.dot(transform, timeseries).astype('int16')
+    expected = dict(('{:03d}'.format(port), timeseries[i]) for i, port in enumerate(ports))
+
+    reader = HD5_reader(hd5_filename, config_filename)
+    location = str(tmpdir.mkdir('noreref'))
+    try:
+        reader._split_data(location, BASENAME)
+        assert reader.get_n_samples() == N_SAMPLES
+    finally:
+        reader.h5file.close()
+    assert_split_files(location, expected)
+
+
+class FakeEdfReader(object):
+    """ Stands in for pyedflib.EdfReader """
+
+    def __init__(self, signals):
+        self.signals = signals
+
+    def readSignal(self, channel):
+        return self.signals[channel]
+
+
+def test_edf_split(tmpdir, writer_threads):
+    rng = np.random.RandomState(0)
+    labels = ['LA1', 'LA2', 'LA02', 'EKG', 'LB1']
+    reader = EDF_reader.__new__(EDF_reader)
+    reader.raw_filename = str(tmpdir.join('recording.edf'))
+    reader.reader = FakeEdfReader([rng.uniform(-1000, 1000, N_SAMPLES) for _ in labels])
+    reader.headers = dict((i, {'label': label, 'sample_rate': 1000}) for i, label in enumerate(labels))
+    reader.channel_map = {}
+    # LA02 matches LA2, which has already been split, and EKG is not in the jacksheet
+    reader.jacksheet = {'LA1': 1, 'LA2': 2, 'LB1': 9}
+    expected = dict(('{:03d}'.format(channel), reader.reader.signals[i].astype('int16'))
+                    for i, channel in ((0, 1), (1, 2), (4, 9)))
+
+    location = str(tmpdir.mkdir('noreref'))
+    reader._split_data(location, BASENAME)
+    assert_split_files(location, expected)
+
+
+def test_egi_split(tmpdir, writer_threads):
+    rng = np.random.RandomState(0)
+    reader = EGI_reader(str(tmpdir.join('recording.raw.bz2')))
+    reader.sample_rate = 500
+    reader.chans = [{'kind': 2, 'ch_name': 'E{:03d}'.format(i)} for i in range(1, 5)] + [{'kind': 3, 'ch_name': 'DIN1'}]
+    # Some values are out of the range of float16, and are clipped
+    reader.data = rng.uniform(-1e5, 1e5, (len(reader.chans), N_SAMPLES))
+    data = reader.data.clip(np.finfo('float16').min, np.finfo('float16').max).astype('float16')
+    expected = dict(('{:03d}'.format(i + 1), data[i]) for i in range(4))
+    expected['DIN1'] = data[4]
+
+    location = str(tmpdir.mkdir('noreref'))
+    reader._split_data(location, BASENAME)
+    os.remove(os.path.join(location, 'params.txt'))
+    os.remove(os.path.join(location, BASENAME + '.params.txt'))
+    assert_split_files(location, expected)
+
+
+def test_bdf_split(tmpdir, writer_threads):
+    rng = np.random.RandomState(0)
+    reader = BDF_reader(str(tmpdir.join('recording.bdf')))
+    reader.sample_rate = 2048
+    reader.names = ['A{}'.format(i) for i in range(1, 129)] + ['EXG{}'.format(i) for i in range(1, 9)] + ['Status']
+    reader.data = rng.uniform(-1e5, 1e5, (len(reader.names), N_SAMPLES))
+    reader.data[-1] = rng.choice([7, 15, 65543, 65551], N_SAMPLES)
+    reader.sync_nums = np.array([15, 65551])
+    # Only channels up to EXG4 are split, followed by the sync pulses
+    data = reader.data.clip(np.finfo('float16').min, np.finfo('float16').max).astype('float16')
+    expected = dict((name, data[i]) for i, name in enumerate(reader.names[:132]))
+    expected['Status'] = np.in1d(reader.data[-1], reader.sync_nums).astype('float16')
+
+    location = str(tmpdir.mkdir('noreref'))
+    reader._split_data(location, BASENAME)
+    os.remove(os.path.join(location, 'params.txt'))
+    os.remove(os.path.join(location, BASENAME + '.params.txt'))
+    assert_split_files(location, expected)
@@ -0,0 +1,120 @@
+import numpy as np
+import pytest
+
+from ..submission.alignment.system1 import System1Aligner, PulseIntervalIndex
+from ..submission.exc import AlignmentError
+
+
+DELTA = System1Aligner.ALIGNMENT_THRESHOLD
+
+
+def scan_best_offset(eeg_diff, task_diff, delta):
+    """ Matches the window by comparing each of its intervals against every task interval """
+    ind = np.where(abs(task_diff - eeg_diff[0]) < delta)
+    for i, this_eeg_diff in enumerate(eeg_diff):
+        ind = np.intersect1d(ind, np.where(abs(task_diff - this_eeg_diff) < delta)[0] - i)
+        if len(ind) == 0:
+            return None
+    if len(ind) > 1:
+        raise AlignmentError("Multiple matching windows. Lower threshold or increase window.")
+    return ind[0]
+
+
+def scan_matching_window(eeg_diff, task_diff, from_front=True, alignment_window=None):
+    """ find_matching_window, looking up every window with scan_best_offset """
+    if alignment_window is None:
+        alignment_window = System1Aligner.STARTING_ALIGNMENT_WINDOW
+    task_start_ind = eeg_start_ind = None
+    start_i = 0 if from_front else len(eeg_diff) - alignment_window
+    end_i = len(eeg_diff) - alignment_window if from_front else 0
+    for i in range(start_i, end_i, 1 if from_front else -1):
+        task_start_ind = scan_best_offset(eeg_diff[i:i + alignment_window], task_diff, DELTA)
+        if task_start_ind:
+            eeg_start_ind = i
+            break
+    if not task_start_ind:
+        if alignment_window - System1Aligner.ALIGNMENT_WINDOW_STEP < System1Aligner.MIN_ALIGNMENT_WINDOW:
+            raise AlignmentError("Could not align window")
+        return scan_matching_window(eeg_diff, task_diff, from_front,
+                                    alignment_window - System1Aligner.ALIGNMENT_WINDOW_STEP)
+    return (task_start_ind, task_start_ind + alignment_window), (eeg_start_ind, eeg_start_ind + alignment_window)
+
+
+def outcome(function, *args, **kwargs):
+    """ The result of the call, or the message of the AlignmentError it raised """
+    try:
+        return function(*args, **kwargs)
+    except AlignmentError as e:
+        return str(e)
+
+
+def make_pulses(rng, num_pulses, drop_frac=.02, num_spurious=20):
+    """
+    Builds the task pulse times of a session, and the eeg pulse times that record them with clock drift, jitter,
+    dropped pulses, and spurious pulses before and after the session. As for pulses received in samples and converted
+    to ms, the eeg intervals are not whole numbers of ms.
+    """
+    task_ms = np.cumsum(rng.randint(800, 1200, num_pulses)).astype(float) + 10 ** 12
+    eeg_ms = (task_ms - task_ms[0]) * 1.00005 + 3000 + rng.uniform(-3, 3, num_pulses)
+    eeg_ms = eeg_ms[rng.rand(num_pulses) >= drop_frac]
+    before = eeg_ms[0] - np.cumsum(rng.uniform(800, 1200, num_spurious))[::-1]
+    after = eeg_ms[-1] + np.cumsum(rng.uniform(800, 1200, num_spurious))
+    return task_ms, np.r_[before, eeg_ms, after]
+
+
+def assert_windows_match_scan(eeg_diff, task_diff):
+    task_index = PulseIntervalIndex(task_diff, DELTA)
+    for from_front in (True, False):
+        expected = outcome(scan_matching_window, eeg_diff, task_diff, from_front)
+        assert outcome(System1Aligner.find_matching_window, eeg_diff, task_diff, from_front) == expected
+        assert outcome(System1Aligner.find_matching_window, eeg_diff, task_diff, from_front,
+                       task_index=task_index) == expected
+    return expected
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('drop_frac', [0, .02, .05])
+def test_windows_match_scan(seed, drop_frac):
+    task_ms, eeg_ms = make_pulses(np.random.RandomState(seed), 300, drop_frac)
+    assert_windows_match_scan(np.diff(eeg_ms), np.diff(task_ms))
+
+
+def test_window_shrinking():
+    rng = np.random.RandomState(0)
+    task_ms, eeg_ms = make_pulses(rng, 300, 0)
+    # Every 40th pulse is dropped, so that only windows of at most 40 intervals can match
+    eeg_ms = np.delete(eeg_ms, np.arange(30, len(eeg_ms), 40))
+    (task_start, task_end), _ = assert_windows_match_scan(np.diff(eeg_ms), np.diff(task_ms))
+    assert task_end - task_start == 30
+
+
+def test_multiple_matching_windows():
+    task_diff = np.tile([1000., 1200., 900.], 100)
+    eeg_diff = task_diff[:150] + np.random.RandomState(0).uniform(-3, 3, 150)
+    assert assert_windows_match_scan(eeg_diff, task_diff) == \
+        'Multiple matching windows. Lower threshold or increase window.'
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_best_offset_matches_scan(seed):
+    rng = np.random.RandomState(seed)
+    # Few distinct intervals, so that windows match in several places until they have grown long enough
+    task_diff = rng.choice([1000., 1010., 1025.], 200)
+    task_index = PulseIntervalIndex(task_diff, DELTA)
+    for start in range(0, 200, 3):
+        for length in (1, 2, 5, 20):
+            # Windows near the end of task_diff run past it, and can only match elsewhere
+            eeg_diff = task_diff[start:start + length]
+            eeg_diff = np.r_[eeg_diff + rng.uniform(-DELTA, DELTA, len(eeg_diff)), task_diff[:length - len(eeg_diff)]]
+            expected = outcome(scan_best_offset, eeg_diff, task_diff, DELTA)
+            assert outcome(System1Aligner.get_best_offset, eeg_diff, task_diff, DELTA) == expected
+            assert outcome(System1Aligner.get_best_offset, eeg_diff, task_diff, DELTA, task_index) == expected
+
+
+def test_positions_at_bin_edges():
+    # Intervals at, and within rounding of, the edges of the bins and of the threshold around them
+    edges = np.arange(90, 110) * float(DELTA)
+    task_diff = np.concatenate([edges + offset for offset in (-1e-9, 0, 1e-9, DELTA / 2.)])
+    task_index = PulseIntervalIndex(task_diff, DELTA)
+    for interval in np.concatenate([task_diff + offset for offset in (-DELTA, -DELTA + 1e-9, DELTA - 1e-9, DELTA)]):
+        assert np.array_equal(task_index.positions(interval), np.where(abs(task_diff - interval) < DELTA)[0])
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from ..submission.parsers.base_log_parser import BaseSessionLogParser
+from ..submission.parsers.system2_log_parser import System2LogParser
+
+
+EVENT_TEMPLATE = (
+    ('type', '', 'S20'),
+    ('mstime', -1, 'int64'),
+    ('list', -999, 'int16'),
+    ('serialpos', -999, 'int16'),
+    ('is_stim', False, 'b1'),
+) + System2LogParser.stim_params_template()
+
+
+def persistent_fields(event):
+    return ('list',)
+
+
+def stim_event_to_mstime(stim_params):
+    # Half of the host times map to fractional mstimes, which are truncated when stored in the events
+    return stim_params['hosttime'][0] * 0.5
+
+
+class StimEventsParser(System2LogParser):
+    """ A System2LogParser with only stim events, which are set directly rather than read from the host logs """
+
+    def __init__(self, stim_events):
+        self._stim_events = stim_events
+
+
+def make_parser(rng, n_stims):
+    stim_events = BaseSessionLogParser.events_from_template(System2LogParser.stim_params_template(), n_stims)
+    for i in range(n_stims):
+        stim_params = stim_events[i, ...].stim_params
+        stim_params['hosttime'][0] = rng.randint(-4, 64)
+        stim_params['n_pulses'][0] = rng.choice([1, 50])
+        stim_params['stim_duration'][0] = rng.randint(0, 12)
+        stim_params['stim_on'][0] = True
+        stim_params['file_index'][0] = i
+    return StimEventsParser(stim_events.view(np.ndarray))
+
+
+def make_events(rng, n_events):
+    events = BaseSessionLogParser.events_from_template(EVENT_TEMPLATE, n_events)
+    events.type = 'WORD'
+    events.mstime = np.sort(rng.randint(0, 30, n_events))
+    events.list = np.arange(n_events) // 4
+    events.serialpos = np.arange(n_events)
+    return events
+
+
+@pytest.mark.parametrize('seed', range(300))
+def test_sorted_merge_matches_unsorted_merge(seed):
+    rng = np.random.RandomState(seed)
+    events = make_events(rng, rng.randint(0, 30))
+    parser = make_parser(rng, rng.randint(1, 10))
+
+    expected = parser._merge_unsorted_events(events.copy(), EVENT_TEMPLATE, stim_event_to_mstime, persistent_fields)
+    merged = parser._merge_sorted_events(events.copy(), EVENT_TEMPLATE, stim_event_to_mstime, persistent_fields)
+
+    assert merged.dtype == expected.dtype
+    for field in merged.dtype.names:
+        if field == 'stim_params':
+            for stim_field in merged[field].dtype.names:
+                assert np.array_equal(merged[field][stim_field], expected[field][stim_field]), stim_field
+        else:
+            assert np.array_equal(merged[field], expected[field]), field
@@ -0,0 +1,37 @@
+import hashlib
+import os
+
+from ..submission.transfer_config import TransferConfig, TransferFile, ChecksumCache
+
+
+def test_checksum_in_blocks(make_transfer_file, monkeypatch):
+    transfer_file = make_transfer_file()
+    expected = hashlib.md5(''.join(open(path, 'rb').read() for path in transfer_file.origin_paths)).hexdigest()
+    monkeypatch.setattr(TransferFile, 'CHECKSUM_BLOCK_SIZE', 1000)
+    assert transfer_file.checksum.hexdigest() == expected
+
+
+def test_cached_checksum(origin_dir, make_transfer_file):
+    cache_filename = os.path.join(origin_dir, 'checksum_cache.json')
+    cache = ChecksumCache(cache_filename)
+    expected = make_transfer_file(cache).checksum.hexdigest()
+    cache.save()
+
+    cached = make_transfer_file(ChecksumCache(cache_filename))
+    cached.contents_to_check = None
+    assert cached.checksum.hexdigest() == expected
+
+    with open(cached.origin_paths[0], 'ab') as origin_file:
+        origin_file.write('changed')
+    assert make_transfer_file(ChecksumCache(cache_filename)).checksum.hexdigest() != expected
+
+
+def test_threaded_checksums(make_transfer_file):
+    transfer_config = TransferConfig.__new__(TransferConfig)
+    transfer_config.timings = {}
+    files = [make_transfer_file() for _ in range(4)]
+    transfer_config.n_threads = 1
+    expected = transfer_config.calculate_checksums(files)
+    transfer_config.n_threads = 4
+    assert transfer_config.calculate_checksums([make_transfer_file() for _ in range(4)]) == expected
+    assert set(transfer_config.timings['raw_eeg']) == {'checksum'}
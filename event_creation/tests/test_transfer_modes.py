@@ -0,0 +1,47 @@
+import os
+
+from ..submission import fileutil
+
+
+def transferred_inodes(transfer_file):
+    return [os.stat(filename).st_ino for filename in transfer_file.transferred_filenames()['raw_eeg']]
+
+
+def test_hardlink_transfer(make_transfer_file, tmpdir):
+    transfer_file = make_transfer_file()
+    transfer_file.transfer(str(tmpdir.join('transferred')), 'hardlink')
+    assert transferred_inodes(transfer_file) == [os.stat(path).st_ino for path in transfer_file.origin_paths]
+
+
+def test_reflink_falls_back_to_copy(make_transfer_file, tmpdir, monkeypatch):
+    def unsupported(source, destination):
+        raise IOError('Not supported')
+    monkeypatch.setattr(fileutil, 'reflink', unsupported)
+
+    transfer_file = make_transfer_file()
+    transfer_file.transfer(str(tmpdir.join('transferred')), 'reflink')
+    for origin, transferred in zip(transfer_file.origin_paths, transfer_file.transferred_filenames()['raw_eeg']):
+        assert open(origin, 'rb').read() == open(transferred, 'rb').read()
+        assert os.stat(origin).st_ino != os.stat(transferred).st_ino
+
+
+def test_reuse_previous_transfer(origin_dir, make_transfer_file, tmpdir):
+    previous_root = str(tmpdir.join('previous'))
+    previous = make_transfer_file()
+    previous.transfer(previous_root)
+    previous_index = previous.transferred_index()
+    previous_inodes = transferred_inodes(previous)
+
+    unchanged = make_transfer_file()
+    unchanged.transfer(str(tmpdir.join('unchanged')), 'hardlink', previous_root, previous_index)
+    assert transferred_inodes(unchanged) == previous_inodes
+
+    copied = make_transfer_file()
+    copied.transfer(str(tmpdir.join('copied')), 'copy', previous_root, previous_index)
+    assert not set(transferred_inodes(copied)) & set(previous_inodes)
+
+    with open(os.path.join(origin_dir, 'raw_0.ns2'), 'ab') as origin_file:
+        origin_file.write('changed')
+    changed = make_transfer_file()
+    changed.transfer(str(tmpdir.join('changed')), 'hardlink', previous_root, previous_index)
+    assert transferred_inodes(changed) == [os.stat(path).st_ino for path in changed.origin_paths]